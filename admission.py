@@ -0,0 +1,202 @@
+# admission.py
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import ADMISSION_REJECTIONS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Admission configuration
+ADMISSION_MAX_QUEUE = 8
+ADMISSION_QUEUE_TIMEOUT = 60
+ADMISSION_MEMORY_LIMIT_MB = 4096
+ADMISSION_MEMORY_POLL_SECONDS = 0.5
+ADMISSION_RSS_CACHE_SECONDS = 1.0
+DEFAULT_RETRY_AFTER = 5
+
+
+class AdmissionRejected(Exception):
+    """Raised when a capture cannot be admitted; status is 429 (queue full) or 503 (timed out / memory)"""
+
+    def __init__(self, message, status=429, retry_after=DEFAULT_RETRY_AFTER, reason="queue_full"):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def descendant_pids(root_pid=None):
+    """PIDs of every process below root_pid (this process by default), read from /proc"""
+    root_pid = root_pid or os.getpid()
+    children = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, so parse after its closing parenthesis
+        fields = stat[stat.rfind(")") + 2:].split()
+        children.setdefault(int(fields[1]), []).append(int(entry))
+
+    pids = []
+    stack = [root_pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            pids.append(child)
+            stack.append(child)
+    return pids
+
+
+def browser_rss_bytes(root_pid=None):
+    """Resident memory of geckodriver, Firefox and its content processes spawned by this process"""
+    if not os.path.isdir("/proc"):
+        return None
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    for pid in descendant_pids(root_pid):
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded wait queue and browser-memory throttling in front of the driver pool"""
+
+    def __init__(self, max_concurrent, max_queue=ADMISSION_MAX_QUEUE, queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+                 memory_limit_mb=ADMISSION_MEMORY_LIMIT_MB, rss_probe=browser_rss_bytes):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.memory_limit = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+        self.rss_probe = rss_probe
+
+        self._active = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected = {"queue_full": 0, "timeout": 0, "memory": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+        self._hold_average = None
+        self._rss = None
+        self._rss_checked = 0.0
+        self._cond = threading.Condition()
+
+    def browser_rss(self):
+        """Browser RSS, re-read from /proc at most once per ADMISSION_RSS_CACHE_SECONDS"""
+        now = time.time()
+        if now - self._rss_checked >= ADMISSION_RSS_CACHE_SECONDS:
+            try:
+                self._rss = self.rss_probe()
+            except Exception as e:
+                logger.warning(f"Browser RSS probe failed: {e}")
+                self._rss = None
+            self._rss_checked = now
+        return self._rss
+
+    def _memory_ok(self):
+        if not self.memory_limit:
+            return True
+        rss = self.browser_rss()
+        # With nothing in flight there is nothing to wait for, so always let one capture through
+        return rss is None or rss < self.memory_limit or self._active == 0
+
+    def retry_after(self):
+        """Seconds until a slot is likely free, estimated from recent capture durations"""
+        if not self._hold_average:
+            return DEFAULT_RETRY_AFTER
+        backlog = (self._waiting + 1) / max(1, self.max_concurrent)
+        return max(1, math.ceil(self._hold_average * backlog))
+
+    def saturated(self):
+        with self._cond:
+            return self._waiting >= self.max_queue
+
+    def _reject(self, message, status, reason):
+        self._rejected[reason] += 1
+        ADMISSION_REJECTIONS_TOTAL.inc(reason=reason)
+        logger.warning(f"Admission rejected ({reason}): {message}")
+        return AdmissionRejected(message, status=status, retry_after=self.retry_after(), reason=reason)
+
+    def acquire(self, timeout=None):
+        """Wait for a capture slot and return the admission time; raises AdmissionRejected"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        start_time = time.time()
+        deadline = start_time + timeout
+
+        with self._cond:
+            if self._active >= self.max_concurrent or self._waiting or not self._memory_ok():
+                if self._waiting >= self.max_queue:
+                    raise self._reject(f"Capture queue is full ({self._waiting} waiting)", 429, "queue_full")
+
+                self._waiting += 1
+                try:
+                    while self._active >= self.max_concurrent or not self._memory_ok():
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            if self._active < self.max_concurrent:
+                                raise self._reject(
+                                    f"Browser memory above {self.memory_limit // (1024 * 1024)} MB", 503, "memory")
+                            raise self._reject(f"No capture slot after {timeout} seconds", 503, "timeout")
+                        # Memory only frees up as browsers recycle, so poll it rather than wait for a notify
+                        self._cond.wait(min(remaining, ADMISSION_MEMORY_POLL_SECONDS))
+                finally:
+                    self._waiting -= 1
+
+            self._active += 1
+            self._admitted += 1
+            waited = time.time() - start_time
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._wait_last = waited
+
+        if waited >= 0.1:
+            logger.info(f"Capture admitted after waiting {waited:.2f} seconds")
+        return time.time()
+
+    def release(self, admitted_at):
+        with self._cond:
+            self._active -= 1
+            held = time.time() - admitted_at
+            self._hold_average = held if self._hold_average is None else 0.8 * self._hold_average + 0.2 * held
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self, timeout=None):
+        admitted_at = self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release(admitted_at)
+
+    def stats(self):
+        with self._cond:
+            rss = self._rss
+            return {
+                "active": self._active,
+                "max_concurrent": self.max_concurrent,
+                "queue_depth": self._waiting,
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": dict(self._rejected),
+                "wait_time_last": round(self._wait_last, 3),
+                "wait_time_max": round(self._wait_max, 3),
+                "wait_time_avg": round(self._wait_total / self._admitted, 3) if self._admitted else 0.0,
+                "capture_time_avg": round(self._hold_average, 2) if self._hold_average else None,
+                "browser_rss_mb": round(rss / (1024 * 1024), 1) if rss is not None else None,
+                "memory_limit_mb": self.memory_limit // (1024 * 1024) if self.memory_limit else None
+            }
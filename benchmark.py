@@ -0,0 +1,273 @@
+# benchmark.py
+#
+# Load benchmark for a running screenshot service, typically pointed at
+# mock_metabase.py so results are repeatable:
+#   python mock_metabase.py --port 3000 --delay 1.0 &
+#   METABASE_BASE_URL=http://localhost:3000 python run.py &
+#   python benchmark.py --questions 1,2,3,4 --concurrency 1,4,8 --requests 40 --service-pid <pid>
+#
+# Runs a first pass (first render of every question), a warm sequential
+# pass, then a fixed number of requests at each concurrency level, and writes
+# latency percentiles, throughput and peak memory to a JSON file.
+#
+# Against an already running service the first pass is labelled "first_render":
+# its browsers are launched and may be logged in already. For a true cold start
+# let the benchmark launch the service itself:
+#   python benchmark.py --start-command "METABASE_BASE_URL=http://localhost:3000 python run.py"
+import argparse
+import json
+import logging
+import os
+import platform
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import urllib3
+
+from admission import browser_rss_bytes
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+# Benchmark configuration
+DEFAULT_SERVICE_URL = "http://localhost:5000"
+REQUEST_TIMEOUT = 300
+RSS_SAMPLE_SECONDS = 0.5
+SERVICE_START_TIMEOUT = 120
+
+
+def git_commit():
+    """Commit the benchmarked tree is at, marked -dirty with uncommitted changes; None outside a git checkout"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=directory, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=directory,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return round(ordered[index], 3)
+
+
+def summarize(name, samples, elapsed):
+    """Latency percentiles and throughput for one run"""
+    latencies = [sample["latency"] for sample in samples if sample["ok"]]
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample["status"])] = statuses.get(str(sample["status"]), 0) + 1
+    return {
+        "name": name,
+        "requests": len(samples),
+        "succeeded": len(latencies),
+        "failed": len(samples) - len(latencies),
+        "statuses": statuses,
+        "elapsed": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed > 0 else None,
+        "latency_min": round(min(latencies), 3) if latencies else None,
+        "latency_mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": round(max(latencies), 3) if latencies else None,
+        "cached": sum(1 for sample in samples if sample.get("cached")),
+        "server_ready_time_p50": percentile([s["ready_time"] for s in samples if s.get("ready_time")], 0.50)
+    }
+
+
+class RssSampler:
+    """Track peak RSS of the service process tree (or the browser RSS it reports) while a run is going"""
+
+    def __init__(self, http, service_url, service_pid=None):
+        self.http = http
+        self.service_url = service_url
+        self.service_pid = service_pid
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        if self.service_pid:
+            total = browser_rss_bytes(self.service_pid) or 0
+            try:
+                with open(f"/proc/{self.service_pid}/statm") as f:
+                    total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            except OSError:
+                pass
+            return total
+        try:
+            response = self.http.request("GET", f"{self.service_url}/health", timeout=5)
+            rss_mb = json.loads(response.data).get("admission", {}).get("browser_rss_mb")
+            return int(rss_mb * 1024 * 1024) if rss_mb is not None else 0
+        except Exception:
+            return 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.sample())
+            self._stop.wait(RSS_SAMPLE_SECONDS)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / (1024 * 1024), 1)
+
+
+class Benchmark:
+    def __init__(self, service_url, questions, payload, service_pid=None):
+        self.service_url = service_url.rstrip("/")
+        self.questions = questions
+        self.payload = payload
+        self.service_pid = service_pid
+        self.http = urllib3.PoolManager(maxsize=64, retries=False)
+
+    def screenshot(self, question_id):
+        """One /screenshot call, returning its latency and what the service reported"""
+        body = dict(self.payload, question_id=question_id)
+        start_time = time.perf_counter()
+        try:
+            response = self.http.request(
+                "POST", f"{self.service_url}/screenshot",
+                body=json.dumps(body).encode(),
+                headers={"Content-Type": "application/json"},
+                timeout=REQUEST_TIMEOUT
+            )
+            latency = time.perf_counter() - start_time
+            result = json.loads(response.data) if response.data else {}
+            return {
+                "question_id": question_id,
+                "status": response.status,
+                "ok": response.status == 200 and result.get("success", False),
+                "latency": latency,
+                "cached": result.get("cached"),
+                "ready_time": result.get("ready_time"),
+                "error": result.get("error")
+            }
+        except Exception as e:
+            return {"question_id": question_id, "status": "error", "ok": False,
+                    "latency": time.perf_counter() - start_time, "error": str(e)}
+
+    def run(self, name, question_ids, concurrency=1):
+        logger.info(f"Run '{name}': {len(question_ids)} requests at concurrency {concurrency}")
+        with RssSampler(self.http, self.service_url, self.service_pid) as sampler:
+            start_time = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                samples = list(executor.map(self.screenshot, question_ids))
+            elapsed = time.perf_counter() - start_time
+        result = summarize(name, samples, elapsed)
+        result["concurrency"] = concurrency
+        result["peak_rss_mb"] = sampler.peak_mb
+        errors = [sample["error"] for sample in samples if sample.get("error")]
+        if errors:
+            result["sample_errors"] = errors[:5]
+        logger.info(f"  - p50 {result['latency_p50']}s, p95 {result['latency_p95']}s, "
+                    f"{result['throughput_rps']} req/s, peak RSS {result['peak_rss_mb']} MB, "
+                    f"{result['failed']} failed")
+        return result
+
+    def wait_until_healthy(self, timeout=SERVICE_START_TIMEOUT):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if self.http.request("GET", f"{self.service_url}/health", timeout=5).status == 200:
+                    return
+            except Exception:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f"Service at {self.service_url} did not become healthy within {timeout} seconds")
+
+    def service_info(self):
+        try:
+            response = self.http.request("GET", f"{self.service_url}/config", timeout=5)
+            return json.loads(response.data)
+        except Exception as e:
+            return {"error": str(e)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Metabase screenshot service")
+    parser.add_argument("--service-url", default=DEFAULT_SERVICE_URL)
+    parser.add_argument("--service-pid", type=int, help="measure RSS of this process tree via /proc")
+    parser.add_argument("--start-command", help="launch the service with this shell command so the first pass is cold")
+    parser.add_argument("--questions", default="1,2,3,4", help="comma-separated question IDs")
+    parser.add_argument("--concurrency", default="1,4,8", help="comma-separated client concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--wait-seconds", type=float, default=10)
+    parser.add_argument("--max-age", type=float, help="allow cached renders this old (default: always render)")
+    parser.add_argument("--no-crop", action="store_true")
+    parser.add_argument("--output", default=f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    args = parser.parse_args()
+
+    questions = [question.strip() for question in args.questions.split(",") if question.strip()]
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    payload = {"wait_seconds": args.wait_seconds, "crop_to_chart": not args.no_crop}
+    if args.max_age is not None:
+        payload["max_age"] = args.max_age
+
+    service = None
+    if args.start_command:
+        logger.info(f"Starting service: {args.start_command}")
+        service = subprocess.Popen(args.start_command, shell=True, start_new_session=True)
+    bench = Benchmark(args.service_url, questions, payload, args.service_pid or (service and service.pid))
+    try:
+        if service:
+            bench.wait_until_healthy()
+        run_benchmark(bench, args, questions, levels, cold=service is not None)
+    finally:
+        if service:
+            logger.info("Stopping service")
+            os.killpg(service.pid, signal.SIGTERM)
+            service.wait()
+
+
+def run_benchmark(bench, args, questions, levels, cold):
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "service_url": args.service_url,
+        "service_config": bench.service_info(),
+        "parameters": vars(args),
+        "runs": []
+    }
+
+    # Cold only when this benchmark started the service: the first renders pay for browser launch and login.
+    # Otherwise the pool is already warm and only the questions themselves are new.
+    results["runs"].append(bench.run("cold" if cold else "first_render", questions))
+    results["runs"].append(bench.run("warm", questions))
+    for level in levels:
+        question_ids = [questions[i % len(questions)] for i in range(args.requests)]
+        results["runs"].append(bench.run(f"concurrency_{level}", question_ids, level))
+
+    results["peak_rss_mb"] = max(run["peak_rss_mb"] for run in results["runs"])
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
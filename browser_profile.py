@@ -0,0 +1,390 @@
+# browser_profile.py
+import fcntl
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+
+logger = logging.getLogger(__name__)
+
+# Capture profile configuration
+CAPTURE_PROFILE_ENABLED = True
+CAPTURE_PROFILE_ROOT = "browser_profiles"
+CAPTURE_CACHE_MB = 256
+CAPTURE_BLOCKED_URLS = [
+    "*://*/favicon.ico",
+    "*://*.google-analytics.com/*",
+    "*://*.googletagmanager.com/*",
+    "*://*.doubleclick.net/*",
+    "*://*.segment.io/*",
+    "*://*.segment.com/*",
+    "*://*.sentry.io/*",
+    "*://*.intercom.io/*",
+    "*://*.intercomcdn.com/*",
+    "*://*.snowplowanalytics.com/*",
+    "*://fonts.googleapis.com/*",
+    "*://fonts.gstatic.com/*",
+    "*://*/api/snowplow/*",
+    "*://www.metabase.com/*"
+]
+CAPTURE_BLOCKED_TYPES = ["beacon", "ping", "media", "websocket"]
+
+# Profile template configuration
+PROFILE_TEMPLATE_ENABLED = True
+PROFILE_WARM_PATHS = ["/auth/login"]  # pages that pull in Metabase's app bundles without a session
+PROFILE_WARM_SETTLE_SECONDS = 2
+PROFILE_VERSION_CHECK_SECONDS = 600
+TEMPLATE_MARKER = "capture-template.json"
+
+# Keeps the browser from phoning home or doing speculative work during captures
+LEAN_PREFS = {
+    # Telemetry and data reporting
+    "toolkit.telemetry.enabled": False,
+    "toolkit.telemetry.unified": False,
+    "toolkit.telemetry.archive.enabled": False,
+    "toolkit.telemetry.server": "",
+    "datareporting.healthreport.uploadEnabled": False,
+    "datareporting.policy.dataSubmissionEnabled": False,
+    "browser.ping-centre.telemetry": False,
+    "app.shield.optoutstudies.enabled": False,
+    "app.normandy.enabled": False,
+    "browser.crashReports.unsubmittedCheck.autoSubmit2": False,
+    # Safe browsing lists
+    "browser.safebrowsing.malware.enabled": False,
+    "browser.safebrowsing.phishing.enabled": False,
+    "browser.safebrowsing.downloads.enabled": False,
+    "browser.safebrowsing.blockedURIs.enabled": False,
+    "browser.safebrowsing.provider.google4.updateURL": "",
+    "browser.safebrowsing.provider.google.updateURL": "",
+    # Prefetch and speculative connections
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "network.predictor.enabled": False,
+    "network.http.speculative-parallel-limit": 0,
+    "browser.urlbar.speculativeConnect.enabled": False,
+    # Update and remote settings checks
+    "app.update.auto": False,
+    "app.update.disabledForTesting": True,
+    "extensions.update.enabled": False,
+    "extensions.getAddons.cache.enabled": False,
+    "browser.search.update": False,
+    "services.settings.server": "",
+    "browser.shell.checkDefaultBrowser": False,
+    "browser.startup.homepage_override.mstone": "ignore",
+    "browser.newtabpage.enabled": False,
+    "browser.aboutwelcome.enabled": False,
+    # HTTP cache kept in the persistent profile
+    "browser.cache.disk.enable": True,
+    "browser.cache.memory.enable": True,
+    "browser.cache.disk.smart_size.enabled": False,
+    "browser.cache.check_doc_frequency": 3
+}
+
+BLOCKER_BACKGROUND_JS = """
+const patterns = %s;
+const types = %s;
+const cancel = () => ({ cancel: true });
+if (patterns.length) {
+    browser.webRequest.onBeforeRequest.addListener(cancel, { urls: patterns }, ["blocking"]);
+}
+if (types.length) {
+    browser.webRequest.onBeforeRequest.addListener(cancel, { urls: ["<all_urls>"], types: types }, ["blocking"]);
+}
+"""
+
+
+def write_blocker_addon(directory, blocked_urls, blocked_types):
+    """Generate an unpacked WebExtension that cancels requests matching the block list"""
+    os.makedirs(directory, exist_ok=True)
+    manifest = {
+        "manifest_version": 2,
+        "name": "Capture request blocker",
+        "version": "1.0",
+        "permissions": ["webRequest", "webRequestBlocking", "<all_urls>"],
+        "background": {"scripts": ["background.js"]},
+        "browser_specific_settings": {"gecko": {"id": "capture-blocker@metabase-screenshot"}}
+    }
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    with open(os.path.join(directory, "background.js"), "w") as f:
+        f.write(BLOCKER_BACKGROUND_JS % (json.dumps(blocked_urls), json.dumps(blocked_types)))
+    return directory
+
+
+class CaptureProfile:
+    """Lean, persistent Firefox profiles leased one per running browser.
+
+    A Firefox profile can only be opened by one browser process at a time, so
+    instead of one shared directory there is one directory per concurrent
+    browser slot. A slot is reused by whichever driver launches next, which
+    keeps its HTTP cache warm across driver recycles and service restarts.
+    Slots are claimed with a flock so gunicorn workers sharing the root never
+    open the same profile.
+
+    A template profile whose disk cache already holds the current Metabase
+    version's bundles is built once per version; a slot that was cloned from
+    an older template (or never cloned) is re-cloned when it is next leased.
+    """
+
+    def __init__(self, root=CAPTURE_PROFILE_ROOT, blocked_urls=None, blocked_types=None, cache_mb=CAPTURE_CACHE_MB):
+        self.root = os.path.abspath(root)
+        self.blocked_urls = CAPTURE_BLOCKED_URLS if blocked_urls is None else blocked_urls
+        self.blocked_types = CAPTURE_BLOCKED_TYPES if blocked_types is None else blocked_types
+        self.cache_mb = cache_mb
+        self.addon_path = None
+        self._leased = {}
+        self._slots = 0
+        self._clones = 0
+        self._warmups = 0
+        self.metabase_version = None
+        self._refresher = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+        os.makedirs(self.root, exist_ok=True)
+        if self.blocked_urls or self.blocked_types:
+            self.addon_path = write_blocker_addon(
+                os.path.join(self.root, "blocker-addon"), self.blocked_urls, self.blocked_types
+            )
+        logger.info(f"Capture profile: {self.root} ({len(self.blocked_urls)} blocked URL patterns, "
+                    f"blocked types {self.blocked_types}, {self.cache_mb} MB disk cache)")
+
+    def slot_path(self, slot):
+        return os.path.join(self.root, f"slot-{slot}")
+
+    def lease(self):
+        """Claim the lowest free profile directory, creating a new slot if all are in use"""
+        with self._lock:
+            slot = 0
+            while True:
+                if slot not in self._leased:
+                    lease_file = open(os.path.join(self.root, f"slot-{slot}.lease"), "w")
+                    try:
+                        fcntl.flock(lease_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except OSError:
+                        # Held by another worker process
+                        lease_file.close()
+                slot += 1
+            self._leased[slot] = lease_file
+            self._slots = max(self._slots, slot + 1)
+        path = self.slot_path(slot)
+        os.makedirs(path, exist_ok=True)
+        # Locks left by a browser that was killed; the flock guarantees nothing else is using this slot
+        for name in ("lock", ".parentlock"):
+            try:
+                os.unlink(os.path.join(path, name))
+            except FileNotFoundError:
+                pass
+        if PROFILE_TEMPLATE_ENABLED:
+            self._sync_slot(slot)
+        return slot
+
+    def release(self, slot):
+        with self._lock:
+            lease_file = self._leased.pop(slot, None)
+        if lease_file is not None:
+            lease_file.close()
+
+    def options(self, base_options, path):
+        """Copy of the service's options pointed at a profile directory with the lean preferences"""
+        options = Options()
+        for argument in base_options.arguments:
+            options.add_argument(argument)
+        for name, value in base_options.preferences.items():
+            options.set_preference(name, value)
+        for name, value in LEAN_PREFS.items():
+            options.set_preference(name, value)
+        options.set_preference("browser.cache.disk.capacity", self.cache_mb * 1024)
+        # -profile makes geckodriver use the directory in place instead of copying it to a temp dir
+        options.add_argument("-profile")
+        options.add_argument(path)
+        return options
+
+    def launch(self, base_options):
+        """Start Firefox on a leased profile slot; the slot is released when the driver quits"""
+        slot = self.lease()
+        try:
+            driver = webdriver.Firefox(options=self.options(base_options, self.slot_path(slot)))
+        except Exception:
+            self.release(slot)
+            raise
+
+        original_quit = driver.quit
+
+        def quit():
+            try:
+                original_quit()
+            finally:
+                self.release(slot)
+
+        driver.quit = quit
+
+        if self.addon_path:
+            try:
+                driver.install_addon(self.addon_path, temporary=True)
+            except Exception as e:
+                logger.warning(f"Failed to install request blocker: {e}")
+        logger.info(f"Firefox launched on profile slot {slot}")
+        return driver
+
+    # Template with a pre-warmed HTTP cache
+
+    @property
+    def template_path(self):
+        return os.path.join(self.root, "template")
+
+    def _template_lock(self, mode):
+        """flock on the template: exclusive while warming, shared while cloning; None if unavailable"""
+        lock_file = open(os.path.join(self.root, "template.lease"), "w")
+        try:
+            fcntl.flock(lock_file, mode)
+            return lock_file
+        except OSError:
+            lock_file.close()
+            return None
+
+    @staticmethod
+    def read_marker(path):
+        try:
+            with open(os.path.join(path, TEMPLATE_MARKER)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def clone_tree(source, destination):
+        """Copy a profile, sharing blocks copy-on-write where the filesystem supports reflinks"""
+        try:
+            subprocess.run(["cp", "-a", "--reflink=auto", source, destination],
+                           check=True, capture_output=True, timeout=120)
+        except (OSError, subprocess.SubprocessError):
+            shutil.rmtree(destination, ignore_errors=True)
+            shutil.copytree(source, destination, symlinks=True)
+
+    def _sync_slot(self, slot):
+        """Re-clone a leased slot from the template when it was built for another template"""
+        template = self.read_marker(self.template_path)
+        if template is None:
+            return
+        path = self.slot_path(slot)
+        if self.read_marker(path) == template:
+            return
+        # A warm-up holding the template keeps the slot as it is until the next lease
+        lock_file = self._template_lock(fcntl.LOCK_SH | fcntl.LOCK_NB)
+        if lock_file is None:
+            return
+        try:
+            start_time = time.time()
+            shutil.rmtree(path, ignore_errors=True)
+            self.clone_tree(self.template_path, path)
+            with self._lock:
+                self._clones += 1
+            logger.info(f"Profile slot {slot} cloned from template for Metabase "
+                        f"{template.get('version')} in {time.time() - start_time:.2f} seconds")
+        except Exception as e:
+            logger.warning(f"Failed to clone profile template into slot {slot}: {e}")
+            os.makedirs(path, exist_ok=True)
+        finally:
+            lock_file.close()
+
+    def warm(self, base_options, base_url, version, paths=None):
+        """Build a template whose HTTP cache holds this Metabase version's static bundles.
+
+        Returns True if a new template was built, False if it was already current.
+        """
+        lock_file = self._template_lock(fcntl.LOCK_EX)
+        try:
+            current = self.read_marker(self.template_path)
+            if current and current.get("version") == version:
+                return False
+
+            logger.info(f"Warming profile template for Metabase {version}...")
+            start_time = time.time()
+            building = os.path.join(self.root, f"template.building-{os.getpid()}")
+            shutil.rmtree(building, ignore_errors=True)
+            os.makedirs(building)
+            driver = webdriver.Firefox(options=self.options(base_options, building))
+            try:
+                for path in paths or PROFILE_WARM_PATHS:
+                    logger.info(f"  - Loading {base_url}{path}")
+                    driver.get(f"{base_url}{path}")
+                    # Lazily loaded chunks are requested after the load event
+                    time.sleep(PROFILE_WARM_SETTLE_SECONDS)
+            finally:
+                # Quitting flushes the cache index to disk
+                driver.quit()
+            for name in ("lock", ".parentlock"):
+                try:
+                    os.unlink(os.path.join(building, name))
+                except FileNotFoundError:
+                    pass
+
+            with open(os.path.join(building, TEMPLATE_MARKER), "w") as f:
+                json.dump({"version": version, "warmed_at": time.time()}, f)
+            retired = f"{self.template_path}.old-{os.getpid()}"
+            if os.path.exists(self.template_path):
+                os.rename(self.template_path, retired)
+            os.rename(building, self.template_path)
+            shutil.rmtree(retired, ignore_errors=True)
+            with self._lock:
+                self._warmups += 1
+            logger.info(f"Profile template warmed in {time.time() - start_time:.2f} seconds")
+            return True
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def refresh(self, base_options, base_url, version_source):
+        """Warm the template if the running Metabase version differs from the one it was built for"""
+        try:
+            version = version_source()
+        except Exception as e:
+            logger.warning(f"Could not read Metabase version for profile template: {e}")
+            return False
+        if not version:
+            return False
+        with self._lock:
+            self.metabase_version = version
+        try:
+            return self.warm(base_options, base_url, version)
+        except Exception as e:
+            logger.error(f"Profile template warm-up failed: {e}")
+            return False
+
+    def start_refresher(self, base_options, base_url, version_source, interval=PROFILE_VERSION_CHECK_SECONDS):
+        """Re-check the Metabase version in the background and re-warm after upgrades"""
+        def run():
+            while not self._stop.wait(interval):
+                self.refresh(base_options, base_url, version_source)
+
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=run, name="profile-refresher", daemon=True)
+        self._refresher.start()
+
+    def close(self):
+        self._stop.set()
+
+    def stats(self):
+        template = self.read_marker(self.template_path) or {}
+        with self._lock:
+            return {
+                "root": self.root,
+                "template_version": template.get("version"),
+                "metabase_version": self.metabase_version,
+                "template_warmups": self._warmups,
+                "slot_clones": self._clones,
+                "slots": self._slots,
+                "leased": len(self._leased),
+                "blocked_url_patterns": len(self.blocked_urls),
+                "blocked_types": list(self.blocked_types),
+                "cache_mb": self.cache_mb
+            }
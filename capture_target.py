@@ -0,0 +1,96 @@
+# capture_target.py
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Capture target configuration, in order of preference
+CHART_TARGET_SELECTORS = [
+    ".Visualization",
+    "[data-testid='query-visualization-root']",
+    ".Card .Visualization",
+    "svg[class*='chart']",
+    "svg[class*='visualization']",
+    ".Visualization svg",
+    "canvas[class*='chart']",
+    ".Visualization canvas",
+    ".QueryBuilder-section .Card",
+    ".Card .Card-content",
+    ".Question .Card",
+    ".DashCard .Card-content"
+]
+TARGET_MIN_WIDTH = 200
+TARGET_MIN_HEIGHT = 150
+
+# Ranks every selector in the page and returns the first suitable element with
+# its bounding rect, scrolled into view, in a single WebDriver round trip.
+CAPTURE_TARGET_SCRIPT = """
+const selectors = arguments[0];
+const minWidth = arguments[1];
+const minHeight = arguments[2];
+const done = arguments[arguments.length - 1];
+
+function visible(element, rect) {
+    const style = window.getComputedStyle(element);
+    return style.display !== 'none' && style.visibility !== 'hidden' && style.opacity !== '0' &&
+        rect.width > 0 && rect.height > 0;
+}
+
+const candidates = [];
+let winner = null;
+
+for (const selector of selectors) {
+    let elements;
+    try {
+        elements = document.querySelectorAll(selector);
+    } catch (e) {
+        candidates.push({ selector: selector, count: 0, error: String(e) });
+        continue;
+    }
+    candidates.push({ selector: selector, count: elements.length });
+    for (const element of elements) {
+        const rect = element.getBoundingClientRect();
+        const pageX = rect.left + window.scrollX;
+        const pageY = rect.top + window.scrollY;
+        if (visible(element, rect) && rect.width > minWidth && rect.height > minHeight && pageX >= 0 && pageY >= 0) {
+            winner = { element: element, selector: selector };
+            break;
+        }
+    }
+    if (winner) break;
+}
+
+if (!winner) {
+    done({ found: false, candidates: candidates, devicePixelRatio: window.devicePixelRatio });
+    return;
+}
+
+winner.element.scrollIntoView({ block: 'start', inline: 'start' });
+
+requestAnimationFrame(() => requestAnimationFrame(() => {
+    const rect = winner.element.getBoundingClientRect();
+    done({
+        found: true,
+        element: winner.element,
+        selector: winner.selector,
+        rect: { x: rect.left, y: rect.top, width: rect.width, height: rect.height },
+        page_rect: { x: rect.left + window.scrollX, y: rect.top + window.scrollY, width: rect.width, height: rect.height },
+        devicePixelRatio: window.devicePixelRatio,
+        page_width: document.documentElement.scrollWidth,
+        candidates: candidates
+    });
+}));
+"""
+
+
+def resolve_capture_target(driver, selectors=None, min_width=TARGET_MIN_WIDTH, min_height=TARGET_MIN_HEIGHT):
+    """Pick the element to crop to, returning its WebElement and bounding rect in one round trip"""
+    selectors = selectors or CHART_TARGET_SELECTORS
+    result = driver.execute_async_script(CAPTURE_TARGET_SCRIPT, selectors, min_width, min_height)
+
+    for candidate in result.get("candidates", []):
+        logger.info(f"    - '{candidate['selector']}': {candidate['count']} elements"
+                    + (f" (error: {candidate['error']})" if candidate.get("error") else ""))
+
+    if not result.get("found"):
+        return None
+    return result
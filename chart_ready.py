@@ -0,0 +1,226 @@
+# chart_ready.py
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Readiness configuration
+CHART_QUIET_MS = 500
+CHART_POLL_MS = 100
+CHART_ROOT_SELECTORS = [
+    "[data-testid='query-visualization-root']",
+    ".Visualization",
+    ".QueryBuilder-section",
+    ".Card .Card-content"
+]
+CHART_SPINNER_SELECTOR = ".Loading, .LoadingSpinner, [data-testid='loading-spinner'], [data-testid='loading-indicator']"
+CHART_CONTENT_SELECTOR = "svg, canvas, table"
+
+# Counts in-flight card query requests (fetch and XHR) and records when the
+# network last changed; installed once per page and shared by both checks.
+# The hooks only go in after navigation returns, so a query the page started
+# while loading is invisible to them: resource timing entries record every
+# query that has finished, before or after the hooks, and a check that has
+# seen no query at all waits for one to finish or for the chart to render.
+READY_HOOKS_JS = """
+const QUERY_URL = /\\/api\\/(card\\/[^/]+\\/query|dataset|dashboard\\/[^/]+\\/dashcard\\/[^/]+\\/card\\/[^/]+\\/query)/;
+
+if (!window.__chartReady) {
+    const state = { inflight: 0, started: 0, completed: 0, lastNetwork: performance.now(), lastMutation: performance.now() };
+    const touch = () => { state.lastNetwork = performance.now(); };
+    const isQuery = entry => QUERY_URL.test(entry.name);
+
+    state.completed = performance.getEntriesByType('resource').filter(isQuery).length;
+    if (window.PerformanceObserver) {
+        new PerformanceObserver(list => {
+            const finished = list.getEntries().filter(isQuery).length;
+            if (finished) {
+                state.completed += finished;
+                touch();
+            }
+        }).observe({ type: 'resource' });
+    }
+
+    const originalFetch = window.fetch;
+    window.fetch = function(input) {
+        const url = typeof input === 'string' ? input : (input && input.url) || '';
+        if (!QUERY_URL.test(url)) {
+            return originalFetch.apply(this, arguments);
+        }
+        state.inflight++;
+        state.started++;
+        touch();
+        return originalFetch.apply(this, arguments).finally(() => { state.inflight--; touch(); });
+    };
+
+    const originalOpen = XMLHttpRequest.prototype.open;
+    const originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.open = function(method, url) {
+        this.__chartTracked = QUERY_URL.test(String(url));
+        return originalOpen.apply(this, arguments);
+    };
+    XMLHttpRequest.prototype.send = function() {
+        if (this.__chartTracked) {
+            state.inflight++;
+            state.started++;
+            touch();
+            this.addEventListener('loadend', () => { state.inflight--; touch(); }, { once: true });
+        }
+        return originalSend.apply(this, arguments);
+    };
+
+    window.__chartReady = state;
+}
+"""
+
+# Resolves once the visualization root exists, a card query has answered (or
+# the chart has rendered), no query is in flight, no spinner is showing and the
+# root has seen no DOM mutations for quietMs.
+CHART_READY_SCRIPT = """
+const rootSelectors = arguments[0];
+const spinnerSelector = arguments[1];
+const contentSelector = arguments[2];
+const quietMs = arguments[3];
+const timeoutMs = arguments[4];
+const pollMs = arguments[5];
+const done = arguments[arguments.length - 1];
+const start = performance.now();
+
+""" + READY_HOOKS_JS + """
+const state = window.__chartReady;
+state.lastMutation = performance.now();
+
+function findRoot() {
+    for (const selector of rootSelectors) {
+        const element = document.querySelector(selector);
+        if (element) {
+            return { element, selector };
+        }
+    }
+    return null;
+}
+
+let observed = null;
+const observer = new MutationObserver(() => { state.lastMutation = performance.now(); });
+
+function finish(ready, reason, root) {
+    observer.disconnect();
+    done({
+        ready: ready,
+        reason: reason,
+        selector: root ? root.selector : null,
+        elapsed_ms: Math.round(performance.now() - start),
+        inflight: state.inflight,
+        charts: document.querySelectorAll('svg, canvas, .Visualization').length
+    });
+}
+
+function check() {
+    const now = performance.now();
+    const root = findRoot();
+
+    if (root && observed !== root.element) {
+        observer.disconnect();
+        observer.observe(root.element, { childList: true, subtree: true, attributes: true, characterData: true });
+        observed = root.element;
+        state.lastMutation = now;
+    }
+
+    const spinning = root && (root.element.matches(spinnerSelector) || root.element.querySelector(spinnerSelector));
+    const answered = state.started + state.completed > 0 || !!(root && root.element.querySelector(contentSelector));
+    const quiet = now - state.lastMutation >= quietMs && now - state.lastNetwork >= quietMs;
+
+    if (root && !spinning && answered && state.inflight === 0 && quiet) {
+        finish(true, 'stable', root);
+    } else if (now - start >= timeoutMs) {
+        finish(false, !root ? 'no-root' : spinning ? 'spinner' : !answered ? 'no-query' : state.inflight ? 'inflight' : 'mutating', root);
+    } else {
+        setTimeout(check, pollMs);
+    }
+}
+
+check();
+"""
+
+
+def wait_for_chart_ready(driver, timeout_seconds, quiet_ms=CHART_QUIET_MS, root_selectors=None):
+    """Block until the chart is stable in the page, with timeout_seconds as the upper bound"""
+    root_selectors = root_selectors or CHART_ROOT_SELECTORS
+    start_time = time.time()
+    driver.set_script_timeout(timeout_seconds + 5)
+    result = driver.execute_async_script(
+        CHART_READY_SCRIPT,
+        root_selectors,
+        CHART_SPINNER_SELECTOR,
+        CHART_CONTENT_SELECTOR,
+        quiet_ms,
+        int(timeout_seconds * 1000),
+        CHART_POLL_MS
+    )
+    result["ready_time"] = round(time.time() - start_time, 3)
+    return result
+
+
+# Non-blocking variant for callers that multiplex several pages: each call
+# returns the current state at once and keeps its observer between calls.
+CHART_READY_POLL_SCRIPT = """
+const rootSelectors = arguments[0];
+const spinnerSelector = arguments[1];
+const contentSelector = arguments[2];
+const quietMs = arguments[3];
+
+if (document.readyState !== 'complete') {
+    return { ready: false, reason: 'loading', url: location.href };
+}
+""" + READY_HOOKS_JS + """
+const state = window.__chartReady;
+if (!window.__chartReadyPoll) {
+    window.__chartReadyPoll = {
+        observed: null,
+        observer: new MutationObserver(() => { state.lastMutation = performance.now(); })
+    };
+}
+const poll = window.__chartReadyPoll;
+const now = performance.now();
+
+let root = null;
+for (const selector of rootSelectors) {
+    const element = document.querySelector(selector);
+    if (element) {
+        root = { element, selector };
+        break;
+    }
+}
+
+if (root && poll.observed !== root.element) {
+    poll.observer.disconnect();
+    poll.observer.observe(root.element, { childList: true, subtree: true, attributes: true, characterData: true });
+    poll.observed = root.element;
+    state.lastMutation = now;
+}
+
+const spinning = root && (root.element.matches(spinnerSelector) || root.element.querySelector(spinnerSelector));
+const answered = state.started + state.completed > 0 || !!(root && root.element.querySelector(contentSelector));
+const quietFor = Math.min(now - state.lastMutation, now - state.lastNetwork);
+const ready = !!root && !spinning && answered && state.inflight === 0 && quietFor >= quietMs;
+
+return {
+    ready: ready,
+    reason: ready ? 'stable' : !root ? 'no-root' : spinning ? 'spinner' : !answered ? 'no-query' : state.inflight ? 'inflight' : 'mutating',
+    selector: root ? root.selector : null,
+    inflight: state.inflight,
+    quiet_ms: Math.round(quietFor),
+    url: location.href
+};
+"""
+
+
+def poll_chart_ready(driver, quiet_ms=CHART_QUIET_MS, root_selectors=None):
+    """One immediate readiness check of the current window; never waits"""
+    return driver.execute_script(
+        CHART_READY_POLL_SCRIPT,
+        root_selectors or CHART_ROOT_SELECTORS,
+        CHART_SPINNER_SELECTOR,
+        CHART_CONTENT_SELECTOR,
+        quiet_ms
+    )
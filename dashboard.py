@@ -0,0 +1,73 @@
+# dashboard.py
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Dashboard configuration
+DASHBOARD_ROOT_SELECTORS = [
+    "[data-testid='dashboard-grid']",
+    ".DashboardGrid",
+    "[data-testid='dashboard']",
+    ".Dashboard"
+]
+DASHCARD_SELECTOR = ".DashCard, [data-testid='dashcard']"
+DASHBOARD_MAX_HEIGHT = 12000
+
+# Page-coordinate rects of every dashcard plus the height the dashboard needs
+# to render without an inner scroll container, in one round trip.
+DASHBOARD_LAYOUT_SCRIPT = """
+const cardSelector = arguments[0];
+const rootSelectors = arguments[1];
+
+const cards = [];
+for (const card of document.querySelectorAll(cardSelector)) {
+    if (card.parentElement && card.parentElement.closest(cardSelector)) continue;
+    const rect = card.getBoundingClientRect();
+    if (rect.width < 1 || rect.height < 1) continue;
+    const title = card.querySelector("[data-testid='legend-caption-title'], .Card-title, h3");
+    cards.push({
+        index: cards.length,
+        dashcard_id: card.getAttribute('data-dashcard-key') || card.getAttribute('data-dashcard-id') || null,
+        title: title ? title.innerText.trim() : null,
+        x: rect.left + window.scrollX,
+        y: rect.top + window.scrollY,
+        width: rect.width,
+        height: rect.height
+    });
+}
+
+let contentHeight = document.documentElement.scrollHeight;
+for (const selector of rootSelectors) {
+    const root = document.querySelector(selector);
+    if (root) {
+        const rect = root.getBoundingClientRect();
+        contentHeight = Math.max(contentHeight, rect.top + window.scrollY + root.scrollHeight);
+        break;
+    }
+}
+
+return {
+    cards: cards,
+    devicePixelRatio: window.devicePixelRatio,
+    contentWidth: document.documentElement.scrollWidth,
+    contentHeight: Math.ceil(contentHeight),
+    innerHeight: window.innerHeight,
+    outerHeight: window.outerHeight
+};
+"""
+
+
+def dashboard_layout(driver):
+    """Bounding rects of all dashcards and the page size needed to show them"""
+    return driver.execute_script(DASHBOARD_LAYOUT_SCRIPT, DASHCARD_SELECTOR, DASHBOARD_ROOT_SELECTORS)
+
+
+def fit_window_to_dashboard(driver, layout, width, max_height=DASHBOARD_MAX_HEIGHT):
+    """Grow the window so the whole dashboard lays out without an inner scrollbar"""
+    chrome = max(0, layout["outerHeight"] - layout["innerHeight"])
+    height = min(layout["contentHeight"], max_height)
+    if height <= layout["innerHeight"]:
+        return False
+    logger.info(f"  - Resizing window to {width}x{height + chrome} to fit dashboard")
+    driver.set_window_size(width, height + chrome)
+    return True
@@ -0,0 +1,238 @@
+# driver_pool.py
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration
+DRIVER_POOL_SIZE = 2
+DRIVER_MAX_USES = 50
+DRIVER_CHECKOUT_TIMEOUT = 120
+
+
+class DriverPoolExhausted(Exception):
+    """Raised when no driver becomes available within the checkout timeout"""
+
+
+class DriverPool:
+    """Bounded pool of pre-launched WebDriver instances shared across requests"""
+
+    def __init__(self, factory, size=DRIVER_POOL_SIZE, max_uses=DRIVER_MAX_USES,
+                 checkout_timeout=DRIVER_CHECKOUT_TIMEOUT):
+        self.factory = factory
+        self.size = size
+        self.max_uses = max_uses
+        self.checkout_timeout = checkout_timeout
+
+        self._idle = []
+        self._uses = {}
+        self._created = 0
+        self._in_use = 0
+        self._started = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+        atexit.register(self.close)
+
+    def start(self):
+        """Pre-launch drivers in the background so the first requests skip the cold start"""
+        with self._cond:
+            if self._started or self._closed:
+                return
+            self._started = True
+        logger.info(f"Warming driver pool: {self.size} drivers")
+        for _ in range(self.size):
+            self._replenish()
+
+    def _launch(self):
+        """Create a new driver through the factory, releasing the slot on failure"""
+        start_time = time.time()
+        try:
+            driver = self.factory()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+        logger.info(f"Driver launched in {time.time() - start_time:.2f} seconds")
+        with self._cond:
+            self._uses[id(driver)] = 0
+        return driver
+
+    def _replenish(self):
+        """Launch one spare driver in a background thread if there is a free slot"""
+        with self._cond:
+            if self._closed or self._created >= self.size:
+                return
+            self._created += 1
+
+        def worker():
+            try:
+                driver = self._launch()
+            except Exception as e:
+                logger.error(f"Background driver launch failed: {e}")
+                return
+            with self._cond:
+                closed = self._closed
+                if closed:
+                    self._created -= 1
+                else:
+                    self._idle.append(driver)
+                    self._cond.notify()
+            if closed:
+                self._quit(driver)
+
+        threading.Thread(target=worker, name="driver-pool-warmup", daemon=True).start()
+
+    def is_healthy(self, driver):
+        """Cheap liveness probe against the browser"""
+        try:
+            driver.execute_script("return 1")
+            return True
+        except Exception as e:
+            logger.warning(f"Driver health probe failed: {e}")
+            return False
+
+    def _quit(self, driver):
+        with self._cond:
+            self._uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Driver quit failed: {e}")
+
+    def checkout(self, timeout=None):
+        """Borrow a healthy driver, launching one if the pool has a free slot"""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+
+        while True:
+            driver = None
+            launch = False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise DriverPoolExhausted("Driver pool is closed")
+                    if self._idle:
+                        driver = self._idle.pop()
+                        break
+                    if self._created < self.size:
+                        self._created += 1
+                        launch = True
+                        break
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise DriverPoolExhausted(
+                            f"No driver available after {timeout} seconds ({self.size} in use)")
+                    self._cond.wait(remaining)
+                self._in_use += 1
+
+            if launch:
+                try:
+                    return self._launch()
+                except Exception:
+                    with self._cond:
+                        self._in_use -= 1
+                    raise
+
+            if self.is_healthy(driver):
+                return driver
+
+            logger.warning("Discarding unhealthy pooled driver")
+            self._quit(driver)
+            with self._cond:
+                self._in_use -= 1
+                self._created -= 1
+                self._cond.notify()
+
+    def reset(self, driver):
+        """Clear per-request browser state before the driver is reused"""
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+            return True
+        except Exception as e:
+            logger.warning(f"Driver reset failed: {e}")
+            return False
+
+    def checkin(self, driver, discard=False):
+        """Return a driver to the pool, recycling it after max_uses or on crash"""
+        with self._cond:
+            uses = self._uses.get(id(driver), 0) + 1
+            self._uses[id(driver)] = uses
+
+        recycle = discard or uses >= self.max_uses or not self.reset(driver)
+
+        with self._cond:
+            self._in_use -= 1
+            recycle = recycle or self._closed
+            if recycle:
+                self._created -= 1
+            else:
+                self._idle.append(driver)
+            self._cond.notify()
+
+        if recycle:
+            logger.info(f"Recycling driver after {uses} uses" + (" (crashed)" if discard else ""))
+            self._quit(driver)
+
+        if recycle and self._started:
+            self._replenish()
+
+    @contextmanager
+    def borrow(self, timeout=None):
+        """Context manager wrapping checkout/checkin with crash detection"""
+        driver = self.checkout(timeout)
+        healthy = True
+        try:
+            yield driver
+        except Exception:
+            healthy = self.is_healthy(driver)
+            raise
+        finally:
+            self.checkin(driver, discard=not healthy)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "max_uses": self.max_uses
+            }
+
+    def drain(self, timeout=DRIVER_CHECKOUT_TIMEOUT):
+        """Stop lending drivers, wait for in-flight captures to check theirs in, then quit everything"""
+        self.close()
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._in_use:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.warning(f"Driver pool drain timed out with {self._in_use} drivers still in use")
+                    return False
+                self._cond.wait(remaining)
+        logger.info("Driver pool drained")
+        return True
+
+    def close(self):
+        """Quit all idle drivers; drivers still checked out are quit on checkin"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for driver in idle:
+            self._quit(driver)
+        logger.info("Driver pool closed")
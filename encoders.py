@@ -0,0 +1,103 @@
+# encoders.py
+import io
+import logging
+import time
+
+from raster import Image, RasterUnavailable, decode
+
+logger = logging.getLogger(__name__)
+
+# Encoder configuration
+DEFAULT_IMAGE_FORMAT = "png"
+DEFAULT_QUALITY = 85
+MAX_THUMBNAILS = 4
+WEBP_METHOD = 4
+
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "jpg": ("JPEG", "image/jpeg", "jpg"),
+    "webp": ("WEBP", "image/webp", "webp")
+}
+
+
+class EncodedImage:
+    def __init__(self, data, mimetype, extension, width=None, height=None):
+        self.data = data
+        self.mimetype = mimetype
+        self.extension = extension
+        self.width = width
+        self.height = height
+
+
+def _encode(image, pil_format, quality):
+    buffer = io.BytesIO()
+    if pil_format == "JPEG":
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    elif pil_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=WEBP_METHOD)
+    elif quality is not None and quality < 100:
+        # Charts use few colors, so a palette PNG is far smaller at no visible cost
+        image.convert("RGB").quantize(colors=256).save(buffer, format="PNG", optimize=True)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def _resize(image, width):
+    if width >= image.size[0]:
+        return image
+    height = max(1, round(image.size[1] * width / image.size[0]))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def check_encoding_options(image_format=DEFAULT_IMAGE_FORMAT, quality=None, max_width=None, thumbnail_sizes=None):
+    """Validate and normalize encoding options before any capture work is done"""
+    image_format = (image_format or DEFAULT_IMAGE_FORMAT).lower()
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported format '{image_format}', expected one of: {', '.join(IMAGE_FORMATS)}")
+    if quality is not None and not 1 <= int(quality) <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    if max_width is not None and int(max_width) < 1:
+        raise ValueError("max_width must be positive")
+    if thumbnail_sizes is not None and not isinstance(thumbnail_sizes, (list, tuple)):
+        raise ValueError("thumbnail_sizes must be a list of widths")
+    thumbnail_sizes = sorted({int(size) for size in thumbnail_sizes or [] if int(size) > 0}, reverse=True)
+    thumbnail_sizes = thumbnail_sizes[:MAX_THUMBNAILS]
+
+    passthrough = IMAGE_FORMATS[image_format][0] == "PNG" and quality is None and not max_width and not thumbnail_sizes
+    if not passthrough and Image is None:
+        raise RasterUnavailable(f"Pillow is required to encode {image_format}, resize or make thumbnails")
+    return image_format, None if quality is None else int(quality), max_width and int(max_width), thumbnail_sizes
+
+
+def encode_variants(png_bytes, image_format=DEFAULT_IMAGE_FORMAT, quality=None, max_width=None,
+                    thumbnail_sizes=None):
+    """Decode a PNG once and produce the requested encoding plus any thumbnails from the same raster"""
+    image_format, quality, max_width, thumbnail_sizes = check_encoding_options(
+        image_format, quality, max_width, thumbnail_sizes
+    )
+    pil_format, mimetype, extension = IMAGE_FORMATS[image_format]
+
+    # The browser PNG can be returned untouched when nothing about it changes
+    if pil_format == "PNG" and quality is None and not max_width and not thumbnail_sizes:
+        return EncodedImage(png_bytes, mimetype, extension), []
+
+    start_time = time.time()
+    quality = DEFAULT_QUALITY if quality is None and pil_format != "PNG" else quality
+    image = decode(png_bytes)
+
+    main = _resize(image, max_width) if max_width else image
+    encoded = EncodedImage(_encode(main, pil_format, quality), mimetype, extension, *main.size)
+
+    thumbnails = []
+    source = main
+    for width in thumbnail_sizes:
+        # Resize from the previous (larger) step rather than the full raster
+        source = _resize(source, width)
+        thumbnails.append(EncodedImage(_encode(source, pil_format, quality), mimetype, extension, *source.size))
+
+    logger.info(f"Encoded {image_format} {encoded.width}x{encoded.height}: {len(png_bytes):,} -> "
+                f"{len(encoded.data):,} bytes, {len(thumbnails)} thumbnails "
+                f"({(time.time() - start_time) * 1000:.0f} ms)")
+    return encoded, thumbnails
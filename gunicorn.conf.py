@@ -0,0 +1,79 @@
+# gunicorn.conf.py
+#
+# Production entry point:
+#   gunicorn -c gunicorn.conf.py run:app
+#
+# Each worker process imports run.py after the fork, so it owns its own
+# screenshot service, driver pool, session cache and in-memory image cache.
+# Browsers are never shared across processes; async job state is shared
+# through the jobs/ directory so any worker can answer for any job.
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+# Concurrent captures per worker; also sizes that worker's driver pool
+captures_per_worker = int(os.environ.get("CAPTURES_PER_WORKER", 2))
+os.environ["CAPTURES_PER_WORKER"] = str(captures_per_worker)
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+# Firefox uses more than one core per capture, so aim for about one capture per core
+workers = int(os.environ.get("WEB_WORKERS", max(1, multiprocessing.cpu_count() // captures_per_worker)))
+worker_class = "gthread"
+# Spare threads beyond the captures keep /health and job polling responsive while browsers are busy
+threads = int(os.environ.get("WORKER_THREADS", captures_per_worker * 2 + 2))
+
+# Captures can legitimately take minutes; graceful_timeout bounds the drain on shutdown
+timeout = int(os.environ.get("WORKER_TIMEOUT", 300))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 120))
+# The arbiter SIGKILLs a worker graceful_timeout after SIGTERM, so the drain must finish
+# a little earlier to leave time to quit browsers and exit cleanly
+drain_timeout = max(1, graceful_timeout - int(os.environ.get("DRAIN_MARGIN", 10)))
+keepalive = 5
+
+# Recycle workers now and then to bound browser and Python memory growth
+max_requests = int(os.environ.get("MAX_REQUESTS", 1000))
+max_requests_jitter = max_requests // 10
+
+# Launching browsers before fork would share geckodriver sessions between processes
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+loglevel = "info"
+
+
+def post_worker_init(worker):
+    """Warm this worker's own driver pool and pick up orphaned jobs before it serves requests"""
+    from run import job_manager, scheduler, screenshot_service
+    worker.log.info(f"Worker {worker.pid}: warming browsers ({os.environ.get('CAPTURE_ENGINE', 'pool')} engine)")
+    screenshot_service.start()
+    scheduler.start()
+    job_manager.adopt_orphans()
+
+    # gthread waits out graceful_timeout for in-flight requests before worker_exit runs,
+    # so start the drain as soon as SIGTERM arrives rather than after the deadline
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def drain_on_exit(sig, frame):
+        if not hasattr(worker, "drain_thread"):
+            from run import shutdown_service
+            worker.drain_started = time.time()
+            worker.drain_thread = threading.Thread(target=shutdown_service, kwargs={"timeout": drain_timeout},
+                                                   name="shutdown-drain", daemon=True)
+            worker.drain_thread.start()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, drain_on_exit)
+
+
+def worker_exit(server, worker):
+    """Finish draining in-flight captures and quit this worker's browsers within drain_timeout"""
+    drain_thread = getattr(worker, "drain_thread", None)
+    if drain_thread is None:
+        # Recycled by max_requests, or exiting without SIGTERM: nothing is counting down yet
+        from run import shutdown_service
+        shutdown_service(timeout=drain_timeout)
+        return
+    drain_thread.join(max(0, drain_timeout - (time.time() - worker.drain_started)))
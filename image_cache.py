@@ -0,0 +1,231 @@
+# image_cache.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+IMAGE_CACHE_TTL_SECONDS = 60 * 60
+IMAGE_CACHE_DIR = "image_cache"
+IMAGE_CACHE_DISK_MAX_BYTES = 2 * 1024 * 1024 * 1024
+IMAGE_CACHE_PRUNE_INTERVAL = 60  # seconds between disk prunes triggered by writes
+
+
+def cache_key(question_id, crop_to_chart, viewport, identity, renderer="browser"):
+    """Stable key for a rendered image; identity scopes it to the credentials that rendered it.
+
+    identity must cover the password as well as the username (see session_cache.credential_digest),
+    otherwise anyone who knows a username is served that user's renders.
+    """
+    if not identity:
+        raise ValueError("cache_key needs a credential identity")
+    parts = [str(question_id), bool(crop_to_chart), list(viewport), identity]
+    if renderer != "browser":
+        # Browser keys keep their original form so existing cache entries stay valid
+        parts.append(renderer)
+    raw = json.dumps(parts)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, data, created_at, meta=None):
+        self.data = data
+        self.created_at = created_at
+        self.meta = meta or {}
+        self.disk_mtime = None  # mtime of the metadata file this entry was last written to or read from
+
+    @property
+    def age(self):
+        return time.time() - self.created_at
+
+
+class ImageCache:
+    """Size-bounded in-memory LRU of rendered images backed by an on-disk store"""
+
+    def __init__(self, max_bytes=IMAGE_CACHE_MAX_BYTES, ttl=IMAGE_CACHE_TTL_SECONDS,
+                 directory=IMAGE_CACHE_DIR, disk_max_bytes=IMAGE_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._pruned_at = 0
+        self._pruning = False
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._maybe_prune()
+
+    def _paths(self, key):
+        return os.path.join(self.directory, f"{key}.img"), os.path.join(self.directory, f"{key}.json")
+
+    def _remember(self, key, entry):
+        """Insert into the memory LRU, evicting the least recently used entries over max_bytes"""
+        if len(entry.data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old:
+            self._bytes -= len(old.data)
+        self._entries[key] = entry
+        self._bytes += len(entry.data)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.data)
+
+    def _load(self, key):
+        """Read an entry from the disk store"""
+        if not self.directory:
+            return None
+        image_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(image_path, "rb") as f:
+                data = f.read()
+            disk_mtime = os.stat(meta_path).st_mtime
+        except (OSError, ValueError):
+            return None
+        entry = CacheEntry(data, meta.pop("created_at"), meta)
+        entry.disk_mtime = disk_mtime
+        return entry
+
+    def _save(self, key, entry):
+        """Write an entry to the disk store atomically"""
+        if not self.directory:
+            return
+        image_path, meta_path = self._paths(key)
+        try:
+            with open(f"{image_path}.tmp", "wb") as f:
+                f.write(entry.data)
+            os.replace(f"{image_path}.tmp", image_path)
+            with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(dict(entry.meta, created_at=entry.created_at), f)
+            os.replace(f"{meta_path}.tmp", meta_path)
+            entry.disk_mtime = os.stat(meta_path).st_mtime
+        except OSError as e:
+            logger.warning(f"Failed to persist cached image {key}: {e}")
+
+    def _disk_changed(self, key, entry):
+        """Whether another process has rewritten the disk copy since this entry was stored or read"""
+        if not self.directory:
+            return False
+        try:
+            return os.stat(self._paths(key)[1]).st_mtime != entry.disk_mtime
+        except OSError:
+            return False
+
+    def _lookup(self, key):
+        """Find an unexpired entry in memory or on disk, promoting disk hits into memory.
+
+        A memory entry is only trusted while the disk copy is unchanged: other gunicorn
+        workers share the disk store, and their fresher renders and touches land there.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+        if not entry or self._disk_changed(key, entry):
+            stored = self._load(key)
+            if stored and (not entry or stored.created_at >= entry.created_at):
+                entry = stored
+                if entry.age <= self.ttl:
+                    with self._lock:
+                        self._remember(key, entry)
+            elif stored:
+                # The disk holds an older render; keep ours without re-reading it on every lookup
+                entry.disk_mtime = stored.disk_mtime
+        if entry and entry.age > self.ttl:
+            return None
+        return entry
+
+    def get(self, key, max_age=None):
+        """Return a cached entry no older than max_age (and the TTL), or None"""
+        entry = self._lookup(key)
+        if not entry or (max_age is not None and entry.age > max_age):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, data, meta=None):
+        entry = CacheEntry(data, time.time(), meta)
+        with self._lock:
+            self._remember(key, entry)
+        self._save(key, entry)
+        self._maybe_prune()
+        return entry
+
+    def _maybe_prune(self):
+        """Prune the disk store at most once per IMAGE_CACHE_PRUNE_INTERVAL, never concurrently"""
+        with self._lock:
+            if self._pruning or time.time() - self._pruned_at < IMAGE_CACHE_PRUNE_INTERVAL:
+                return
+            self._pruning = True
+        try:
+            self.prune_disk()
+        finally:
+            with self._lock:
+                self._pruning = False
+                self._pruned_at = time.time()
+
+    def peek(self, key):
+        """Any unexpired entry, regardless of max_age and without counting a hit or miss"""
+        return self._lookup(key)
+
+    def touch(self, key, **meta):
+        """Restart an entry's age after confirming it is still current"""
+        entry = self._lookup(key)
+        if entry:
+            entry.created_at = time.time()
+            entry.meta.update(meta)
+            self._save(key, entry)
+        return entry
+
+    def prune_disk(self):
+        """Drop expired files and trim the disk store to disk_max_bytes, oldest first"""
+        if not self.directory:
+            return
+        files = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".img"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name[:-4]))
+            total += stat.st_size
+
+        for mtime, size, key in sorted(files):
+            if total <= self.disk_max_bytes and now - mtime <= self.ttl:
+                continue
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses
+            }
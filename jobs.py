@@ -0,0 +1,437 @@
+# jobs.py
+import base64
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import urllib3
+
+from tracing import begin_request, current_request_id, end_request
+
+logger = logging.getLogger(__name__)
+
+# Job configuration
+JOB_WORKERS = 2
+JOB_MAX_PENDING = 50
+JOB_RETENTION_SECONDS = 60 * 60
+JOB_DIR = "jobs"  # shared by every gunicorn worker, so any worker can answer for any job
+JOB_PRUNE_INTERVAL = 60
+# Results are served from JOB_DIR; only those that could not be written there stay in memory, up to this much
+JOB_RESULT_MAX_BYTES = 128 * 1024 * 1024
+CALLBACK_TIMEOUT = 10
+# Hosts callback_url may point at, comma separated; ".example.com" also allows its subdomains. Empty disables callbacks.
+CALLBACK_ALLOWED_HOSTS = [host.strip().lower() for host in os.environ.get("JOB_CALLBACK_HOSTS", "").split(",")
+                          if host.strip()]
+
+_JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JobQueueFull(Exception):
+    """Raised when the job backlog is at JOB_MAX_PENDING"""
+
+
+class _JobInfo(dict):
+    """Capture info whose phase changes are passed to a callback, so they reach the shared job directory"""
+
+    def __init__(self, on_phase, *args):
+        super().__init__(*args)
+        self._on_phase = on_phase
+
+    def __setitem__(self, key, value):
+        changed = key == "phase" and self.get("phase") != value
+        super().__setitem__(key, value)
+        if changed:
+            self._on_phase()
+
+
+class CaptureJob:
+    """State of a single asynchronous capture"""
+
+    def __init__(self, params, callback_url=None):
+        self.id = uuid.uuid4().hex
+        self.request_id = current_request_id()
+        self.params = params
+        self.callback_url = callback_url
+        self.state = "queued"
+        self.info = {"phase": "queued"}
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.owner = os.getpid()
+        # The password never leaves this process, so only this worker can run a job that carries one
+        self.credentials = params.get("password") is not None
+        self.result_path = None
+        self._result = None
+
+    @property
+    def finished(self):
+        return self.state in ("succeeded", "failed")
+
+    @property
+    def result(self):
+        """Image bytes, read from the shared job directory for jobs another worker ran"""
+        if self._result is None and self.result_path:
+            try:
+                with open(self.result_path, "rb") as f:
+                    return f.read()
+            except OSError:
+                return None
+        return self._result
+
+    @result.setter
+    def result(self, value):
+        self._result = value
+
+    def record(self):
+        """JSON-safe state for the shared job directory; never includes the password"""
+        params = {key: value for key, value in self.params.items() if key != "password"}
+        return {
+            "id": self.id,
+            "request_id": self.request_id,
+            "params": params,
+            "callback_url": self.callback_url,
+            "state": self.state,
+            "info": {key: self.info.get(key) for key in ("phase", "chart_ready", "ready_time", "cached")},
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "owner": self.owner,
+            "credentials": self.credentials,
+            "result_path": self.result_path
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls.__new__(cls)
+        job.id = record["id"]
+        job.request_id = record.get("request_id")
+        job.params = record.get("params") or {}
+        job.callback_url = record.get("callback_url")
+        job.state = record["state"]
+        job.info = {key: value for key, value in (record.get("info") or {}).items() if value is not None}
+        job.error = record.get("error")
+        job.created_at = record["created_at"]
+        job.started_at = record.get("started_at")
+        job.finished_at = record.get("finished_at")
+        job.owner = record.get("owner")
+        job.credentials = record.get("credentials", False)
+        job.result_path = record.get("result_path")
+        job._result = None
+        return job
+
+    def to_dict(self, include_image=False):
+        job = {
+            "job_id": self.id,
+            "request_id": self.request_id,
+            "state": self.state,
+            "phase": self.info.get("phase"),
+            "question_id": self.params.get("question_id"),
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            "finished_at": datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None
+        }
+        if self.started_at:
+            job["processing_time"] = round((self.finished_at or time.time()) - self.started_at, 2)
+        if self.state == "succeeded":
+            result = self.result
+            job["result"] = {
+                "image_size": len(result) if result is not None else None,
+                "chart_ready": self.info.get("chart_ready"),
+                "ready_time": self.info.get("ready_time"),
+                "cached": self.info.get("cached", False)
+            }
+            if include_image and result is not None:
+                job["result"]["image_base64"] = base64.b64encode(result).decode()
+        if self.error:
+            job["error"] = self.error
+        return job
+
+
+def check_callback_url(url):
+    """Validate a job's callback_url against CALLBACK_ALLOWED_HOSTS"""
+    if url is None:
+        return None
+    parts = urlsplit(str(url))
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise ValueError("callback_url must be an http or https URL")
+    if not any(host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+               for allowed in CALLBACK_ALLOWED_HOSTS):
+        raise ValueError(f"callback_url host '{host}' is not allowed (see JOB_CALLBACK_HOSTS)")
+    return url
+
+
+def _process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobManager:
+    """Runs capture jobs on a bounded worker pool and tracks their progress.
+
+    Every state change is written to JOB_DIR, so a status or image request can
+    be answered by whichever gunicorn worker receives it. A queued job whose
+    worker exits (shutdown, max_requests recycling or a crash) is left in the
+    directory unowned and adopted by the next worker that starts or looks it up.
+    Passwords are never written there, so a job submitted with one fails
+    instead of moving to another worker.
+    """
+
+    def __init__(self, capture, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING,
+                 retention=JOB_RETENTION_SECONDS, directory=JOB_DIR):
+        self.capture = capture
+        self.max_pending = max_pending
+        self.retention = retention
+        self.directory = directory
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="capture-job")
+        self.http = urllib3.PoolManager(retries=False, timeout=CALLBACK_TIMEOUT)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pruned_at = 0
+        self._closed = False
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    # Shared job directory
+
+    def _path(self, job_id, extension="json"):
+        return os.path.join(self.directory, f"{job_id}.{extension}")
+
+    def _persist(self, job):
+        if not self.directory:
+            return
+        path = self._path(job.id)
+        try:
+            # Records hold usernames and callback URLs, so keep them private to the service user
+            fd = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(job.record(), f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"Failed to persist job {job.id}: {e}")
+
+    def _save_result(self, job):
+        if not self.directory:
+            return
+        path = self._path(job.id, "img")
+        try:
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(job.result)
+            os.replace(f"{path}.tmp", path)
+            job.result_path = path
+        except OSError as e:
+            logger.warning(f"Failed to persist image of job {job.id}: {e}")
+
+    def _load(self, job_id):
+        if not self.directory or not _JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                return CaptureJob.from_record(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _orphaned(self, job):
+        if job.finished or job.owner == os.getpid():
+            return False
+        if job.owner is None:
+            # Only jobs that never started are handed back
+            return job.state == "queued"
+        return not _process_alive(job.owner)
+
+    def _adopt(self, job_id):
+        """Take over an unfinished job whose worker has exited; None if it is no longer orphaned"""
+        with open(os.path.join(self.directory, ".adopt.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            job = self._load(job_id)
+            if job is None or not self._orphaned(job):
+                return None
+            job.owner = os.getpid()
+            if job.credentials:
+                job.state = "failed"
+                job.error = "The worker holding this job's credentials exited before it finished; resubmit it"
+                job.finished_at = time.time()
+            else:
+                job.state = "queued"
+                job.info["phase"] = "queued"
+                job.started_at = None
+            self._persist(job)
+        if job.finished:
+            logger.warning(f"Job {job.id} failed: its worker exited and its credentials were not stored")
+            if job.callback_url:
+                self._notify(job)
+            return job
+        with self._lock:
+            self._jobs[job.id] = job
+        logger.info(f"Job {job.id} adopted from an exited worker")
+        self.executor.submit(self._run, job)
+        return job
+
+    def adopt_orphans(self):
+        """Run every unfinished job left behind by exited workers"""
+        if not self.directory or self._closed:
+            return 0
+        adopted = 0
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                job = self._load(name[:-len(".json")])
+                if job is not None and self._orphaned(job):
+                    job = self._adopt(job.id)
+                    if job is not None and not job.finished:
+                        adopted += 1
+        if adopted:
+            logger.info(f"Adopted {adopted} jobs left behind by exited workers")
+        return adopted
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+        held = [job for job in self._jobs.values() if job._result is not None and job.finished]
+        total = sum(len(job._result) for job in held)
+        for job in sorted(held, key=lambda job: job.finished_at or 0):
+            if total <= JOB_RESULT_MAX_BYTES:
+                break
+            # Oldest first; the job stays visible, its image is gone
+            total -= len(job._result)
+            job.result = None
+            logger.info(f"Dropped the in-memory image of job {job.id} (over {JOB_RESULT_MAX_BYTES:,} bytes held)")
+        if not self.directory or time.time() - self._pruned_at < JOB_PRUNE_INTERVAL:
+            return
+        self._pruned_at = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            job = self._load(name[:-len(".json")])
+            if job is not None and job.finished and job.finished_at and job.finished_at < cutoff:
+                for extension in ("json", "img"):
+                    try:
+                        os.remove(self._path(job.id, extension))
+                    except OSError:
+                        pass
+
+    def submit(self, params, callback_url=None):
+        """Queue a capture and return its job immediately"""
+        callback_url = check_callback_url(callback_url)
+        with self._lock:
+            self._prune()
+            pending = sum(1 for job in self._jobs.values() if not job.finished)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"Job queue is full ({pending} pending)")
+            job = CaptureJob(params, callback_url)
+            self._jobs[job.id] = job
+        self._persist(job)
+
+        logger.info(f"Job {job.id} queued for question {params.get('question_id')}")
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """A job run by this worker, or the shared record of one run by another"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        job = self._load(job_id)
+        if job is not None and not self._closed and self._orphaned(job):
+            return self._adopt(job_id) or self._load(job_id)
+        return job
+
+    def _run(self, job):
+        # Claim the job in one step under the lock shutdown() hands queued jobs back under,
+        # so a job is either run here or handed back, never both
+        with self._lock:
+            if job.state != "queued" or job.owner != os.getpid():
+                return
+            job.state = "running"
+            job.started_at = time.time()
+        # Worker threads start with an empty context; log and trace under the submitting request's ID
+        tokens = begin_request(job.request_id, f"job {job.id}")
+        try:
+            self._execute(job)
+        finally:
+            end_request(tokens)
+
+    def _execute(self, job):
+        # Phase changes are written through so other workers report where the capture is
+        job.info = _JobInfo(lambda: self._persist(job), job.info)
+        self._persist(job)
+        logger.info(f"Job {job.id} started")
+        try:
+            job.result = self.capture(info=job.info, **job.params)
+            size = len(job.result)
+            self._save_result(job)
+            if job.result_path:
+                # Served from the job directory from now on
+                job.result = None
+            job.state = "succeeded"
+            job.info["phase"] = "done"
+            logger.info(f"Job {job.id} succeeded ({size:,} bytes)")
+        except Exception as e:
+            job.error = str(e)
+            job.state = "failed"
+            logger.error(f"Job {job.id} failed during {job.info.get('phase')}: {e}")
+        finally:
+            job.finished_at = time.time()
+            self._persist(job)
+
+        if job.callback_url:
+            self._notify(job)
+
+    def _notify(self, job):
+        """POST the finished job, including the image, to its callback URL"""
+        try:
+            response = self.http.request(
+                "POST",
+                job.callback_url,
+                body=json.dumps(job.to_dict(include_image=True)).encode(),
+                headers={"Content-Type": "application/json"}
+            )
+            logger.info(f"Job {job.id} callback delivered: HTTP {response.status}")
+        except Exception as e:
+            logger.error(f"Job {job.id} callback to {job.callback_url} failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return states
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """Stop taking jobs; optionally hand queued ones back so only running captures are waited for"""
+        self._closed = True
+        if cancel_pending:
+            handed_back = 0
+            with self._lock:
+                for job in [job for job in self._jobs.values() if job.state == "queued"]:
+                    if self.directory and not job.credentials:
+                        # Unowned: the next worker to start or look the job up runs it
+                        job.owner = None
+                        handed_back += 1
+                    else:
+                        job.state = "failed"
+                        job.error = "Service shutting down"
+                        job.finished_at = time.time()
+                    self._persist(job)
+            if handed_back:
+                logger.info(f"Handed back {handed_back} queued jobs for another worker to run")
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_pending)
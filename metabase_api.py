@@ -0,0 +1,108 @@
+# metabase_api.py
+import hashlib
+import json
+import logging
+import time
+
+import urllib3
+
+logger = logging.getLogger(__name__)
+
+# HTTP client configuration
+API_CONNECT_TIMEOUT = 5
+API_READ_TIMEOUT = 30
+API_POOL_MAXSIZE = 8
+SESSION_HEADER = "X-Metabase-Session"
+
+
+class MetabaseAPIError(Exception):
+    """Raised when a Metabase API call fails or returns a non-2xx status"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def result_fingerprint(card, result):
+    """Hash of a card definition's last change and a query result already fetched for it"""
+    card = card or {}
+    data = (result or {}).get("data") or {}
+    payload = {
+        "updated_at": card.get("updated_at"),
+        "display": card.get("display"),
+        "cols": [col.get("name") for col in data.get("cols") or []],
+        "rows": data.get("rows") or []
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class MetabaseAPIClient:
+    """Thin Metabase REST client over a pooled keep-alive HTTP connection"""
+
+    def __init__(self, base_url, maxsize=API_POOL_MAXSIZE):
+        self.base_url = base_url.rstrip("/")
+        self.http = urllib3.PoolManager(
+            maxsize=maxsize,
+            block=False,
+            retries=False,
+            timeout=urllib3.Timeout(connect=API_CONNECT_TIMEOUT, read=API_READ_TIMEOUT)
+        )
+
+    def request_json(self, method, path, body=None, session_token=None):
+        """Send a JSON request and return the decoded JSON response"""
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        if session_token:
+            headers[SESSION_HEADER] = session_token
+
+        start_time = time.time()
+        try:
+            response = self.http.request(
+                method,
+                f"{self.base_url}{path}",
+                body=json.dumps(body).encode() if body is not None else None,
+                headers=headers
+            )
+        except urllib3.exceptions.HTTPError as e:
+            raise MetabaseAPIError(f"{method} {path} failed: {e}")
+
+        elapsed = time.time() - start_time
+        logger.info(f"  - {method} {path} -> {response.status} ({elapsed * 1000:.0f} ms)")
+
+        if response.status >= 400:
+            raise MetabaseAPIError(f"{method} {path} returned HTTP {response.status}", status=response.status)
+
+        try:
+            return json.loads(response.data.decode("utf-8")) if response.data else None
+        except ValueError as e:
+            raise MetabaseAPIError(f"{method} {path} returned invalid JSON: {e}", status=response.status)
+
+    def create_session(self, username, password):
+        """Exchange credentials for a session token via POST /api/session"""
+        result = self.request_json("POST", "/api/session", {"username": username, "password": password})
+        token = (result or {}).get("id")
+        if not token:
+            raise MetabaseAPIError("Session response did not contain a token")
+        return token
+
+    def get_version(self):
+        """Metabase version tag from the unauthenticated GET /api/session/properties"""
+        result = self.request_json("GET", "/api/session/properties") or {}
+        return (result.get("version") or {}).get("tag")
+
+    def get_card(self, card_id, session_token):
+        """Card definition via GET /api/card/{id}"""
+        return self.request_json("GET", f"/api/card/{card_id}", session_token=session_token)
+
+    def query_card(self, card_id, session_token):
+        """Run the card's query via POST /api/card/{id}/query"""
+        result = self.request_json("POST", f"/api/card/{card_id}/query", {}, session_token=session_token)
+        if (result or {}).get("status") not in (None, "completed"):
+            raise MetabaseAPIError(f"Card {card_id} query did not complete: {result.get('error') or result.get('status')}")
+        return result
+
+    def card_fingerprint(self, card_id, session_token):
+        """Hash of the card definition's last change and its current query result"""
+        card = self.get_card(card_id, session_token)
+        return result_fingerprint(card, self.query_card(card_id, session_token))
@@ -0,0 +1,220 @@
+# metrics.py
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import span
+
+# Metrics configuration
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                for key, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = self.header()
+        for key, (counts, total) in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total!r}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+CAPTURE_PHASE_SECONDS = registry.histogram(
+    "metabase_capture_phase_seconds", "Duration of each capture phase", ["phase"])
+CAPTURE_STEP_SECONDS = registry.histogram(
+    "metabase_capture_step_seconds", "Duration of capture sub-steps", ["step"])
+REQUEST_SECONDS = registry.histogram(
+    "metabase_request_seconds", "End-to-end request duration by endpoint", ["endpoint"])
+CAPTURES_TOTAL = registry.counter(
+    "metabase_captures_total", "Browser captures by kind and outcome", ["kind", "outcome"])
+CAPTURE_FAILURES_TOTAL = registry.counter(
+    "metabase_capture_failures_total", "Failed captures by the phase they failed in", ["phase"])
+CACHE_LOOKUPS_TOTAL = registry.counter(
+    "metabase_image_cache_lookups_total", "Image cache lookups by result (hit, unchanged, coalesced, miss)",
+    ["result"])
+LOGINS_TOTAL = registry.counter(
+    "metabase_logins_total", "Authentications by method (reused, api, form, failed)", ["method"])
+CAPTURE_MODE_TOTAL = registry.counter(
+    "metabase_capture_mode_total", "Chart captures by how the image was produced", ["mode"])
+FULL_PAGE_FALLBACKS_TOTAL = registry.counter(
+    "metabase_full_page_fallbacks_total", "Chart captures that fell back to a full-page screenshot")
+NATIVE_FALLBACKS_TOTAL = registry.counter(
+    "metabase_native_fallbacks_total", "Native render requests handed to the browser, by card display",
+    ["display"])
+ADMISSION_REJECTIONS_TOTAL = registry.counter(
+    "metabase_admission_rejections_total", "Captures turned away by admission control", ["reason"])
+
+POOL_DRIVERS = registry.gauge(
+    "metabase_driver_pool_drivers", "Pooled WebDrivers by state", ["state"])
+ADMISSION_QUEUE_DEPTH = registry.gauge(
+    "metabase_admission_queue_depth", "Captures waiting for admission")
+ADMISSION_ACTIVE = registry.gauge(
+    "metabase_admission_active", "Captures currently holding a slot")
+BROWSER_RSS_BYTES = registry.gauge(
+    "metabase_browser_rss_bytes", "Resident memory of spawned browser processes")
+
+
+def _record(timings, name, elapsed):
+    if timings is not None:
+        timings[name] = round(timings.get(name, 0.0) + elapsed, 3)
+
+
+@contextmanager
+def timed_step(step, timings=None):
+    """Observe a sub-step in CAPTURE_STEP_SECONDS and add it to a per-capture timings dict"""
+    start_time = time.perf_counter()
+    try:
+        with span(step):
+            yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        CAPTURE_STEP_SECONDS.observe(elapsed, step=step)
+        _record(timings, step, elapsed)
+
+
+class PhaseTimer:
+    """Times consecutive capture phases; starting a phase ends the previous one.
+
+    Use it as a context manager so the last phase is also ended when a capture fails.
+    """
+
+    def __init__(self, timings=None):
+        self.timings = timings
+        self.phase = None
+        self.started_at = None
+        self._span = None
+
+    def start(self, phase):
+        self.stop()
+        self.phase = phase
+        self.started_at = time.perf_counter()
+        self._span = span(f"phase.{phase}")
+        self._span.__enter__()
+
+    def stop(self, error=None):
+        """End the current phase; error marks its span as failed"""
+        if self.phase is None:
+            return
+        phase_span, self._span = self._span, None
+        try:
+            elapsed = time.perf_counter() - self.started_at
+            CAPTURE_PHASE_SECONDS.observe(elapsed, phase=self.phase)
+            _record(self.timings, self.phase, elapsed)
+        finally:
+            self.phase = None
+            # Always leave the span, or whatever runs next in this context nests under it
+            if error is None:
+                phase_span.__exit__(None, None, None)
+            else:
+                phase_span.__exit__(type(error), error, error.__traceback__)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop(exc)
@@ -0,0 +1,368 @@
+# mock_metabase.py
+#
+# Minimal stand-in for a Metabase instance, for benchmarking the screenshot
+# service without a real Metabase:
+#   python mock_metabase.py --port 3000 --delay 1.5 --popup
+#   METABASE_BASE_URL=http://localhost:3000 python run.py
+#
+# It serves the login page, the session API, /question/{id} and
+# /dashboard/{id} pages that fetch their data through the same query
+# endpoints the readiness script watches, plus the card API used by the
+# freshness check.
+import argparse
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import Flask, Response, jsonify, redirect, request
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+# Mock configuration (overridden from the command line)
+MOCK_CONFIG = {
+    "username": None,      # None accepts any credentials
+    "password": None,
+    "delay": 1.0,          # seconds each card query takes
+    "jitter": 0.2,         # +/- fraction of delay
+    "popup": False,        # show an onboarding modal over the chart
+    "chart_type": "auto",  # line, bar, table or auto (by question id)
+    "volatile": True,      # vary query results so freshness checks see new data
+    "version": "v0.50.0",
+    "bundle_kb": 2048,     # size of the fake JS bundle every page loads
+    "dashcards": 4
+}
+CHART_TYPES = ["line", "bar", "table"]
+SESSION_COOKIE_NAME = "metabase.SESSION"
+
+app = Flask(__name__)
+_sessions = set()
+_sessions_lock = threading.Lock()
+_started_at = datetime.now().isoformat()
+
+
+def chart_type(card_id):
+    if MOCK_CONFIG["chart_type"] != "auto":
+        return MOCK_CONFIG["chart_type"]
+    return CHART_TYPES[int(hashlib.md5(str(card_id).encode()).hexdigest(), 16) % len(CHART_TYPES)]
+
+
+def authenticated():
+    token = request.headers.get("X-Metabase-Session") or request.cookies.get(SESSION_COOKIE_NAME)
+    with _sessions_lock:
+        return token in _sessions
+
+
+def bundle_path():
+    return f"/app/dist/app-main.{MOCK_CONFIG['version']}.js"
+
+
+def card_rows(card_id):
+    seed = int(hashlib.md5(str(card_id).encode()).hexdigest()[:8], 16)
+    rows = []
+    for month in range(12):
+        value = 100 + (seed % 50) + 40 * math.sin((month + seed % 7) / 2)
+        if MOCK_CONFIG["volatile"]:
+            value += random.uniform(-5, 5)
+        rows.append([f"2026-{month + 1:02d}", round(value, 1)])
+    return rows
+
+
+def simulate_query():
+    delay = MOCK_CONFIG["delay"] * (1 + random.uniform(-MOCK_CONFIG["jitter"], MOCK_CONFIG["jitter"]))
+    time.sleep(max(0.0, delay))
+
+
+def query_result(card_id):
+    simulate_query()
+    return {
+        "status": "completed",
+        "row_count": 12,
+        "data": {
+            "cols": [
+                {"name": "month", "display_name": "Month", "base_type": "type/Text"},
+                {"name": "count", "display_name": "Count", "base_type": "type/Float"}
+            ],
+            "rows": card_rows(card_id)
+        }
+    }
+
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title} · Metabase</title>
+<link rel="icon" href="/favicon.ico">
+<link rel="stylesheet" href="/app/dist/styles.css">
+<script src="{bundle}"></script>
+<style>
+body {{ font-family: sans-serif; margin: 0; background: #f9fbfc; }}
+.QueryBuilder-section {{ padding: 24px; }}
+.Visualization {{ width: 900px; height: 500px; background: #fff; border: 1px solid #eee; }}
+.DashCard .Visualization {{ width: 100%; height: 300px; }}
+[data-testid='dashboard-grid'] {{ display: grid; grid-template-columns: 1fr 1fr; gap: 16px; padding: 24px; }}
+.modal-backdrop {{ position: fixed; inset: 0; background: rgba(0,0,0,.4); }}
+.modal {{ position: fixed; top: 120px; left: 300px; width: 400px; padding: 24px; background: #fff; }}
+</style>
+</head>
+<body>
+{body}
+<script>
+const SHOW_POPUP = {popup};
+
+function renderChart(root, type, result) {{
+    const rows = result.data.rows;
+    if (type === 'table') {{
+        root.innerHTML = '<table class="TableInteractive"><thead><tr><th>Month</th><th>Count</th></tr></thead><tbody>' +
+            rows.map(r => '<tr><td>' + r[0] + '</td><td>' + r[1] + '</td></tr>').join('') + '</tbody></table>';
+        return;
+    }}
+    const w = root.clientWidth - 40, h = root.clientHeight - 40;
+    const max = Math.max(...rows.map(r => r[1]));
+    const x = i => 20 + i * w / (rows.length - 1 || 1);
+    const y = v => 20 + h - v / max * h;
+    let shapes;
+    if (type === 'bar') {{
+        const bw = w / rows.length * 0.7;
+        shapes = rows.map((r, i) => '<rect x="' + (20 + i * w / rows.length) + '" y="' + y(r[1]) + '" width="' + bw +
+            '" height="' + (20 + h - y(r[1])) + '" fill="#509ee3"/>').join('');
+    }} else {{
+        shapes = '<path fill="none" stroke="#509ee3" stroke-width="3" d="' +
+            rows.map((r, i) => (i ? 'L' : 'M') + x(i) + ' ' + y(r[1])).join(' ') + '"/>';
+    }}
+    root.innerHTML = '<svg class="chart-' + type + '" width="' + (w + 40) + '" height="' + (h + 40) + '">' + shapes + '</svg>';
+}}
+
+function load(root, url, type) {{
+    root.innerHTML = '<div class="LoadingSpinner">Loading...</div>';
+    fetch(url, {{ method: 'POST', headers: {{ 'Content-Type': 'application/json' }}, body: '{{}}' }})
+        .then(response => response.json())
+        .then(result => renderChart(root, type, result));
+}}
+
+document.querySelectorAll('[data-query-url]').forEach(root => load(root, root.dataset.queryUrl, root.dataset.chartType));
+
+if (SHOW_POPUP) {{
+    setTimeout(() => {{
+        document.body.insertAdjacentHTML('beforeend',
+            '<div class="modal-backdrop"></div><div class="modal" role="dialog" aria-modal="true">' +
+            '<h2>Welcome to Metabase</h2><p>Take a quick tour?</p>' +
+            '<button aria-label="Close" class="close">Not now</button></div>');
+        document.querySelector('.modal .close').onclick = () =>
+            document.querySelectorAll('.modal, .modal-backdrop').forEach(e => e.remove());
+    }}, 300);
+}}
+</script>
+</body>
+</html>
+"""
+
+LOGIN_BODY = """
+<div class="login">
+<form id="login-form">
+<input type="text" name="username" placeholder="nicetoseeyou@email.com">
+<input type="password" name="password">
+<button type="submit">Sign in</button>
+</form>
+<p class="error" style="display:none">Invalid credentials</p>
+</div>
+<script>
+document.getElementById('login-form').addEventListener('submit', event => {
+    event.preventDefault();
+    const form = event.target;
+    fetch('/api/session', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ username: form.username.value, password: form.password.value })
+    }).then(response => {
+        if (response.ok) {
+            window.location = new URLSearchParams(window.location.search).get('redirect') || '/';
+        } else {
+            document.querySelector('.error').style.display = 'block';
+        }
+    });
+});
+</script>
+"""
+
+
+def page(title, body):
+    html = PAGE_TEMPLATE.format(
+        title=title,
+        body=body,
+        bundle=bundle_path(),
+        popup=json.dumps(MOCK_CONFIG["popup"])
+    )
+    return Response(html, mimetype="text/html")
+
+
+def login_redirect():
+    return redirect(f"/auth/login?redirect={request.path}")
+
+
+@app.route('/auth/login')
+def login_page():
+    # The real login page renders its form client-side after the bundle loads
+    return page("Login", LOGIN_BODY)
+
+
+@app.route('/api/session', methods=['POST'])
+def create_session():
+    data = request.json or {}
+    if MOCK_CONFIG["username"] and (data.get("username") != MOCK_CONFIG["username"]
+                                    or data.get("password") != MOCK_CONFIG["password"]):
+        return jsonify({"errors": {"password": "did not match stored password"}}), 401
+    token = str(uuid.uuid4())
+    with _sessions_lock:
+        _sessions.add(token)
+    response = jsonify({"id": token})
+    response.set_cookie(SESSION_COOKIE_NAME, token, httponly=True, samesite="Lax")
+    return response
+
+
+@app.route('/api/health')
+def health():
+    return jsonify({"status": "ok"})
+
+
+@app.route('/api/session/properties')
+def session_properties():
+    return jsonify({"version": {"tag": MOCK_CONFIG["version"], "date": "2026-01-01"}, "site-name": "Mock Metabase"})
+
+
+@app.route('/api/card/<card_id>')
+def get_card(card_id):
+    if not authenticated():
+        return "Unauthenticated", 401
+    return jsonify({
+        "id": int(card_id) if card_id.isdigit() else card_id,
+        "name": f"Question {card_id}",
+        "display": chart_type(card_id),
+        "updated_at": _started_at,
+        "visualization_settings": {"graph.dimensions": ["month"], "graph.metrics": ["count"]}
+    })
+
+
+@app.route('/api/card/<card_id>/query', methods=['POST'])
+def query_card(card_id):
+    if not authenticated():
+        return "Unauthenticated", 401
+    return jsonify(query_result(card_id))
+
+
+@app.route('/api/dashboard/<dashboard_id>/dashcard/<dashcard_id>/card/<card_id>/query', methods=['POST'])
+def query_dashcard(dashboard_id, dashcard_id, card_id):
+    if not authenticated():
+        return "Unauthenticated", 401
+    return jsonify(query_result(card_id))
+
+
+@app.route('/')
+def home():
+    if not authenticated():
+        return login_redirect()
+    return page("Home", "<main class='Home'><h1>Home</h1></main>")
+
+
+@app.route('/question/<question_id>')
+def question(question_id):
+    if not authenticated():
+        return login_redirect()
+    kind = chart_type(question_id)
+    body = f"""
+<main class="QueryBuilder">
+<section class="QueryBuilder-section">
+<h1 class="Card-title">Question {question_id}</h1>
+<div class="Visualization" data-testid="query-visualization-root" data-chart-type="{kind}"
+     data-query-url="/api/card/{question_id}/query"></div>
+</section>
+</main>"""
+    return page(f"Question {question_id}", body)
+
+
+@app.route('/dashboard/<dashboard_id>')
+def dashboard(dashboard_id):
+    if not authenticated():
+        return login_redirect()
+    cards = []
+    for index in range(MOCK_CONFIG["dashcards"]):
+        card_id = int(dashboard_id) * 100 + index if dashboard_id.isdigit() else index
+        kind = chart_type(card_id)
+        cards.append(f"""
+<div class="DashCard" data-dashcard-key="{index + 1}">
+<h3 class="Card-title">Card {card_id}</h3>
+<div class="Visualization" data-chart-type="{kind}"
+     data-query-url="/api/dashboard/{dashboard_id}/dashcard/{index + 1}/card/{card_id}/query"></div>
+</div>""")
+    body = f"""<main class="Dashboard" data-testid="dashboard">
+<div class="DashboardGrid" data-testid="dashboard-grid">{''.join(cards)}</div>
+</main>"""
+    return page(f"Dashboard {dashboard_id}", body)
+
+
+@app.route('/app/dist/<path:name>')
+def static_asset(name):
+    # Immutable, versioned bundles like the real ones, so browser caching has something to work with
+    if name.endswith(".css"):
+        body = "/* mock stylesheet */\n" + ".x{color:#000}\n" * 1024
+        mimetype = "text/css"
+    else:
+        body = "/* mock bundle */\n" + ("window.__mockBundle = (window.__mockBundle || 0) + 1;\n" *
+                                         (MOCK_CONFIG["bundle_kb"] * 1024 // 56))
+        mimetype = "application/javascript"
+    response = Response(body, mimetype=mimetype)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    response.headers["ETag"] = f'"{MOCK_CONFIG["version"]}-{name}"'
+    return response
+
+
+@app.route('/favicon.ico')
+def favicon():
+    return Response(b"", mimetype="image/x-icon")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Metabase server for benchmarking")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--delay", type=float, default=MOCK_CONFIG["delay"], help="card query latency in seconds")
+    parser.add_argument("--jitter", type=float, default=MOCK_CONFIG["jitter"])
+    parser.add_argument("--popup", action="store_true", help="show an onboarding modal on every page")
+    parser.add_argument("--chart-type", choices=["auto"] + CHART_TYPES, default=MOCK_CONFIG["chart_type"])
+    parser.add_argument("--stable", action="store_true", help="return identical query results every time")
+    parser.add_argument("--version", default=MOCK_CONFIG["version"])
+    parser.add_argument("--bundle-kb", type=int, default=MOCK_CONFIG["bundle_kb"])
+    parser.add_argument("--dashcards", type=int, default=MOCK_CONFIG["dashcards"])
+    args = parser.parse_args()
+
+    MOCK_CONFIG.update({
+        "username": args.username,
+        "password": args.password,
+        "delay": args.delay,
+        "jitter": args.jitter,
+        "popup": args.popup,
+        "chart_type": args.chart_type,
+        "volatile": not args.stable,
+        "version": args.version,
+        "bundle_kb": args.bundle_kb,
+        "dashcards": args.dashcards
+    })
+    logger.info(f"Mock Metabase on http://{args.host}:{args.port} with {MOCK_CONFIG}")
+    app.run(host=args.host, port=args.port, debug=False, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+# native_render.py
+import io
+import logging
+import math
+import time
+
+from raster import Image
+from metrics import timed_step
+
+try:
+    from PIL import ImageDraw, ImageFont
+except ImportError:
+    ImageDraw = ImageFont = None
+
+logger = logging.getLogger(__name__)
+
+# Native renderer configuration
+NATIVE_WIDTH = 1000
+NATIVE_HEIGHT = 500
+NATIVE_SUPERSAMPLE = 2  # drawn at this multiple and downscaled, for anti-aliased lines and text
+NATIVE_MAX_POINTS = 1000
+NATIVE_MAX_BARS = 120
+NATIVE_TABLE_MAX_ROWS = 50
+NATIVE_DISPLAYS = ("line", "bar", "table")
+
+PALETTE = ["#509EE3", "#88BF4D", "#A989C5", "#EF8C8C", "#F9D45C", "#F2A86F", "#98D9D9", "#7172AD"]
+TEXT_COLOR = "#4C5773"
+LABEL_COLOR = "#949AAB"
+GRID_COLOR = "#EDF2F5"
+BORDER_COLOR = "#DCDFE0"
+HEADER_BACKGROUND = "#F9FBFC"
+
+NUMERIC_TYPES = ("type/Integer", "type/BigInteger", "type/Float", "type/Decimal", "type/Number")
+
+
+class NativeUnsupported(Exception):
+    """Raised when a card cannot be drawn natively and must go through the browser"""
+
+    def __init__(self, message, display=None):
+        super().__init__(message)
+        self.display = display
+        # What the attempt already fetched, so the browser fallback need not query again
+        self.card = None
+        self.result = None
+
+
+def available():
+    return Image is not None and ImageDraw is not None
+
+
+# Chart spec from the card definition and query result
+
+def is_numeric(col, rows, index):
+    if col.get("base_type") in NUMERIC_TYPES:
+        return True
+    values = [row[index] for row in rows if row[index] is not None]
+    return bool(values) and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values)
+
+
+def chart_spec(card, result):
+    """Columns and series to draw, or NativeUnsupported for anything the browser must handle"""
+    display = card.get("display")
+    if display not in NATIVE_DISPLAYS:
+        raise NativeUnsupported(f"display '{display}' is not supported natively", display)
+    data = (result or {}).get("data") or {}
+    cols = data.get("cols") or []
+    rows = data.get("rows") or []
+    if not cols:
+        raise NativeUnsupported("query returned no columns", display)
+    settings = card.get("visualization_settings") or {}
+    names = [col.get("name") for col in cols]
+    spec = {"display": display, "title": card.get("name") or "", "row_count": len(rows)}
+
+    if display == "table":
+        indexes = list(range(len(cols)))
+        enabled = [column.get("name") for column in settings.get("table.columns") or []
+                   if column.get("enabled", True) and column.get("name") in names]
+        if enabled:
+            indexes = [names.index(name) for name in enabled]
+        spec["columns"] = [cols[i].get("display_name") or cols[i].get("name") for i in indexes]
+        spec["numeric"] = [is_numeric(cols[i], rows, i) for i in indexes]
+        spec["rows"] = [[row[i] for i in indexes] for row in rows[:NATIVE_TABLE_MAX_ROWS]]
+        return spec
+
+    if settings.get("stackable.stack_type") or settings.get("graph.y_axis.scale") in ("log", "pow"):
+        raise NativeUnsupported("stacked or non-linear axes are not supported natively", display)
+    dimensions = [name for name in settings.get("graph.dimensions") or [] if name]
+    if len(dimensions) > 1:
+        raise NativeUnsupported("breakout series are not supported natively", display)
+    dimension = dimensions[0] if dimensions else names[0]
+    if dimension not in names:
+        raise NativeUnsupported(f"dimension '{dimension}' is not in the result", display)
+    x_index = names.index(dimension)
+    metrics = [name for name in settings.get("graph.metrics") or [] if name in names]
+    if not metrics:
+        metrics = [name for i, name in enumerate(names) if i != x_index and is_numeric(cols[i], rows, i)]
+    if not metrics:
+        raise NativeUnsupported("no numeric metric to plot", display)
+    if len(rows) > (NATIVE_MAX_BARS if display == "bar" else NATIVE_MAX_POINTS):
+        raise NativeUnsupported(f"{len(rows)} rows is too many to draw natively", display)
+
+    series = []
+    for name in metrics:
+        index = names.index(name)
+        if not is_numeric(cols[index], rows, index):
+            raise NativeUnsupported(f"metric '{name}' is not numeric", display)
+        series.append({
+            "name": cols[index].get("display_name") or name,
+            "values": [row[index] for row in rows]
+        })
+    spec["x_label"] = cols[x_index].get("display_name") or dimension
+    spec["x"] = [row[x_index] for row in rows]
+    spec["series"] = series
+    return spec
+
+
+# Drawing helpers
+
+def nice_ticks(low, high, count=5):
+    """Round axis ticks covering [low, high]; always at least two distinct values"""
+    if not (math.isfinite(low) and math.isfinite(high) and math.isfinite(high - low)):
+        raise ValueError(f"axis range {low}..{high} is not finite")
+    if high - low <= abs(high) * 1e-9:
+        # Equal (or float-equal) values: pad around them so the axis has some height
+        pad = abs(high) * 0.1 or 1
+        low, high = low - pad, high + pad
+    raw_step = (high - low) / count
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(multiple * magnitude for multiple in (1, 2, 2.5, 5, 10) if multiple * magnitude >= raw_step)
+    first = math.floor(low / step)
+    ticks = []
+    index = first
+    while index * step < high + step * 0.5:
+        # Twelve significant digits trims float noise at any magnitude
+        ticks.append(float(f"{index * step:.12g}"))
+        index += 1
+    if ticks[-1] < high:
+        ticks.append(float(f"{index * step:.12g}"))
+    if len(ticks) < 2 or ticks[0] >= ticks[-1]:
+        return [low, high]
+    return ticks
+
+
+def format_number(value, compact=False):
+    if value is None:
+        return ""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return str(value)
+    if compact:
+        for divisor, suffix in ((1e9, "B"), (1e6, "M"), (1e3, "k")):
+            if abs(value) >= divisor:
+                return f"{value / divisor:.1f}".rstrip("0").rstrip(".") + suffix
+    if float(value).is_integer():
+        return f"{int(value):,}"
+    return f"{value:,.2f}".rstrip("0").rstrip(".")
+
+
+def format_label(value):
+    text = str(value) if value is not None else "(empty)"
+    # ISO timestamps from temporal breakouts
+    if len(text) >= 10 and text[4:5] == "-" and "T" in text:
+        text = text.split("T")[0]
+    return text
+
+
+class Canvas:
+    """A supersampled Pillow drawing surface measured in output pixels"""
+
+    def __init__(self, width, height):
+        self.scale = NATIVE_SUPERSAMPLE
+        self.width = width
+        self.height = height
+        self.image = Image.new("RGB", (width * self.scale, height * self.scale), "white")
+        self.draw = ImageDraw.Draw(self.image)
+        self._fonts = {}
+
+    def font(self, size):
+        if size not in self._fonts:
+            try:
+                self._fonts[size] = ImageFont.load_default(size=size * self.scale)
+            except (TypeError, OSError, ImportError):
+                # Pillow < 10.1 or built without FreeType: the bitmap font cannot be sized or anchored
+                raise NativeUnsupported("native rendering needs Pillow >= 10.1 with FreeType")
+        return self._fonts[size]
+
+    def text_width(self, text, size):
+        return self.draw.textlength(text, font=self.font(size)) / self.scale
+
+    def text(self, xy, text, size=12, fill=TEXT_COLOR, anchor="la"):
+        x, y = xy
+        self.draw.text((x * self.scale, y * self.scale), text, font=self.font(size), fill=fill, anchor=anchor)
+
+    def line(self, points, fill, width=1):
+        self.draw.line([(x * self.scale, y * self.scale) for x, y in points], fill=fill,
+                       width=max(1, round(width * self.scale)), joint="curve")
+
+    def rectangle(self, box, fill=None, outline=None):
+        left, top, right, bottom = (value * self.scale for value in box)
+        # Anything thinner than a device pixel is drawn as a single pixel rather than rejected by Pillow
+        self.draw.rectangle((left, top, max(left, right - 1), max(top, bottom - 1)), fill=fill, outline=outline)
+
+    def ellipse(self, center, radius, fill):
+        x, y = center
+        self.draw.ellipse(((x - radius) * self.scale, (y - radius) * self.scale,
+                           (x + radius) * self.scale, (y + radius) * self.scale), fill=fill)
+
+    def truncate(self, text, size, max_width):
+        if self.text_width(text, size) <= max_width:
+            return text
+        while text and self.text_width(text + "…", size) > max_width:
+            text = text[:-1]
+        return text + "…"
+
+    def png(self):
+        image = self.image.resize((self.width, self.height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue()
+
+
+def draw_xy_chart(spec, width=NATIVE_WIDTH, height=NATIVE_HEIGHT):
+    """Line or bar chart with a y grid, category x axis and a legend for multiple series"""
+    canvas = Canvas(width, height)
+    bar = spec["display"] == "bar"
+    series = spec["series"]
+    labels = [format_label(value) for value in spec["x"]]
+    values = [value for s in series for value in s["values"] if value is not None]
+    low, high = (min(values), max(values)) if values else (0, 1)
+    if bar or low > 0 and low < high * 0.5:
+        low = min(low, 0)
+    ticks = nice_ticks(low, max(high, 0) if bar else high)
+    low, high = ticks[0], ticks[-1]
+
+    top = 20
+    if spec["title"]:
+        canvas.text((20, 16), canvas.truncate(spec["title"], 16, width - 40), size=16)
+        top = 48
+    if len(series) > 1:
+        x = 20
+        for index, s in enumerate(series):
+            color = PALETTE[index % len(PALETTE)]
+            canvas.ellipse((x + 5, top + 6), 5, color)
+            canvas.text((x + 14, top), s["name"], size=12)
+            x += 30 + canvas.text_width(s["name"], 12)
+        top += 28
+
+    left = 24 + max(canvas.text_width(format_number(tick, compact=True), 11) for tick in ticks)
+    right = width - 24
+    bottom = height - 44
+    plot_width = right - left
+    plot_height = bottom - top
+
+    def y_at(value):
+        return bottom - (value - low) / (high - low) * plot_height
+
+    for tick in ticks:
+        y = y_at(tick)
+        canvas.line([(left, y), (right, y)], GRID_COLOR)
+        canvas.text((left - 8, y), format_number(tick, compact=True), size=11, fill=LABEL_COLOR, anchor="rm")
+    canvas.line([(left, bottom), (right, bottom)], BORDER_COLOR)
+
+    count = max(1, len(labels))
+    slot = plot_width / count
+    widest = max([canvas.text_width(label, 11) for label in labels] or [0]) + 12
+    if bar:
+        centers = [left + slot * (i + 0.5) for i in range(count)]
+    elif count > 1:
+        # Inset the first and last points so their labels are not clipped
+        inset = min(widest / 2, plot_width / 4)
+        centers = [left + inset + (plot_width - 2 * inset) * i / (count - 1) for i in range(count)]
+    else:
+        centers = [left + plot_width / 2]
+
+    # Thin out x labels so they never overlap
+    every = max(1, math.ceil(widest / max(plot_width / count, 1)))
+    for i, label in enumerate(labels):
+        if i % every == 0:
+            canvas.text((centers[i], bottom + 8), canvas.truncate(label, 11, widest * every), size=11,
+                        fill=LABEL_COLOR, anchor="ma")
+    canvas.text(((left + right) / 2, height - 8), spec["x_label"], size=12, fill=LABEL_COLOR, anchor="md")
+
+    zero = y_at(max(low, 0))
+    for index, s in enumerate(series):
+        color = PALETTE[index % len(PALETTE)]
+        if bar:
+            group = slot * 0.8
+            bar_width = group / len(series)
+            for i, value in enumerate(s["values"]):
+                if value is None or value == 0:
+                    continue
+                x0 = centers[i] - group / 2 + bar_width * index
+                y = y_at(value)
+                canvas.rectangle((x0 + 0.5, min(y, zero), x0 + bar_width - 0.5, max(y, zero)), fill=color)
+        else:
+            segment = []
+            for i, value in enumerate(s["values"]):
+                if value is None:
+                    if len(segment) > 1:
+                        canvas.line(segment, color, width=2)
+                    segment = []
+                    continue
+                segment.append((centers[i], y_at(value)))
+            if len(segment) > 1:
+                canvas.line(segment, color, width=2)
+            if count <= 60:
+                for i, value in enumerate(s["values"]):
+                    if value is not None:
+                        canvas.ellipse((centers[i], y_at(value)), 3, color)
+    return canvas.png()
+
+
+def draw_table(spec, width=NATIVE_WIDTH):
+    """Plain table of the first rows, numbers right-aligned"""
+    row_height = 32
+    rows = spec["rows"]
+    title_height = 44 if spec["title"] else 0
+    footer = spec["row_count"] > len(rows)
+    height = title_height + row_height * (len(rows) + 1) + (28 if footer else 0) + 2
+    cells = [[format_number(value) if numeric else format_label(value) if value is not None else ""
+              for value, numeric in zip(row, spec["numeric"])] for row in rows]
+
+    # Measure on a scratch canvas, then size the image to the table when it is narrower than the maximum
+    measure = Canvas(1, 1)
+    natural = [max([measure.text_width(str(name), 12)] + [measure.text_width(row[i], 12) for row in cells]) + 24
+               for i, name in enumerate(spec["columns"])]
+    title_width = measure.text_width(spec["title"], 16) + 32 if spec["title"] else 0
+    width = min(width, max(int(math.ceil(sum(natural))) + 2, int(math.ceil(title_width)), 240))
+    factor = min(1.0, (width - 2) / max(sum(natural), 1))
+    widths = [w * factor for w in natural]
+
+    canvas = Canvas(width, height)
+    if spec["title"]:
+        canvas.text((16, 14), canvas.truncate(spec["title"], 16, width - 32), size=16)
+
+    y = title_height
+    canvas.rectangle((0, y, width, y + row_height), fill=HEADER_BACKGROUND)
+    for row_index, row in enumerate([[str(name) for name in spec["columns"]]] + cells):
+        x = 1
+        for value, column_width, numeric in zip(row, widths, spec["numeric"]):
+            text = canvas.truncate(value, 12, column_width - 24)
+            if numeric:
+                canvas.text((x + column_width - 12, y + row_height / 2), text, size=12,
+                            fill=LABEL_COLOR if row_index == 0 else TEXT_COLOR, anchor="rm")
+            else:
+                canvas.text((x + 12, y + row_height / 2), text, size=12,
+                            fill=LABEL_COLOR if row_index == 0 else TEXT_COLOR, anchor="lm")
+            x += column_width
+        y += row_height
+        canvas.line([(0, y), (width, y)], BORDER_COLOR)
+    if footer:
+        canvas.text((16, y + 8), f"Showing first {len(rows):,} of {spec['row_count']:,} rows", size=11,
+                    fill=LABEL_COLOR)
+    return canvas.png()
+
+
+class NativeRenderer:
+    """Draws simple questions straight from Metabase's API, without a browser"""
+
+    def __init__(self, api_client, width=NATIVE_WIDTH, height=NATIVE_HEIGHT):
+        self.api_client = api_client
+        self.width = width
+        self.height = height
+
+    def render(self, card_id, session_token, info=None):
+        """PNG of a card drawn from its definition and query result; raises NativeUnsupported"""
+        info = {} if info is None else info
+        if not available():
+            raise NativeUnsupported("Pillow is required for native rendering (pip install Pillow)")
+        timings = info.setdefault("step_timings", {})
+        start_time = time.time()
+
+        info["phase"] = "native_fetch"
+        with timed_step("native_fetch", timings):
+            card = self.api_client.get_card(card_id, session_token) or {}
+            if card.get("display") not in NATIVE_DISPLAYS:
+                # Skip the query when the browser has to draw it anyway
+                raise NativeUnsupported(f"display '{card.get('display')}' is not supported natively",
+                                        card.get("display"))
+            result = self.api_client.query_card(card_id, session_token)
+
+        info["phase"] = "native_draw"
+        with timed_step("native_draw", timings):
+            try:
+                spec = chart_spec(card, result)
+                try:
+                    if spec["display"] == "table":
+                        png = draw_table(spec, self.width)
+                    else:
+                        png = draw_xy_chart(spec, self.width, self.height)
+                except NativeUnsupported:
+                    raise
+                except Exception as e:
+                    # Data the drawing code did not anticipate is the browser's job, not a failed request
+                    logger.warning(f"Native drawing of question {card_id} failed: {e}")
+                    raise NativeUnsupported(f"native drawing failed: {e}", spec["display"])
+            except NativeUnsupported as e:
+                e.card, e.result = card, result
+                raise
+
+        info["renderer"] = "native"
+        info["capture_mode"] = "native"
+        info["chart_ready"] = True
+        info["ready_time"] = round(time.time() - start_time, 3)
+        logger.info(f"Question {card_id} drawn natively as {spec['display']} in {info['ready_time']:.2f} seconds: "
+                    f"{len(png):,} bytes")
+        return png
@@ -0,0 +1,131 @@
+# popups.py
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Popup configuration
+POPUP_AUTO_DISMISS = True
+POPUP_CONTAINER_SELECTORS = [
+    "[role='dialog']",
+    "[role='alertdialog']",
+    "[aria-modal='true']",
+    "[data-testid='onboarding-modal']",
+    "[data-testid='tutorial-modal']",
+    ".onboarding-modal",
+    ".tutorial-modal",
+    ".modal",
+    ".popup",
+    ".dialog"
+]
+POPUP_CLOSE_SELECTORS = [
+    "button[aria-label='Close' i]",
+    "button[aria-label='Dismiss' i]",
+    "button[aria-label='Cancel' i]",
+    "[data-testid='close-button']",
+    "[data-testid='modal-close']",
+    ".close-button",
+    ".modal-close",
+    "button.close",
+    ".close"
+]
+POPUP_OVERLAY_SELECTORS = [".modal-backdrop", ".overlay"]
+POPUP_CLOSE_LABELS = ["close", "dismiss", "cancel", "skip", "later", "maybe later", "no thanks", "not now", "got it"]
+
+# Closes every visible popup in one round trip and returns what it touched.
+# With observe=true a MutationObserver keeps dismissing popups that appear later.
+POPUP_DISMISS_SCRIPT = """
+const config = arguments[0];
+const observe = arguments[1];
+
+function visible(element) {
+    if (!element.isConnected) return false;
+    const style = window.getComputedStyle(element);
+    const rect = element.getBoundingClientRect();
+    return style.display !== 'none' && style.visibility !== 'hidden' && rect.width > 0 && rect.height > 0;
+}
+
+function describe(element) {
+    return element.getAttribute('data-testid') || element.getAttribute('role') ||
+        (typeof element.className === 'string' && element.className.split(' ')[0]) || element.tagName.toLowerCase();
+}
+
+function findCloseButton(container) {
+    for (const selector of config.close) {
+        const button = container.querySelector(selector);
+        if (button && visible(button)) return button;
+    }
+    for (const button of container.querySelectorAll('button, [role="button"]')) {
+        const label = (button.innerText || button.getAttribute('aria-label') || '').trim().toLowerCase();
+        if (config.labels.includes(label) && visible(button)) return button;
+    }
+    return null;
+}
+
+function dismissAll() {
+    const dismissed = [];
+    const seen = new Set();
+    for (const container of document.querySelectorAll(config.containers.join(','))) {
+        if (seen.has(container) || !visible(container)) continue;
+        container.querySelectorAll('*').forEach(child => seen.add(child));
+        const button = findCloseButton(container);
+        if (button) {
+            button.click();
+            dismissed.push({ popup: describe(container), action: 'click', label: (button.innerText || button.getAttribute('aria-label') || '').trim() });
+        } else {
+            container.style.setProperty('display', 'none', 'important');
+            dismissed.push({ popup: describe(container), action: 'hide' });
+        }
+    }
+    for (const overlay of document.querySelectorAll(config.overlays.join(','))) {
+        if (!visible(overlay)) continue;
+        overlay.style.setProperty('display', 'none', 'important');
+        dismissed.push({ popup: describe(overlay), action: 'hide' });
+    }
+    if (dismissed.length) {
+        document.dispatchEvent(new KeyboardEvent('keydown', { key: 'Escape', keyCode: 27, bubbles: true }));
+    }
+    return dismissed;
+}
+
+const dismissed = dismissAll();
+
+if (observe && !window.__popupObserver && document.body) {
+    let scheduled = false;
+    window.__popupObserver = new MutationObserver(() => {
+        if (scheduled) return;
+        scheduled = true;
+        requestAnimationFrame(() => {
+            scheduled = false;
+            window.__popupDismissed = (window.__popupDismissed || []).concat(dismissAll());
+        });
+    });
+    window.__popupObserver.observe(document.body, { childList: true, subtree: true });
+}
+
+const autoDismissed = window.__popupDismissed || [];
+window.__popupDismissed = [];
+
+return { dismissed: dismissed, auto_dismissed: autoDismissed, observing: !!window.__popupObserver };
+"""
+
+
+def dismiss_popups(driver, observe=POPUP_AUTO_DISMISS):
+    """Dismiss every visible modal, overlay or dialog in a single execute_script call"""
+    config = {
+        "containers": POPUP_CONTAINER_SELECTORS,
+        "close": POPUP_CLOSE_SELECTORS,
+        "overlays": POPUP_OVERLAY_SELECTORS,
+        "labels": POPUP_CLOSE_LABELS
+    }
+    try:
+        result = driver.execute_script(POPUP_DISMISS_SCRIPT, config, observe)
+    except Exception as e:
+        logger.info(f"Popup dismissal script failed: {e}")
+        return []
+
+    dismissed = result.get("dismissed", [])
+    for popup in dismissed:
+        logger.info(f"Popup dismissed: {popup.get('popup')} ({popup.get('action')})")
+    for popup in result.get("auto_dismissed", []):
+        logger.info(f"Popup auto-dismissed by observer: {popup.get('popup')} ({popup.get('action')})")
+    return dismissed + result.get("auto_dismissed", [])
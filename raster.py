@@ -0,0 +1,79 @@
+# raster.py
+import io
+import logging
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+class RasterUnavailable(Exception):
+    """Raised when in-process image decoding is needed but Pillow is not installed"""
+
+
+def available():
+    return Image is not None
+
+
+def decode(png_bytes):
+    """Decode a screenshot once into a Pillow image"""
+    if Image is None:
+        raise RasterUnavailable("Pillow is required for in-process cropping (pip install Pillow)")
+    image = Image.open(io.BytesIO(png_bytes))
+    image.load()
+    return image
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def scale_rect(rect, scale, bounds):
+    """Convert a CSS-pixel rect to a clamped device-pixel crop box"""
+    width, height = bounds
+    left = max(0, int(round(rect["x"] * scale)))
+    top = max(0, int(round(rect["y"] * scale)))
+    right = min(width, int(round((rect["x"] + rect["width"]) * scale)))
+    bottom = min(height, int(round((rect["y"] + rect["height"]) * scale)))
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
+
+
+def infer_scale(image_width, page_width, device_pixel_ratio=1.0):
+    """CSS-to-raster pixel scale, trusting the raster size over devicePixelRatio when they disagree"""
+    device_pixel_ratio = device_pixel_ratio or 1.0
+    if not page_width:
+        return device_pixel_ratio
+    measured = image_width / page_width
+    if abs(measured - device_pixel_ratio) > 0.01:
+        logger.info(f"Raster scale {measured:.3f} differs from devicePixelRatio {device_pixel_ratio}, using raster scale")
+        return measured
+    return device_pixel_ratio
+
+
+def crop_regions(png_bytes, rects, scale=1.0, page_width=None):
+    """Decode a page raster once and crop every rect from it, returning PNG bytes (None if off-image)"""
+    image = decode(png_bytes)
+    if page_width:
+        scale = infer_scale(image.size[0], page_width, scale)
+    crops = []
+    for rect in rects:
+        box = scale_rect(rect, scale, image.size)
+        crops.append(encode_png(image.crop(box)) if box else None)
+    logger.info(f"Cropped {sum(1 for crop in crops if crop)}/{len(rects)} regions from one "
+                f"{image.size[0]}x{image.size[1]} raster")
+    return crops
+
+
+def capture_regions(driver, rects, device_pixel_ratio=1.0, page_width=None):
+    """Take one full-page screenshot and crop every page-coordinate rect from it in process"""
+    if not available():
+        raise RasterUnavailable("Pillow is required for in-process cropping (pip install Pillow)")
+    page_png = driver.get_full_page_screenshot_as_png()
+    return page_png, crop_regions(page_png, rects, device_pixel_ratio, page_width)
@@ -0,0 +1,71 @@
+# responses.py
+import json
+import uuid
+
+from flask import Response
+
+RESPONSE_MODES = ("json", "binary", "multipart")
+
+
+def metadata_headers(metadata, prefix="X-"):
+    """Turn {"ready_time": 1.2} into {"X-Ready-Time": "1.2"}, skipping empty values"""
+    headers = {}
+    for key, value in metadata.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value, separators=(",", ":"))
+        name = "-".join(part.capitalize() for part in str(key).split("_"))
+        # Header values must stay on one line
+        headers[f"{prefix}{name}"] = " ".join(str(value).splitlines())
+    return headers
+
+
+def response_mode(data, default="json"):
+    """Requested response mode, honouring the older return_base64 flag"""
+    mode = data.get('response_mode')
+    if mode is None:
+        mode = default if data.get('return_base64', True) else "binary"
+    if mode not in RESPONSE_MODES:
+        raise ValueError(f"Unsupported response_mode '{mode}', expected one of: {', '.join(RESPONSE_MODES)}")
+    return mode
+
+
+def binary_response(data, mimetype, filename=None, metadata=None, attachment=True):
+    """Raw image bytes in the body with the capture metadata in headers"""
+    response = Response(data, mimetype=mimetype, direct_passthrough=True)
+    response.headers.update(metadata_headers(metadata or {}))
+    if filename:
+        disposition = "attachment" if attachment else "inline"
+        response.headers["Content-Disposition"] = f'{disposition}; filename="{filename}"'
+    return response
+
+
+def multipart_part(boundary, data, mimetype, filename=None, metadata=None):
+    """Headers and body of one multipart/mixed part"""
+    lines = [f"--{boundary}", f"Content-Type: {mimetype}", f"Content-Length: {len(data)}"]
+    if filename:
+        lines.append(f'Content-Disposition: attachment; filename="{filename}"')
+    lines.extend(f"{name}: {value}" for name, value in metadata_headers(metadata or {}).items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode(), data, b"\r\n"
+
+
+def json_part(boundary, payload, metadata=None):
+    return multipart_part(boundary, json.dumps(payload).encode(), "application/json", metadata=metadata)
+
+
+def multipart_response(parts):
+    """Stream an iterable of (data, mimetype, filename, metadata) tuples as multipart/mixed"""
+    boundary = uuid.uuid4().hex
+
+    def generate():
+        for data, mimetype, filename, metadata in parts:
+            if mimetype == "application/json" and not isinstance(data, (bytes, bytearray)):
+                yield from json_part(boundary, data, metadata)
+            else:
+                yield from multipart_part(boundary, data, mimetype, filename, metadata)
+        yield f"--{boundary}--\r\n".encode()
+
+    return Response(generate(), mimetype=f"multipart/mixed; boundary={boundary}")
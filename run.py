@@ -1,5 +1,5 @@
 # metabase_screenshot_service.py
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file
 from selenium import webdriver
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.common.by import By
@@ -7,23 +7,72 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 import base64
+import contextvars
+import json
+import os
+import queue
+import signal
+import threading
 import time
 import io
 from datetime import datetime
 import logging
 
+from driver_pool import DRIVER_POOL_SIZE, DriverPool
+from session_cache import SessionCache, credential_digest
+from metabase_api import MetabaseAPIClient, MetabaseAPIError, result_fingerprint
+from chart_ready import wait_for_chart_ready
+from popups import dismiss_popups
+from capture_target import resolve_capture_target
+from jobs import JobManager, JobQueueFull
+from image_cache import ImageCache, cache_key
+from singleflight import SingleFlight
+from dashboard import DASHBOARD_ROOT_SELECTORS, dashboard_layout, fit_window_to_dashboard
+from raster import RasterUnavailable, capture_regions, crop_regions
+from encoders import check_encoding_options, encode_variants
+from native_render import NATIVE_HEIGHT, NATIVE_WIDTH, NativeRenderer, NativeUnsupported
+from responses import binary_response, multipart_response, response_mode
+from admission import AdmissionController, AdmissionRejected, descendant_pids
+from metrics import (ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, BROWSER_RSS_BYTES, CACHE_LOOKUPS_TOTAL,
+                     CAPTURE_FAILURES_TOTAL, CAPTURE_MODE_TOTAL, CAPTURES_TOTAL, FULL_PAGE_FALLBACKS_TOTAL,
+                     LOGINS_TOTAL, NATIVE_FALLBACKS_TOTAL, POOL_DRIVERS, REQUEST_SECONDS, PhaseTimer, registry,
+                     timed_step)
+from browser_profile import CAPTURE_PROFILE_ENABLED, PROFILE_TEMPLATE_ENABLED, CaptureProfile
+from scheduler import SCHEDULE_FILE, PrerenderScheduler, load_schedule
+from tab_engine import TAB_ENGINE_BROWSERS, TABS_PER_BROWSER, TabEngine
+from tracing import (begin_request, current_request_id, current_trace, end_request, in_context, install_log_filter,
+                     instrument_driver, span)
+
 # Configuration
-METABASE_BASE_URL = "http://your-metabase.com"
+METABASE_BASE_URL = os.environ.get("METABASE_BASE_URL", "http://your-metabase.com")
 DEFAULT_QUESTION_ID = "123"
-DEFAULT_USERNAME = "your-username"
-DEFAULT_PASSWORD = "your-password"
+DEFAULT_USERNAME = os.environ.get("METABASE_USERNAME", "your-username")
+DEFAULT_PASSWORD = os.environ.get("METABASE_PASSWORD", "your-password")
+LOGIN_MODE = "api"  # "api" (session API) or "form" (login page)
+SAVE_DEBUG_ARTIFACTS = False
+VIEWPORT_WIDTH = 1400
+VIEWPORT_HEIGHT = 1000
+FRESHNESS_CHECK = True
+BATCH_MAX_ITEMS = 100
+BATCH_DRIVERS = 3
+# Concurrent captures (browsers) per server process; see gunicorn.conf.py
+CAPTURES_PER_WORKER = int(os.environ.get("CAPTURES_PER_WORKER", DRIVER_POOL_SIZE))
+SHUTDOWN_DRAIN_SECONDS = 120
+# "pool": one browser per capture; "tabs": several windows per logged-in browser (see tab_engine.py)
+CAPTURE_ENGINE = os.environ.get("CAPTURE_ENGINE", "pool")
+# "browser": always render in Firefox; "native": draw line/bar/table questions from the API (see native_render.py)
+RENDERERS = ("browser", "native")
+DEFAULT_RENDERER = os.environ.get("DEFAULT_RENDERER", "browser")
+if DEFAULT_RENDERER not in RENDERERS:
+    raise ValueError(f"DEFAULT_RENDERER must be one of: {', '.join(RENDERERS)} (got '{DEFAULT_RENDERER}')")
 
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
+install_log_filter()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -35,8 +84,9 @@ class MetabaseScreenshotService:
         self.firefox_options.add_argument("--headless")
         self.firefox_options.add_argument("--no-sandbox")
         self.firefox_options.add_argument("--disable-dev-shm-usage")
-        self.firefox_options.add_argument("--width=1400")
-        self.firefox_options.add_argument("--height=1000")
+        self.firefox_options.add_argument(f"--width={VIEWPORT_WIDTH}")
+        self.firefox_options.add_argument(f"--height={VIEWPORT_HEIGHT}")
+        self.viewport = (VIEWPORT_WIDTH, VIEWPORT_HEIGHT)
         
         # Set real browser User-Agent
         self.firefox_options.set_preference("general.useragent.override", 
@@ -44,6 +94,45 @@ class MetabaseScreenshotService:
         
         logger.info("Firefox options configured")
         
+        # Lean persistent profiles with third-party requests blocked (see browser_profile.py)
+        self.capture_profile = CaptureProfile() if CAPTURE_PROFILE_ENABLED else None
+        
+        self.driver_pool = DriverPool(self.create_driver, size=CAPTURES_PER_WORKER)
+        self.session_cache = SessionCache()
+        self.api_client = MetabaseAPIClient(METABASE_BASE_URL)
+        self.native_renderer = NativeRenderer(self.api_client)
+        self._login_locks = {}
+        self._login_locks_lock = threading.Lock()
+        self.image_cache = ImageCache()
+        self.singleflight = SingleFlight()
+        self.tab_engine = None
+        if CAPTURE_ENGINE == "tabs":
+            self.tab_engine = TabEngine(self, METABASE_BASE_URL, TAB_ENGINE_BROWSERS, TABS_PER_BROWSER)
+        # Captures this worker runs at once: every tab window in tabs mode, otherwise one per pooled browser
+        self.capture_slots = self.tab_engine.capacity if self.tab_engine else self.driver_pool.size
+        self.admission = AdmissionController(self.capture_slots)
+    
+    def start(self):
+        """Launch browsers ahead of the first request"""
+        if self.capture_profile and PROFILE_TEMPLATE_ENABLED:
+            # Warm the shared profile template first so the pool's browsers start with cached bundles
+            self.capture_profile.refresh(self.firefox_options, METABASE_BASE_URL, self.api_client.get_version)
+            self.capture_profile.start_refresher(self.firefox_options, METABASE_BASE_URL, self.api_client.get_version)
+        if self.tab_engine:
+            # Question captures go to the tab engine; the pool only serves batch, dashboard and /test,
+            # so its browsers launch on first checkout instead of sitting idle
+            self.tab_engine.start()
+        else:
+            self.driver_pool.start()
+        
+    def create_driver(self):
+        """Launch a new headless Firefox WebDriver for the pool"""
+        logger.info("Launching Firefox WebDriver...")
+        with timed_step("driver_startup"):
+            if self.capture_profile:
+                return instrument_driver(self.capture_profile.launch(self.firefox_options))
+            return instrument_driver(webdriver.Firefox(options=self.firefox_options))
+        
     def wait_for_dynamic_elements(self, driver, max_wait=45):
         """Wait for JavaScript dynamic rendering completion with extended debugging"""
         logger.info("Step 1/3: Waiting for dynamic content loading...")
@@ -68,9 +157,10 @@ class MetabaseScreenshotService:
             logger.info(f"  - Page source length: {len(page_source)} characters")
             
             # Save full page source for debugging
-            with open("full_page_source.html", "w", encoding="utf-8") as f:
-                f.write(page_source)
-            logger.info("  - Full page source saved: full_page_source.html")
+            if SAVE_DEBUG_ARTIFACTS:
+                with open("full_page_source.html", "w", encoding="utf-8") as f:
+                    f.write(page_source)
+                logger.info("  - Full page source saved: full_page_source.html")
             
             # Check for common indicators
             indicators = {
@@ -93,11 +183,12 @@ class MetabaseScreenshotService:
             logger.error(f"  - Page analysis error: {e}")
         
         # 4. Take screenshot before form search
-        try:
-            driver.save_screenshot("before_form_search.png")
-            logger.info("  - Screenshot saved: before_form_search.png")
-        except Exception as e:
-            logger.error(f"  - Screenshot error: {e}")
+        if SAVE_DEBUG_ARTIFACTS:
+            try:
+                driver.save_screenshot("before_form_search.png")
+                logger.info("  - Screenshot saved: before_form_search.png")
+            except Exception as e:
+                logger.error(f"  - Screenshot error: {e}")
         
         # 5. Extended JavaScript form detection
         logger.info("  - Starting extended form detection...")
@@ -233,7 +324,8 @@ class MetabaseScreenshotService:
         
         # Wait for dynamic elements
         logger.info("  - Starting form detection with extended debugging...")
-        form_result = self.wait_for_dynamic_elements(driver)
+        with timed_step("login_form_detection"):
+            form_result = self.wait_for_dynamic_elements(driver)
         
         if not form_result.get("found"):
             logger.error("  - LOGIN FORM NOT FOUND - Starting extensive debugging...")
@@ -352,7 +444,10 @@ class MetabaseScreenshotService:
         
         # Wait and verify login
         logger.info("  - Waiting for login completion...")
-        time.sleep(5)
+        try:
+            WebDriverWait(driver, 10).until(lambda d: "/auth/login" not in d.current_url)
+        except TimeoutException:
+            pass
         
         current_url = driver.current_url
         if "/auth/login" not in current_url:
@@ -362,150 +457,147 @@ class MetabaseScreenshotService:
             logger.error(f"  - Login failed - still on login page: {current_url}")
             return False
     
+    def login_via_api(self, driver, username, password):
+        """Get a session token from the session API and attach it to the browser as a cookie"""
+        logger.info("  - Requesting session token from Metabase API...")
+        try:
+            token = self.api_client.create_session(username, password)
+        except MetabaseAPIError as e:
+            logger.warning(f"  - API login failed: {e}")
+            return False
+        
+        cookie = self.session_cache.store_token(username, password, token)
+        try:
+            self.session_cache.attach(driver, METABASE_BASE_URL, cookie)
+        except Exception as e:
+            logger.warning(f"  - Failed to attach session cookie: {e}")
+            self.session_cache.invalidate(username)
+            return False
+        
+        logger.info("  - Session cookie attached from API login")
+        return True
+    
+    def login_lock(self, username):
+        """Per-username lock so concurrent captures log in only once"""
+        with self._login_locks_lock:
+            return self._login_locks.setdefault(username, threading.Lock())
+    
+    def authenticate(self, driver, username, password):
+        """Reuse a cached Metabase session, falling back to the login form on a miss"""
+        if self.session_cache.inject(driver, METABASE_BASE_URL, username, password):
+            logger.info(f"  - Reusing cached Metabase session for {username}")
+            LOGINS_TOTAL.inc(method="reused")
+            return True
+        
+        with self.login_lock(username):
+            # Another capture may have logged in while we were waiting
+            if self.session_cache.inject(driver, METABASE_BASE_URL, username, password):
+                logger.info(f"  - Reusing Metabase session created by a concurrent login for {username}")
+                LOGINS_TOTAL.inc(method="reused")
+                return True
+            
+            if LOGIN_MODE == "api":
+                if self.login_via_api(driver, username, password):
+                    LOGINS_TOTAL.inc(method="api")
+                    return True
+                logger.info("  - Falling back to form login")
+            
+            logger.info("  - No cached session, logging in through the form")
+            if not self.login_to_metabase(driver, username, password):
+                LOGINS_TOTAL.inc(method="failed")
+                return False
+            
+            self.session_cache.store_from_driver(driver, username, password)
+            LOGINS_TOTAL.inc(method="form")
+            return True
+    
+    def open_authenticated(self, driver, url, username, password):
+        """Load a page, logging in again if Metabase bounces the session to /auth/login"""
+        driver.get(url)
+        if "/auth/login" not in driver.current_url:
+            return True
+        
+        logger.warning("  - Redirected to login page, cached session rejected")
+        self.session_cache.invalidate(username)
+        if not self.authenticate(driver, username, password):
+            return False
+        
+        driver.get(url)
+        return "/auth/login" not in driver.current_url
+    
     def wait_for_question_load(self, driver, wait_seconds=10):
         """Wait for Question page chart loading completion"""
         logger.info("Step 3/3: Loading question chart...")
+        logger.info(f"  - Waiting for chart to stabilize (upper bound: {wait_seconds} seconds)")
         
-        logger.info("  - Searching for chart elements...")
-        chart_selectors = [
-            ".Visualization",
-            "[data-testid='query-visualization-root']", 
-            ".QueryBuilder-section",
-            ".Card .Card-content",
-            "svg",
-            "canvas"
-        ]
-        
-        chart_found = False
-        for i, selector in enumerate(chart_selectors, 1):
-            logger.info(f"    - Attempt {i}/{len(chart_selectors)}: Looking for '{selector}'")
-            try:
-                WebDriverWait(driver, 15).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, selector))
-                )
-                logger.info(f"    - SUCCESS: Chart element found with '{selector}'")
-                chart_found = True
-                break
-            except TimeoutException:
-                logger.info(f"    - Failed: Timeout for '{selector}'")
-                continue
-        
-        if not chart_found:
-            logger.warning("  - No chart elements found, but continuing process")
-        
-        logger.info("  - Checking for loading spinners...")
         try:
-            WebDriverWait(driver, 10).until_not(
-                EC.presence_of_element_located((By.CSS_SELECTOR, ".Loading, .LoadingSpinner, [data-testid='loading-spinner']"))
-            )
-            logger.info("  - Loading spinners disappeared")
-        except TimeoutException:
-            logger.info("  - Loading spinner check timeout, continuing...")
+            result = wait_for_chart_ready(driver, wait_seconds)
+        except Exception as e:
+            logger.error(f"  - Readiness detection error: {e}, falling back to fixed wait")
+            time.sleep(wait_seconds)
+            return {"ready": False, "reason": "error", "ready_time": wait_seconds}
         
-        logger.info(f"  - Additional safety wait: {wait_seconds} seconds")
-        time.sleep(wait_seconds)
+        if result.get('ready'):
+            logger.info(f"  - Chart ready in {result['ready_time']:.2f} seconds "
+                        f"(root: '{result.get('selector')}', {result.get('charts')} chart elements)")
+        else:
+            logger.warning(f"  - Chart not stable after {result['ready_time']:.2f} seconds "
+                           f"({result.get('reason')}), continuing process")
         
-        logger.info("  - Verifying chart rendering with JavaScript...")
-        try:
-            is_ready = driver.execute_script("""
-                const charts = document.querySelectorAll('svg, canvas, .Visualization');
-                return {
-                    count: charts.length,
-                    ready: charts.length > 0
-                };
-            """)
-            
-            if is_ready.get('ready'):
-                logger.info(f"  - Chart rendering verified: {is_ready.get('count')} chart elements found")
-            else:
-                logger.warning("  - No chart elements found in JavaScript verification")
-        except Exception as e:
-            logger.error(f"  - JavaScript verification error: {e}")
+        return result
     
-    def capture_question_chart(self, driver):
-        """Enhanced chart area capture with better detection"""
+    def capture_question_chart(self, driver, info=None):
+        """Chart area capture, cropped in process from a single full-page raster"""
+        info = {} if info is None else info
+        timings = info.setdefault("step_timings", {})
         logger.info("  - Starting enhanced chart area capture...")
         
         try:
-            time.sleep(2)
-            
-            chart_selectors = [
-                ".Visualization",
-                "[data-testid='query-visualization-root']",
-                ".Card .Visualization",
-                "svg[class*='chart']",
-                "svg[class*='visualization']", 
-                ".Visualization svg",
-                "canvas[class*='chart']",
-                ".Visualization canvas",
-                ".QueryBuilder-section .Card",
-                ".Card .Card-content",
-                ".Question .Card",
-                ".DashCard .Card-content"
-            ]
+            logger.info("  - Resolving chart element in browser...")
+            with timed_step("selector_match", timings):
+                target = resolve_capture_target(driver)
             
-            chart_element = None
-            successful_selector = None
+            if not target:
+                logger.warning("  - No suitable chart element found, capturing full page")
+                info["capture_mode"] = "full_page"
+                with timed_step("raster", timings):
+                    return driver.get_screenshot_as_png()
             
-            for i, selector in enumerate(chart_selectors, 1):
-                logger.info(f"    - Chart detection attempt {i}/{len(chart_selectors)}: '{selector}'")
-                try:
-                    elements = driver.find_elements(By.CSS_SELECTOR, selector)
-                    logger.info(f"      - Found {len(elements)} elements")
-                    
-                    for j, element in enumerate(elements):
-                        try:
-                            size = element.size
-                            location = element.location
-                            is_displayed = element.is_displayed()
-                            
-                            logger.info(f"      - Element {j+1}: size={size}, location={location}, displayed={is_displayed}")
-                            
-                            if (is_displayed and 
-                                size['width'] > 200 and size['height'] > 150 and
-                                location['x'] >= 0 and location['y'] >= 0):
-                                
-                                chart_element = element
-                                successful_selector = selector
-                                logger.info(f"    - SUCCESS: Chart element selected")
-                                logger.info(f"      - Selector: '{selector}'")
-                                logger.info(f"      - Final size: {size}")
-                                break
-                                
-                        except Exception as e:
-                            logger.info(f"      - Element {j+1}: Error checking - {e}")
-                            continue
-                    
-                    if chart_element:
-                        break
-                        
-                except Exception as e:
-                    logger.info(f"      - Selector error: {e}")
-                    continue
+            logger.info(f"    - SUCCESS: Chart element selected")
+            logger.info(f"      - Selector: '{target['selector']}'")
+            logger.info(f"      - Final rect: {target['page_rect']}")
             
-            if chart_element:
-                logger.info("  - Capturing chart element screenshot...")
-                try:
-                    driver.execute_script("arguments[0].scrollIntoView(true);", chart_element)
-                    time.sleep(1)
-                    
-                    screenshot_data = chart_element.screenshot_as_png
-                    logger.info(f"  - Chart area screenshot captured successfully using: {successful_selector}")
-                    return screenshot_data
-                    
-                except Exception as e:
-                    logger.error(f"  - Chart element screenshot failed: {e}")
-                    return driver.get_screenshot_as_png()
-            else:
-                logger.warning("  - No suitable chart element found, capturing full page")
-                return driver.get_screenshot_as_png()
+            logger.info("  - Cropping chart from full-page raster...")
+            try:
+                with timed_step("raster", timings):
+                    page_png, crops = capture_regions(
+                        driver, [target['page_rect']], target['devicePixelRatio'], target.get('page_width')
+                    )
+            except RasterUnavailable as e:
+                logger.warning(f"  - {e}; using element screenshot")
+                info["capture_mode"] = "element"
+                with timed_step("raster", timings):
+                    return target['element'].screenshot_as_png
+            
+            if crops[0]:
+                logger.info(f"  - Chart area cropped successfully using: {target['selector']}")
+                info["capture_mode"] = "raster_crop"
+                return crops[0]
+            
+            logger.error("  - Chart rect is outside the page raster, returning full page")
+            info["capture_mode"] = "full_page"
+            return page_png
                 
         except Exception as e:
             logger.error(f"  - Chart capture completely failed: {e}")
-            return driver.get_screenshot_as_png()
+            info["capture_mode"] = "full_page"
+            with timed_step("raster", timings):
+                return driver.get_screenshot_as_png()
     
-    def capture_question(self, question_id=None, username=None, password=None, wait_seconds=10, crop_to_chart=True):
-        """Capture Question URL as PNG"""
+    def capture_question(self, question_id=None, username=None, password=None, wait_seconds=10, crop_to_chart=True,
+                         info=None):
+        """Capture Question URL as PNG, recording capture details into info when given"""
+        info = {} if info is None else info
         logger.info("="*60)
         logger.info("STARTING METABASE SCREENSHOT CAPTURE")
         logger.info("="*60)
@@ -521,99 +613,650 @@ class MetabaseScreenshotService:
         logger.info(f"  - Wait seconds: {wait_seconds}")
         logger.info(f"  - Crop to chart: {crop_to_chart}")
         
-        logger.info("Initializing Firefox WebDriver...")
+        timings = info.setdefault("step_timings", {})
+        info["phase"] = "admission"
+        with timed_step("admission_wait", timings):
+            admitted_at = self.admission.acquire()
+        
+        logger.info("Borrowing Firefox WebDriver from pool...")
         try:
-            driver = webdriver.Firefox(options=self.firefox_options)
-            logger.info("Firefox WebDriver initialized successfully")
+            with timed_step("driver_checkout", timings):
+                driver = self.driver_pool.checkout()
+            logger.info("Firefox WebDriver ready")
         except Exception as e:
-            logger.error(f"Failed to initialize Firefox WebDriver: {e}")
+            logger.error(f"Failed to obtain Firefox WebDriver: {e}")
+            self.admission.release(admitted_at)
+            CAPTURE_FAILURES_TOTAL.inc(phase="driver_checkout")
+            CAPTURES_TOTAL.inc(kind="question", outcome="failed")
             raise
         
+        healthy = True
         try:
-            # Login
-            logger.info("\n" + "="*40)
-            logger.info("PHASE 1: AUTHENTICATION")
-            logger.info("="*40)
+            with span("capture_question", question_id=question_id, crop_to_chart=crop_to_chart):
+                screenshot_png = self.run_capture(driver, question_id, username, password, wait_seconds,
+                                                  crop_to_chart, info)
+            CAPTURES_TOTAL.inc(kind="question", outcome="succeeded")
+            return screenshot_png
+                
+        except Exception as e:
+            CAPTURE_FAILURES_TOTAL.inc(phase=info.get("phase"))
+            CAPTURES_TOTAL.inc(kind="question", outcome="failed")
+            logger.error(f"\n" + "="*60)
+            logger.error("SCREENSHOT CAPTURE FAILED!")
+            logger.error("="*60)
+            logger.error(f"Error: {e}")
             
-            if not self.login_to_metabase(driver, username, password):
-                raise Exception("Authentication failed")
+            try:
+                driver.save_screenshot("capture_error.png")
+                logger.info("Error screenshot saved: capture_error.png")
+            except:
+                logger.error("Failed to save error screenshot")
             
-            logger.info("Authentication completed successfully!")
+            healthy = self.driver_pool.is_healthy(driver)
+            raise
+        finally:
+            logger.info("Returning Firefox WebDriver to pool...")
+            self.driver_pool.checkin(driver, discard=not healthy)
+            self.admission.release(admitted_at)
+    
+    def capture_question_tabbed(self, question_id=None, username=None, password=None, wait_seconds=10,
+                                crop_to_chart=True, info=None):
+        """Capture a question in its own window of a shared, logged-in browser"""
+        info = {} if info is None else info
+        question_id = question_id or DEFAULT_QUESTION_ID
+        username = username or DEFAULT_USERNAME
+        password = password or DEFAULT_PASSWORD
+        logger.info("="*60)
+        logger.info(f"STARTING TABBED CAPTURE: question {question_id}")
+        logger.info("="*60)
+        
+        info["phase"] = "admission"
+        with timed_step("admission_wait", info.setdefault("step_timings", {})):
+            admitted_at = self.admission.acquire()
+        try:
+            with span("capture_question", question_id=question_id, crop_to_chart=crop_to_chart, engine="tabs"):
+                return self.tab_engine.capture(question_id, username, password, wait_seconds, crop_to_chart, info)
+        finally:
+            self.admission.release(admitted_at)
+    
+    def api_session_token(self, username, password):
+        """Session token for API calls, reusing the browser session cache when possible"""
+        cookie = self.session_cache.get(username, password)
+        if cookie:
+            return cookie["value"]
+        with self.login_lock(username):
+            cookie = self.session_cache.get(username, password)
+            if cookie:
+                return cookie["value"]
+            token = self.api_client.create_session(username, password)
+            self.session_cache.store_token(username, password, token)
+            return token
+    
+    def data_fingerprint(self, question_id, username, password):
+        """Hash of the question's current query result, or None if it cannot be fetched"""
+        start_time = time.time()
+        try:
+            try:
+                fingerprint = self.api_client.card_fingerprint(question_id, self.api_session_token(username, password))
+            except MetabaseAPIError as e:
+                if e.status != 401:
+                    raise
+                self.session_cache.invalidate(username)
+                fingerprint = self.api_client.card_fingerprint(question_id, self.api_session_token(username, password))
+        except Exception as e:
+            logger.warning(f"Freshness check failed for question {question_id}: {e}")
+            return None
+        
+        logger.info(f"Data fingerprint for question {question_id}: {fingerprint[:12]} "
+                    f"({time.time() - start_time:.2f} seconds)")
+        return fingerprint
+    
+    def capture_question_native(self, question_id, username, password, info):
+        """Draw a question from its API query result without a browser; raises NativeUnsupported"""
+        logger.info(f"Rendering question {question_id} natively...")
+        try:
+            try:
+                png = self.native_renderer.render(question_id, self.api_session_token(username, password), info)
+            except MetabaseAPIError as e:
+                if e.status != 401:
+                    raise
+                self.session_cache.invalidate(username)
+                png = self.native_renderer.render(question_id, self.api_session_token(username, password), info)
+        except NativeUnsupported:
+            raise
+        except Exception:
+            CAPTURE_FAILURES_TOTAL.inc(phase=info.get("phase"))
+            CAPTURES_TOTAL.inc(kind="native", outcome="failed")
+            raise
+        CAPTURES_TOTAL.inc(kind="native", outcome="succeeded")
+        CAPTURE_MODE_TOTAL.inc(mode="native")
+        return png
+    
+    def question_cache_key(self, question_id, username, password, crop_to_chart=True, renderer="browser"):
+        # Native renders are sized by the renderer, not the browser viewport
+        viewport = (NATIVE_WIDTH, NATIVE_HEIGHT) if renderer == "native" else self.viewport
+        return cache_key(question_id, crop_to_chart, viewport, credential_digest(username, password), renderer=renderer)
+    
+    def cached_question_age(self, question_id, username=None, password=None, crop_to_chart=True, renderer=None):
+        """Age in seconds of the cached render a request with these parameters would get, or None"""
+        if crop_to_chart is None:
+            crop_to_chart = True
+        entry = self.image_cache.peek(self.question_cache_key(
+            question_id, username or DEFAULT_USERNAME, password or DEFAULT_PASSWORD, crop_to_chart,
+            renderer or DEFAULT_RENDERER
+        ))
+        return entry.age if entry else None
+    
+    def capture_question_cached(self, question_id=None, username=None, password=None, wait_seconds=10,
+                                crop_to_chart=True, max_age=None, renderer=None, info=None):
+        """Serve a cached render no older than max_age, otherwise capture and cache it"""
+        info = {} if info is None else info
+        question_id = question_id or DEFAULT_QUESTION_ID
+        username = username or DEFAULT_USERNAME
+        password = password or DEFAULT_PASSWORD
+        renderer = renderer or DEFAULT_RENDERER
+        key = self.question_cache_key(question_id, username, password, crop_to_chart, renderer)
+        
+        if max_age is not None:
+            entry = self.image_cache.get(key, max_age)
+            if entry:
+                logger.info(f"Serving cached image for question {question_id} (age: {entry.age:.0f} seconds)")
+                CACHE_LOOKUPS_TOTAL.inc(result="hit")
+                info["cached"] = True
+                info["cache_age"] = round(entry.age, 1)
+                info["renderer"] = entry.meta.get("renderer", "browser")
+                return entry.data
+        
+        def render():
+            fingerprint = None
+            if renderer == "native":
+                try:
+                    screenshot_png = self.capture_question_native(question_id, username, password, info)
+                    CACHE_LOOKUPS_TOTAL.inc(result="miss")
+                    info["cached"] = False
+                    self.image_cache.put(key, screenshot_png, {"question_id": question_id, "renderer": "native"})
+                    return screenshot_png, dict(info)
+                except NativeUnsupported as e:
+                    # Cached under the native key, so fresh-enough repeats are served without another attempt
+                    logger.info(f"Question {question_id} cannot be rendered natively ({e}), using the browser")
+                    NATIVE_FALLBACKS_TOTAL.inc(display=e.display)
+                    info["native_fallback"] = str(e)
+                    if e.result is not None:
+                        # The native attempt already ran the query; don't run it again for the freshness check
+                        fingerprint = result_fingerprint(e.card, e.result)
+            
+            if FRESHNESS_CHECK:
+                fingerprint = fingerprint or self.data_fingerprint(question_id, username, password)
+                entry = self.image_cache.peek(key)
+                if fingerprint and entry and entry.meta.get("fingerprint") == fingerprint:
+                    logger.info(f"Question {question_id} data unchanged, serving cached image "
+                                f"(age: {entry.age:.0f} seconds)")
+                    CACHE_LOOKUPS_TOTAL.inc(result="unchanged")
+                    info["cached"] = True
+                    info["cache_age"] = round(entry.age, 1)
+                    info["data_unchanged"] = True
+                    info["renderer"] = entry.meta.get("renderer", "browser")
+                    self.image_cache.touch(key)
+                    return entry.data, dict(info)
             
+            CACHE_LOOKUPS_TOTAL.inc(result="miss")
+            info["cached"] = False
+            info["renderer"] = "browser"
+            capture = self.capture_question_tabbed if self.tab_engine else self.capture_question
+            screenshot_png = capture(
+                question_id=question_id,
+                username=username,
+                password=password,
+                wait_seconds=wait_seconds,
+                crop_to_chart=crop_to_chart,
+                info=info
+            )
+            
+            if info.get("chart_ready"):
+                self.image_cache.put(key, screenshot_png, {
+                    "question_id": question_id,
+                    "crop_to_chart": crop_to_chart,
+                    "fingerprint": fingerprint,
+                    "renderer": "browser"
+                })
+            else:
+                logger.info("Chart was not confirmed ready, not caching this render")
+            return screenshot_png, dict(info)
+        
+        info["phase"] = "coalesced"
+        (screenshot_png, leader_info), leader = self.singleflight.do(key, render)
+        if not leader:
+            CACHE_LOOKUPS_TOTAL.inc(result="coalesced")
+            info.update(leader_info)
+        info["coalesced"] = "leader" if leader else "follower"
+        return screenshot_png
+    
+    def run_capture(self, driver, question_id, username, password, wait_seconds, crop_to_chart, info,
+                    authenticated=False):
+        """Run the capture phases on an already borrowed driver"""
+        with PhaseTimer(info.setdefault("phase_timings", {})) as phases:
+            timings = info.setdefault("step_timings", {})
+        
+            # Login
+            if not authenticated:
+                logger.info("\n" + "="*40)
+                logger.info("PHASE 1: AUTHENTICATION")
+                logger.info("="*40)
+                info["phase"] = "authentication"
+                phases.start("authentication")
+            
+                if not self.authenticate(driver, username, password):
+                    raise Exception("Authentication failed")
+            
+                logger.info("Authentication completed successfully!")
+        
             # Navigate to Question page
             logger.info("\n" + "="*40)
             logger.info("PHASE 2: NAVIGATION")
             logger.info("="*40)
-            
+            info["phase"] = "navigation"
+            phases.start("navigation")
+        
             question_url = f"{METABASE_BASE_URL}/question/{question_id}"
             logger.info(f"Navigating to Question page: {question_url}")
-            
+        
             try:
-                driver.get(question_url)
+                if not self.open_authenticated(driver, question_url, username, password):
+                    raise Exception("Authentication failed")
                 logger.info("Question page loaded successfully")
                 logger.info(f"Current URL: {driver.current_url}")
             except Exception as e:
                 logger.error(f"Failed to load question page: {e}")
                 raise
-            
+        
             # Wait for chart loading completion
             logger.info("\n" + "="*40)
             logger.info("PHASE 3: CHART LOADING")
             logger.info("="*40)
-            
-            self.wait_for_question_load(driver, wait_seconds)
+            info["phase"] = "chart_loading"
+            phases.start("chart_loading")
+        
+            with timed_step("readiness_wait", timings):
+                readiness = self.wait_for_question_load(driver, wait_seconds)
+            info["chart_ready"] = readiness.get("ready", False)
+            info["ready_time"] = readiness.get("ready_time")
             logger.info("Chart loading phase completed")
-            
+        
+            # Onboarding and announcement modals would otherwise be captured over the chart
+            info["phase"] = "popup_dismissal"
+            phases.start("popup_dismissal")
+            dismissed = dismiss_popups(driver)
+            if dismissed:
+                logger.info(f"Dismissed {len(dismissed)} popups before capture")
+        
             # Capture screenshot
             logger.info("\n" + "="*40)
             logger.info("PHASE 4: SCREENSHOT CAPTURE")
             logger.info("="*40)
-            
+            info["phase"] = "capture"
+            phases.start("capture")
+        
             if crop_to_chart:
                 logger.info("Capturing chart area only...")
-                screenshot_png = self.capture_question_chart(driver)
+                screenshot_png = self.capture_question_chart(driver, info)
+                if info.get("capture_mode") == "full_page":
+                    FULL_PAGE_FALLBACKS_TOTAL.inc()
             else:
                 logger.info("Capturing full page...")
-                screenshot_png = driver.get_screenshot_as_png()
+                info["capture_mode"] = "full_page"
+                with timed_step("raster", timings):
+                    screenshot_png = driver.get_screenshot_as_png()
+            CAPTURE_MODE_TOTAL.inc(mode=info["capture_mode"])
+        
+        screenshot_size = len(screenshot_png)
+        logger.info(f"Screenshot captured successfully")
+        logger.info(f"Screenshot size: {screenshot_size:,} bytes ({screenshot_size/1024:.1f} KB)")
+        
+        logger.info("\n" + "="*60)
+        logger.info("SCREENSHOT CAPTURE COMPLETED SUCCESSFULLY!")
+        logger.info("="*60)
+        
+        return screenshot_png
+    
+    def capture_dashboard(self, dashboard_id, username=None, password=None, wait_seconds=30, per_card=False,
+                          info=None):
+        """Capture a dashboard from one page load and one full-page raster, optionally cropped per card"""
+        info = {} if info is None else info
+        username = username or DEFAULT_USERNAME
+        password = password or DEFAULT_PASSWORD
+        
+        logger.info("="*60)
+        logger.info(f"STARTING DASHBOARD CAPTURE: {dashboard_id} (per card: {per_card})")
+        logger.info("="*60)
+        
+        phases = PhaseTimer(info.setdefault("phase_timings", {}))
+        timings = info.setdefault("step_timings", {})
+        info["phase"] = "admission"
+        with timed_step("admission_wait", timings):
+            admitted_at = self.admission.acquire()
+        try:
+            with timed_step("driver_checkout", timings):
+                driver = self.driver_pool.checkout()
+        except Exception:
+            self.admission.release(admitted_at)
+            CAPTURE_FAILURES_TOTAL.inc(phase="driver_checkout")
+            CAPTURES_TOTAL.inc(kind="dashboard", outcome="failed")
+            raise
+        healthy = True
+        resized = False
+        try:
+            info["phase"] = "authentication"
+            phases.start("authentication")
+            if not self.authenticate(driver, username, password):
+                raise Exception("Authentication failed")
             
-            screenshot_size = len(screenshot_png)
-            logger.info(f"Screenshot captured successfully")
-            logger.info(f"Screenshot size: {screenshot_size:,} bytes ({screenshot_size/1024:.1f} KB)")
+            info["phase"] = "navigation"
+            phases.start("navigation")
+            dashboard_url = f"{METABASE_BASE_URL}/dashboard/{dashboard_id}"
+            logger.info(f"Navigating to dashboard: {dashboard_url}")
+            if not self.open_authenticated(driver, dashboard_url, username, password):
+                raise Exception("Authentication failed")
             
-            logger.info("\n" + "="*60)
-            logger.info("SCREENSHOT CAPTURE COMPLETED SUCCESSFULLY!")
-            logger.info("="*60)
+            info["phase"] = "chart_loading"
+            phases.start("chart_loading")
+            with timed_step("readiness_wait", timings):
+                readiness = wait_for_chart_ready(driver, wait_seconds, root_selectors=DASHBOARD_ROOT_SELECTORS)
+            layout = dashboard_layout(driver)
+            logger.info(f"  - {len(layout['cards'])} dashcards, content height {layout['contentHeight']}px")
             
-            return screenshot_png
-                
-        except Exception as e:
-            logger.error(f"\n" + "="*60)
-            logger.error("SCREENSHOT CAPTURE FAILED!")
-            logger.error("="*60)
-            logger.error(f"Error: {e}")
+            if fit_window_to_dashboard(driver, layout, VIEWPORT_WIDTH):
+                resized = True
+                # Cards that were below the fold may only start rendering now
+                with timed_step("readiness_wait", timings):
+                    readiness = wait_for_chart_ready(driver, wait_seconds, root_selectors=DASHBOARD_ROOT_SELECTORS)
+                layout = dashboard_layout(driver)
             
-            try:
-                driver.save_screenshot("capture_error.png")
-                logger.info("Error screenshot saved: capture_error.png")
-            except:
-                logger.error("Failed to save error screenshot")
+            info["chart_ready"] = readiness.get("ready", False)
+            info["ready_time"] = readiness.get("ready_time")
+            logger.info(f"  - Dashboard ready: {info['chart_ready']} in {info['ready_time']:.2f} seconds")
             
+            info["phase"] = "popup_dismissal"
+            phases.start("popup_dismissal")
+            dismiss_popups(driver)
+            
+            info["phase"] = "capture"
+            phases.start("capture")
+            cards = [dict(card) for card in layout["cards"]]
+            info["cropped"] = False
+            page_png = None
+            if per_card:
+                try:
+                    with timed_step("raster", timings):
+                        page_png, crops = capture_regions(
+                            driver, cards, layout["devicePixelRatio"], layout["contentWidth"]
+                        )
+                    for card, crop in zip(cards, crops):
+                        card["image"] = crop
+                    info["cropped"] = True
+                except RasterUnavailable as e:
+                    logger.warning(f"  - {e}; returning the full dashboard with card rects instead")
+            if page_png is None:
+                with timed_step("raster", timings):
+                    page_png = driver.get_full_page_screenshot_as_png()
+            logger.info(f"  - Full dashboard raster: {len(page_png):,} bytes")
+            CAPTURES_TOTAL.inc(kind="dashboard", outcome="succeeded")
+            
+            return {"image": page_png, "cards": cards, "device_pixel_ratio": layout["devicePixelRatio"],
+                    "content_width": layout["contentWidth"]}
+            
+        except Exception as e:
+            logger.error(f"Dashboard capture failed during {info.get('phase')}: {e}")
+            phases.stop(e)
+            CAPTURE_FAILURES_TOTAL.inc(phase=info.get("phase"))
+            CAPTURES_TOTAL.inc(kind="dashboard", outcome="failed")
+            healthy = self.driver_pool.is_healthy(driver)
             raise
         finally:
-            logger.info("Closing Firefox WebDriver...")
+            phases.stop()
+            if resized and healthy:
+                try:
+                    driver.set_window_size(VIEWPORT_WIDTH, VIEWPORT_HEIGHT)
+                except Exception as e:
+                    logger.warning(f"Failed to restore window size: {e}")
+                    healthy = False
+            self.driver_pool.checkin(driver, discard=not healthy)
+            self.admission.release(admitted_at)
+    
+    def capture_dashboard_cached(self, dashboard_id, username=None, password=None, wait_seconds=30, per_card=False,
+                                 max_age=None, info=None):
+        """Serve a cached dashboard raster no older than max_age, otherwise capture and cache it.
+        
+        The cache holds the full-page raster and card rects, so per-card crops are cut from it on a hit.
+        """
+        info = {} if info is None else info
+        username = username or DEFAULT_USERNAME
+        password = password or DEFAULT_PASSWORD
+        key = cache_key(f"dashboard:{dashboard_id}", False, self.viewport, credential_digest(username, password))
+        
+        entry = self.image_cache.get(key, max_age) if max_age is not None else None
+        if entry:
+            logger.info(f"Serving cached dashboard {dashboard_id} (age: {entry.age:.0f} seconds)")
+            CACHE_LOOKUPS_TOTAL.inc(result="hit")
+            info["cached"] = True
+            info["cache_age"] = round(entry.age, 1)
+            info["chart_ready"] = True
+            info["cropped"] = False
+            cards = [dict(card) for card in entry.meta["cards"]]
+            if per_card:
+                try:
+                    with timed_step("raster", info.setdefault("step_timings", {})):
+                        crops = crop_regions(entry.data, cards, entry.meta["device_pixel_ratio"],
+                                             entry.meta.get("content_width"))
+                    for card, crop in zip(cards, crops):
+                        card["image"] = crop
+                    info["cropped"] = True
+                except RasterUnavailable as e:
+                    logger.warning(f"  - {e}; returning the full dashboard with card rects instead")
+            return {"image": entry.data, "cards": cards, "device_pixel_ratio": entry.meta["device_pixel_ratio"],
+                    "content_width": entry.meta.get("content_width")}
+        
+        def render():
+            CACHE_LOOKUPS_TOTAL.inc(result="miss")
+            info["cached"] = False
+            result = self.capture_dashboard(dashboard_id, username, password, wait_seconds, per_card, info)
+            if info.get("chart_ready"):
+                self.image_cache.put(key, result["image"], {
+                    "dashboard_id": dashboard_id,
+                    "cards": [{k: v for k, v in card.items() if k != "image"} for card in result["cards"]],
+                    "device_pixel_ratio": result["device_pixel_ratio"],
+                    "content_width": result.get("content_width")
+                })
+            else:
+                logger.info("Dashboard was not confirmed ready, not caching this render")
+            return result, dict(info)
+        
+        # Coalesce only identical requests; a per-card request needs the crops its leader produced
+        info["phase"] = "coalesced"
+        (result, leader_info), leader = self.singleflight.do(f"{key}:{bool(per_card)}", render)
+        if not leader:
+            CACHE_LOOKUPS_TOTAL.inc(result="coalesced")
+            info.update(leader_info)
+        info["coalesced"] = "leader" if leader else "follower"
+        return result
+    
+    def capture_batch(self, items, username=None, password=None, drivers=BATCH_DRIVERS):
+        """Capture many questions with one login, yielding each result as soon as it is ready"""
+        username = username or DEFAULT_USERNAME
+        password = password or DEFAULT_PASSWORD
+        
+        logger.info("="*60)
+        logger.info(f"STARTING BATCH CAPTURE: {len(items)} questions")
+        logger.info("="*60)
+        
+        work = queue.Queue()
+        for index, item in enumerate(items):
+            work.put((index, item))
+        results = queue.Queue()
+        cancelled = threading.Event()
+        workers = max(1, min(drivers, len(items), self.driver_pool.size))
+        
+        def worker():
             try:
-                driver.quit()
-                logger.info("Firefox WebDriver closed successfully")
-            except:
-                logger.error("Failed to close Firefox WebDriver")
+                admitted_at = self.admission.acquire()
+            except AdmissionRejected as e:
+                logger.warning(f"Batch worker not admitted: {e}")
+                results.put(None)
+                return
+            try:
+                driver = self.driver_pool.checkout()
+            except Exception as e:
+                logger.warning(f"Batch worker could not borrow a driver: {e}")
+                self.admission.release(admitted_at)
+                results.put(None)
+                return
+            
+            healthy = True
+            authenticated = False
+            try:
+                while healthy and not cancelled.is_set():
+                    try:
+                        index, item = work.get_nowait()
+                    except queue.Empty:
+                        break
+                    
+                    info = {}
+                    result = {"index": index, "question_id": item["question_id"]}
+                    start_time = time.time()
+                    try:
+                        if not authenticated:
+                            info["phase"] = "authentication"
+                            if not self.authenticate(driver, username, password):
+                                raise Exception("Authentication failed")
+                            authenticated = True
+                        with span("batch_item", index=index, question_id=item["question_id"]):
+                            result["image"] = self.run_capture(
+                                driver, item["question_id"], username, password,
+                                item["wait_seconds"], item["crop_to_chart"], info, authenticated=True
+                            )
+                        result["success"] = True
+                        CAPTURES_TOTAL.inc(kind="batch", outcome="succeeded")
+                    except Exception as e:
+                        logger.error(f"Batch item {index} (question {item['question_id']}) failed: {e}")
+                        CAPTURE_FAILURES_TOTAL.inc(phase=info.get("phase"))
+                        CAPTURES_TOTAL.inc(kind="batch", outcome="failed")
+                        result["success"] = False
+                        result["error"] = str(e)
+                        result["phase"] = info.get("phase")
+                        healthy = self.driver_pool.is_healthy(driver)
+                    
+                    result["processing_time"] = round(time.time() - start_time, 2)
+                    result["ready_time"] = info.get("ready_time")
+                    result["phase_timings"] = info.get("phase_timings")
+                    results.put(result)
+            finally:
+                self.driver_pool.checkin(driver, discard=not healthy)
+                self.admission.release(admitted_at)
+                results.put(None)
+        
+        for i in range(workers):
+            # Each worker gets its own copy of the context so logs and spans keep the request ID
+            threading.Thread(target=contextvars.copy_context().run, args=(worker,), name=f"batch-worker-{i}",
+                             daemon=True).start()
+        
+        try:
+            finished = 0
+            while finished < workers:
+                result = results.get()
+                if result is None:
+                    finished += 1
+                    continue
+                yield result
+            
+            # Items left over when every worker lost its driver
+            while True:
+                try:
+                    index, item = work.get_nowait()
+                except queue.Empty:
+                    break
+                yield {"index": index, "question_id": item["question_id"], "success": False,
+                       "error": "No browser available to capture this question"}
+        finally:
+            cancelled.set()
 
 # Service instance
 screenshot_service = MetabaseScreenshotService()
+job_manager = JobManager(screenshot_service.capture_question_cached, workers=screenshot_service.capture_slots)
+scheduler = PrerenderScheduler(screenshot_service, load_schedule(SCHEDULE_FILE))
+
+def shutdown_service(timeout=SHUTDOWN_DRAIN_SECONDS):
+    """Hand queued jobs back, let running captures finish within timeout seconds, then quit every browser.
+
+    The whole drain fits in timeout: browsers still running when it runs out are
+    killed here rather than left behind when the process is killed.
+    """
+    deadline = time.time() + timeout
+    logger.info("="*60)
+    logger.info(f"SHUTTING DOWN: draining in-flight captures (up to {timeout} seconds)")
+    logger.info("="*60)
+    job_manager.shutdown(wait=False, cancel_pending=True)
+    scheduler.close()
+    if screenshot_service.tab_engine:
+        screenshot_service.tab_engine.close(timeout=max(0, deadline - time.time()))
+    if screenshot_service.capture_profile:
+        screenshot_service.capture_profile.close()
+    screenshot_service.driver_pool.drain(max(0, deadline - time.time()))
+    leftover = descendant_pids()
+    if leftover:
+        logger.warning(f"Killing {len(leftover)} browser processes still running after the drain")
+        for pid in leftover:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+@app.before_request
+def start_request_trace():
+    """Bind a request ID (from X-Request-Id or freshly generated) and a root trace span"""
+    g.trace_tokens = begin_request(request.headers.get('X-Request-Id'), f"{request.method} {request.path}")
+
+@app.after_request
+def add_request_id_header(response):
+    response.headers['X-Request-Id'] = current_request_id()
+    return response
+
+@app.teardown_request
+def finish_request_trace(exc):
+    tokens = g.pop('trace_tokens', None)
+    if tokens:
+        end_request(tokens)
+
+def check_renderer(renderer):
+    """Validate a request's renderer choice, defaulting to DEFAULT_RENDERER"""
+    renderer = renderer or DEFAULT_RENDERER
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unsupported renderer '{renderer}', expected one of: {', '.join(RENDERERS)}")
+    return renderer
+
+def check_max_age(max_age):
+    """Validate a request's max_age: None, or a non-negative number of seconds"""
+    if max_age is None:
+        return None
+    if isinstance(max_age, bool) or not isinstance(max_age, (int, float)) or not max_age >= 0:
+        raise ValueError(f"max_age must be a non-negative number of seconds, got {max_age!r}")
+    return max_age
+
+def busy_response(error, **extra):
+    """429/503 for a capture that was not admitted, with a Retry-After hint"""
+    response = jsonify({
+        "success": False,
+        "error": str(error),
+        "reason": error.reason,
+        "retry_after": error.retry_after,
+        "timestamp": datetime.now().isoformat(),
+        **extra
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, error.status
 
 @app.route('/screenshot', methods=['POST'])
 def take_screenshot():
     """API to convert Question to PNG"""
-    request_id = int(time.time())
+    request_id = current_request_id()
     logger.info(f"\n" + "+"*60)
     logger.info(f"NEW API REQUEST - ID: {request_id}")
     logger.info("+"*60)
@@ -625,57 +1268,145 @@ def take_screenshot():
         password = data.get('password')
         wait_seconds = data.get('wait_seconds', 10)
         crop_to_chart = data.get('crop_to_chart', True)
-        return_base64 = data.get('return_base64', True)
+        max_age = data.get('max_age')
+        encoding = {
+            "image_format": data.get('format'),
+            "quality": data.get('quality'),
+            "max_width": data.get('max_width'),
+            "thumbnail_sizes": data.get('thumbnail_sizes')
+        }
+        
+        try:
+            mode = response_mode(data)
+            renderer = check_renderer(data.get('renderer'))
+            max_age = check_max_age(max_age)
+            check_encoding_options(**encoding)
+            if mode == "binary" and encoding["thumbnail_sizes"]:
+                # A binary response carries exactly one image
+                raise ValueError("thumbnail_sizes needs response_mode 'json' or 'multipart'")
+        except (ValueError, TypeError, RasterUnavailable) as e:
+            return jsonify({
+                "success": False,
+                "error": str(e),
+                "request_id": request_id,
+                "timestamp": datetime.now().isoformat()
+            }), 400
         
         logger.info(f"Request parameters:")
         logger.info(f"  - Question ID: {question_id or DEFAULT_QUESTION_ID}")
         logger.info(f"  - Username: {username or DEFAULT_USERNAME}")
         logger.info(f"  - Wait seconds: {wait_seconds}")
         logger.info(f"  - Crop to chart: {crop_to_chart}")
-        logger.info(f"  - Return Base64: {return_base64}")
+        logger.info(f"  - Response mode: {mode}")
+        logger.info(f"  - Renderer: {renderer}")
+        logger.info(f"  - Max cache age: {max_age}")
+        logger.info(f"  - Encoding: {encoding}")
         
         start_time = time.time()
-        screenshot_png = screenshot_service.capture_question(
+        capture_info = {}
+        screenshot_png = screenshot_service.capture_question_cached(
             question_id=question_id,
             username=username,
             password=password,
             wait_seconds=wait_seconds,
-            crop_to_chart=crop_to_chart
+            crop_to_chart=crop_to_chart,
+            max_age=max_age,
+            renderer=renderer,
+            info=capture_info
         )
         end_time = time.time()
         
+        # Feeds the hot set the scheduler keeps warm; only credentials that just rendered are kept
+        scheduler.record_request(question_id or DEFAULT_QUESTION_ID, {
+            "username": username,
+            "password": password,
+            "wait_seconds": wait_seconds,
+            "crop_to_chart": crop_to_chart,
+            "renderer": renderer
+        })
+        
         total_time = end_time - start_time
         logger.info(f"Total processing time: {total_time:.2f} seconds")
         
-        if return_base64:
+        with timed_step("encode", capture_info.setdefault("step_timings", {})):
+            image, thumbnails = encode_variants(screenshot_png, **encoding)
+        REQUEST_SECONDS.observe(time.time() - start_time, endpoint="screenshot")
+        
+        if mode == "json":
             logger.info("Converting to Base64...")
-            image_base64 = base64.b64encode(screenshot_png).decode()
+            image_base64 = base64.b64encode(image.data).decode()
             logger.info(f"Base64 conversion completed: {len(image_base64):,} characters")
             
             response = {
                 "success": True,
                 "image_base64": image_base64,
+                "mimetype": image.mimetype,
                 "timestamp": datetime.now().isoformat(),
                 "question_id": question_id or DEFAULT_QUESTION_ID,
                 "base_url": METABASE_BASE_URL,
                 "processing_time": round(total_time, 2),
-                "image_size": len(screenshot_png)
+                "chart_ready": capture_info.get("chart_ready"),
+                "ready_time": capture_info.get("ready_time"),
+                "cached": capture_info.get("cached", False),
+                "cache_age": capture_info.get("cache_age"),
+                "data_unchanged": capture_info.get("data_unchanged", False),
+                "coalesced": capture_info.get("coalesced"),
+                "renderer": capture_info.get("renderer"),
+                "native_fallback": capture_info.get("native_fallback"),
+                "image_size": len(image.data),
+                "original_size": len(screenshot_png),
+                "phase_timings": capture_info.get("phase_timings"),
+                "step_timings": capture_info.get("step_timings")
             }
+            if thumbnails:
+                response["thumbnails"] = [{
+                    "width": thumbnail.width,
+                    "height": thumbnail.height,
+                    "image_size": len(thumbnail.data),
+                    "image_base64": base64.b64encode(thumbnail.data).decode()
+                } for thumbnail in thumbnails]
+            
+            if data.get('trace'):
+                response["trace"] = current_trace()
             
             logger.info(f"API Request {request_id} completed successfully")
             return jsonify(response)
-        else:
-            logger.info("Returning binary file...")
-            filename = f'metabase_question_{question_id or DEFAULT_QUESTION_ID}_{int(time.time())}.png'
-            logger.info(f"Filename: {filename}")
-            
-            return send_file(
-                io.BytesIO(screenshot_png),
-                mimetype='image/png',
-                as_attachment=True,
-                download_name=filename
-            )
+        
+        metadata = {
+            "question_id": question_id or DEFAULT_QUESTION_ID,
+            "processing_time": round(total_time, 2),
+            "chart_ready": capture_info.get("chart_ready"),
+            "ready_time": capture_info.get("ready_time"),
+            "cache": "HIT" if capture_info.get("cached") else "MISS",
+            "cache_age": capture_info.get("cache_age"),
+            "data_unchanged": capture_info.get("data_unchanged", False),
+            "coalesced": capture_info.get("coalesced"),
+            "renderer": capture_info.get("renderer"),
+            "original_size": len(screenshot_png),
+            "image_width": image.width,
+            "image_height": image.height,
+            "phase_timings": capture_info.get("phase_timings")
+        }
+        filename = f'metabase_question_{question_id or DEFAULT_QUESTION_ID}_{int(time.time())}.{image.extension}'
+        logger.info(f"Returning {mode} response: {filename}")
+        
+        if mode == "binary":
+            return binary_response(image.data, image.mimetype, filename, metadata)
+        
+        # multipart: the main image followed by each thumbnail as its own part
+        parts = [(image.data, image.mimetype, filename, metadata)]
+        for index, thumbnail in enumerate(thumbnails):
+            parts.append((
+                thumbnail.data, thumbnail.mimetype,
+                f'metabase_question_{question_id or DEFAULT_QUESTION_ID}_thumb{index}.{thumbnail.extension}',
+                {"question_id": question_id or DEFAULT_QUESTION_ID, "thumbnail": index,
+                 "image_width": thumbnail.width, "image_height": thumbnail.height}
+            ))
+        return multipart_response(parts)
             
+    except AdmissionRejected as e:
+        logger.warning(f"API Request {request_id} rejected: {e}")
+        return busy_response(e, request_id=request_id)
     except Exception as e:
         logger.error(f"API Request {request_id} failed: {e}")
         return jsonify({
@@ -685,6 +1416,278 @@ def take_screenshot():
             "timestamp": datetime.now().isoformat()
         }), 500
 
+@app.route('/dashboard', methods=['POST'])
+def dashboard_screenshot():
+    """Capture a whole dashboard, or every dashcard cropped from one raster"""
+    try:
+        data = request.json or {}
+        dashboard_id = data.get('dashboard_id')
+        if not dashboard_id:
+            return jsonify({"success": False, "error": "dashboard_id is required"}), 400
+        per_card = data.get('per_card', False)
+        try:
+            mode = response_mode(data)
+            max_age = check_max_age(data.get('max_age'))
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        
+        start_time = time.time()
+        capture_info = {}
+        result = screenshot_service.capture_dashboard_cached(
+            dashboard_id,
+            username=data.get('username'),
+            password=data.get('password'),
+            wait_seconds=data.get('wait_seconds', 30),
+            per_card=per_card,
+            max_age=max_age,
+            info=capture_info
+        )
+        total_time = time.time() - start_time
+        REQUEST_SECONDS.observe(total_time, endpoint="dashboard")
+        
+        metadata = {
+            "dashboard_id": dashboard_id,
+            "processing_time": round(total_time, 2),
+            "chart_ready": capture_info.get("chart_ready"),
+            "ready_time": capture_info.get("ready_time"),
+            "device_pixel_ratio": result["device_pixel_ratio"],
+            "cropped": capture_info.get("cropped"),
+            "cache": "HIT" if capture_info.get("cached") else "MISS",
+            "cache_age": capture_info.get("cache_age"),
+            "cards": len(result["cards"])
+        }
+        
+        if mode == "binary" and not capture_info.get("cropped"):
+            return binary_response(result["image"], 'image/png', f'metabase_dashboard_{dashboard_id}.png', metadata)
+        
+        if mode != "json":
+            # One part per cropped card, or the whole dashboard when nothing was cropped,
+            # preceded by a JSON part carrying the card rects
+            def parts():
+                cards = [{key: value for key, value in card.items() if key != "image"} for card in result["cards"]]
+                yield {"success": True, "timestamp": datetime.now().isoformat(), **metadata, "cards": cards}, \
+                    "application/json", None, None
+                if not capture_info.get("cropped"):
+                    yield result["image"], 'image/png', f'metabase_dashboard_{dashboard_id}.png', {"dashboard_id": dashboard_id}
+                    return
+                for card in result["cards"]:
+                    if card.get("image") is None:
+                        continue
+                    yield card["image"], 'image/png', f'metabase_dashboard_{dashboard_id}_card{card["index"]}.png', {
+                        "card_index": card["index"],
+                        "dashcard_id": card.get("dashcard_id"),
+                        "card_title": card.get("title")
+                    }
+            return multipart_response(parts())
+        
+        cards = []
+        for card in result["cards"]:
+            card = dict(card)
+            image = card.pop("image", None)
+            if image is not None:
+                card["image_size"] = len(image)
+                card["image_base64"] = base64.b64encode(image).decode()
+            cards.append(card)
+        
+        response = {
+            "success": True,
+            "dashboard_id": dashboard_id,
+            "timestamp": datetime.now().isoformat(),
+            "processing_time": round(total_time, 2),
+            "chart_ready": capture_info.get("chart_ready"),
+            "ready_time": capture_info.get("ready_time"),
+            "device_pixel_ratio": result["device_pixel_ratio"],
+            "cropped": capture_info.get("cropped"),
+            "cached": capture_info.get("cached", False),
+            "cache_age": capture_info.get("cache_age"),
+            "phase_timings": capture_info.get("phase_timings"),
+            "step_timings": capture_info.get("step_timings"),
+            "cards": cards
+        }
+        if data.get('trace'):
+            response["trace"] = current_trace()
+        if not capture_info.get("cropped"):
+            response["image_size"] = len(result["image"])
+            response["image_base64"] = base64.b64encode(result["image"]).decode()
+        return jsonify(response)
+        
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error(f"Dashboard API error: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route('/batch', methods=['POST'])
+def batch_screenshot():
+    """Capture many questions with one login, streaming NDJSON results as they finish"""
+    try:
+        data = request.json or {}
+        default_wait = data.get('wait_seconds', 10)
+        default_crop = data.get('crop_to_chart', True)
+        mode = data.get('response_mode', 'ndjson')
+        if mode not in ('ndjson', 'multipart'):
+            return jsonify({"success": False, "error": "Batch response_mode must be 'ndjson' or 'multipart'"}), 400
+        
+        items = []
+        for entry in data.get('questions') or []:
+            if not isinstance(entry, dict):
+                entry = {"question_id": entry}
+            items.append({
+                "question_id": str(entry.get('question_id') or DEFAULT_QUESTION_ID),
+                "wait_seconds": entry.get('wait_seconds', default_wait),
+                "crop_to_chart": entry.get('crop_to_chart', default_crop)
+            })
+        
+        if not items:
+            return jsonify({"success": False, "error": "questions must be a non-empty list"}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({"success": False, "error": f"At most {BATCH_MAX_ITEMS} questions per batch"}), 400
+        drivers = data.get('drivers', BATCH_DRIVERS)
+        if isinstance(drivers, bool) or not isinstance(drivers, int) or drivers < 1:
+            return jsonify({"success": False, "error": "drivers must be a positive integer"}), 400
+        
+        if screenshot_service.admission.saturated():
+            return busy_response(AdmissionRejected(
+                "Capture queue is full", retry_after=screenshot_service.admission.retry_after()))
+        
+        logger.info(f"Batch request: {len(items)} questions")
+        results = screenshot_service.capture_batch(
+            items,
+            username=data.get('username'),
+            password=data.get('password'),
+            drivers=min(drivers, BATCH_DRIVERS)
+        )
+        
+        def generate():
+            start_time = time.time()
+            succeeded = 0
+            for result in results:
+                image = result.pop("image", None)
+                if image is not None:
+                    succeeded += 1
+                    result["image_size"] = len(image)
+                    result["image_base64"] = base64.b64encode(image).decode()
+                yield json.dumps(result) + "\n"
+            
+            yield json.dumps({
+                "done": True,
+                "total": len(items),
+                "succeeded": succeeded,
+                "failed": len(items) - succeeded,
+                "processing_time": round(time.time() - start_time, 2),
+                "timestamp": datetime.now().isoformat()
+            }) + "\n"
+        
+        def parts():
+            # Each image part carries its result in headers; failures become JSON parts
+            start_time = time.time()
+            succeeded = 0
+            for result in results:
+                image = result.pop("image", None)
+                if image is None:
+                    yield result, "application/json", None, {"index": result["index"], "success": False}
+                    continue
+                succeeded += 1
+                filename = f'metabase_question_{result["question_id"]}.png'
+                yield image, 'image/png', filename, result
+            
+            yield {
+                "done": True,
+                "total": len(items),
+                "succeeded": succeeded,
+                "failed": len(items) - succeeded,
+                "processing_time": round(time.time() - start_time, 2),
+                "timestamp": datetime.now().isoformat()
+            }, "application/json", None, None
+        
+        # The body is produced after this request's context is gone, so the stream carries its own
+        if mode == 'multipart':
+            return multipart_response(in_context(parts(), name="POST /batch (stream)"))
+        return Response(in_context(generate(), name="POST /batch (stream)"), mimetype='application/x-ndjson')
+        
+    except Exception as e:
+        logger.error(f"Batch API error: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue an asynchronous screenshot capture and return its job ID"""
+    try:
+        data = request.json or {}
+        params = {
+            "question_id": data.get('question_id') or DEFAULT_QUESTION_ID,
+            "username": data.get('username'),
+            "password": data.get('password'),
+            "wait_seconds": data.get('wait_seconds', 10),
+            "crop_to_chart": data.get('crop_to_chart', True),
+            "max_age": check_max_age(data.get('max_age')),
+            "renderer": check_renderer(data.get('renderer'))
+        }
+        job = job_manager.submit(params, callback_url=data.get('callback_url'))
+        
+        response = job.to_dict()
+        response["status_url"] = f"/jobs/{job.id}"
+        return jsonify(response), 202
+        
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 400
+    except JobQueueFull as e:
+        logger.warning(f"Job rejected: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 503
+    except Exception as e:
+        logger.error(f"Job creation error: {e}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job state, current phase and, once finished, the result"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": f"Unknown job: {job_id}"}), 404
+    
+    include_image = request.args.get('include_image', 'false').lower() == 'true'
+    response = job.to_dict(include_image=include_image)
+    if job.state == "succeeded":
+        response["image_url"] = f"/jobs/{job.id}/image"
+    return jsonify(response)
+
+@app.route('/jobs/<job_id>/image', methods=['GET'])
+def get_job_image(job_id):
+    """Binary PNG of a finished job"""
+    job = job_manager.get(job_id)
+    if not job or job.state != "succeeded":
+        return jsonify({"success": False, "error": f"No image for job: {job_id}"}), 404
+    
+    result = job.result
+    if result is None:
+        return jsonify({"success": False, "error": f"No image for job: {job_id}"}), 404
+    
+    return send_file(
+        io.BytesIO(result),
+        mimetype='image/png',
+        download_name=f'metabase_question_{job.params["question_id"]}.png'
+    )
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Service health check"""
@@ -694,9 +1697,37 @@ def health_check():
         "timestamp": datetime.now().isoformat(),
         "service": "Metabase Screenshot Service",
         "base_url": METABASE_BASE_URL,
-        "default_question_id": DEFAULT_QUESTION_ID
+        "default_question_id": DEFAULT_QUESTION_ID,
+        "pid": os.getpid(),
+        "driver_pool": screenshot_service.driver_pool.stats(),
+        "session_cache": screenshot_service.session_cache.stats(),
+        "jobs": job_manager.stats(),
+        "image_cache": screenshot_service.image_cache.stats(),
+        "singleflight": screenshot_service.singleflight.stats(),
+        "admission": screenshot_service.admission.stats(),
+        "tab_engine": screenshot_service.tab_engine.stats() if screenshot_service.tab_engine else None,
+        "capture_profile": screenshot_service.capture_profile.stats() if screenshot_service.capture_profile else None,
+        "scheduler": scheduler.stats()
     })
 
+@app.route('/schedule', methods=['GET'])
+def get_schedule():
+    """Schedule entries with their last runs, and the learned hot set"""
+    return jsonify(scheduler.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text-format metrics for this process"""
+    pool = screenshot_service.driver_pool.stats()
+    admission = screenshot_service.admission.stats()
+    POOL_DRIVERS.set(pool["in_use"], state="in_use")
+    POOL_DRIVERS.set(pool["idle"], state="idle")
+    ADMISSION_QUEUE_DEPTH.set(admission["queue_depth"])
+    ADMISSION_ACTIVE.set(admission["active"])
+    if admission["browser_rss_mb"] is not None:
+        BROWSER_RSS_BYTES.set(int(admission["browser_rss_mb"] * 1024 * 1024))
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/test', methods=['POST'])
 def test_login():
     """Login test endpoint"""
@@ -709,9 +1740,7 @@ def test_login():
         
         logger.info(f"Testing login with username: {username}")
         
-        driver = webdriver.Firefox(options=screenshot_service.firefox_options)
-        
-        try:
+        with screenshot_service.driver_pool.borrow() as driver:
             result = screenshot_service.login_to_metabase(driver, username, password)
             
             response = {
@@ -725,9 +1754,6 @@ def test_login():
             logger.info(f"Login test result: {'SUCCESS' if result else 'FAILED'}")
             return jsonify(response)
             
-        finally:
-            driver.quit()
-            
     except Exception as e:
         logger.error(f"Login test error: {e}")
         return jsonify({
@@ -743,7 +1769,12 @@ def get_config():
     return jsonify({
         "base_url": METABASE_BASE_URL,
         "default_question_id": DEFAULT_QUESTION_ID,
-        "default_username": DEFAULT_USERNAME
+        "default_username": DEFAULT_USERNAME,
+        "login_mode": LOGIN_MODE,
+        "captures_per_worker": CAPTURES_PER_WORKER,
+        "capture_engine": CAPTURE_ENGINE,
+        "default_renderer": DEFAULT_RENDERER,
+        "schedule_file": SCHEDULE_FILE
     })
 
 @app.route('/diagnose', methods=['POST'])
@@ -752,9 +1783,7 @@ def diagnose_login():
     try:
         data = request.json or {}
         
-        driver = webdriver.Firefox(options=screenshot_service.firefox_options)
-        
-        try:
+        with screenshot_service.driver_pool.borrow() as driver:
             login_url = f"{METABASE_BASE_URL}/auth/login"
             logger.info(f"Diagnosing: {login_url}")
             
@@ -786,7 +1815,7 @@ def diagnose_login():
                 except:
                     input_info.append({"index": i, "error": "Could not read attributes"})
             
-                        return jsonify({
+            return jsonify({
                 "success": True,
                 "url": current_url,
                 "title": title,
@@ -799,9 +1828,6 @@ def diagnose_login():
                 "has_form": "<form" in page_source.lower()
             })
             
-        finally:
-            driver.quit()
-            
     except Exception as e:
         return jsonify({
             "success": False,
@@ -817,15 +1843,14 @@ def debug_chart_detection():
         username = data.get('username') or DEFAULT_USERNAME
         password = data.get('password') or DEFAULT_PASSWORD
         
-        driver = webdriver.Firefox(options=screenshot_service.firefox_options)
-        
-        try:
-            if not screenshot_service.login_to_metabase(driver, username, password):
+        with screenshot_service.driver_pool.borrow() as driver:
+            if not screenshot_service.authenticate(driver, username, password):
                 return jsonify({"error": "Login failed"}), 500
             
             question_url = f"{METABASE_BASE_URL}/question/{question_id}"
-            driver.get(question_url)
-            time.sleep(10)
+            if not screenshot_service.open_authenticated(driver, question_url, username, password):
+                return jsonify({"error": "Login failed"}), 500
+            readiness = screenshot_service.wait_for_question_load(driver, 10)
             
             analysis_script = """
             const allElements = document.querySelectorAll('*');
@@ -860,12 +1885,10 @@ def debug_chart_detection():
             return jsonify({
                 "success": True,
                 "candidates": candidates[:20],
-                "total_candidates": len(candidates)
+                "total_candidates": len(candidates),
+                "readiness": readiness
             })
             
-        finally:
-            driver.quit()
-            
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -875,17 +1898,28 @@ if __name__ == '__main__':
     logger.info("="*60)
     logger.info("Available endpoints:")
     logger.info("   POST /screenshot - Convert Question to PNG")
+    logger.info("   POST /dashboard - Capture a dashboard or its cards")
+    logger.info("   POST /batch - Capture many questions, streaming results")
+    logger.info("   POST /jobs - Queue asynchronous capture")
+    logger.info("   GET /jobs/<id> - Job state, phase and result")
     logger.info("   POST /test - Login test")
     logger.info("   POST /diagnose - Quick login page diagnosis")
     logger.info("   POST /debug-chart - Debug chart element detection")
     logger.info("   GET /health - Service health check")
+    logger.info("   GET /schedule - Pre-render schedule and hot set")
+    logger.info("   GET /metrics - Prometheus metrics")
     logger.info("   GET /config - View current configuration")
     logger.info(f"Configuration:")
     logger.info(f"   Base URL: {METABASE_BASE_URL}")
     logger.info(f"   Default Question ID: {DEFAULT_QUESTION_ID}")
     logger.info(f"   Default Username: {DEFAULT_USERNAME}")
     logger.info("="*60)
+    logger.info("Development server; for production use: gunicorn -c gunicorn.conf.py run:app")
     logger.info("Server starting on: http://0.0.0.0:5000")
     logger.info("="*60)
     
+    screenshot_service.start()
+    scheduler.start()
+    job_manager.adopt_orphans()
+    
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -12,11 +12,17 @@ import io
 from datetime import datetime
 import logging
 
+from driver_pool import DriverPool
+from session_cache import SessionCache
+from metabase_api import MetabaseAPIClient, MetabaseAPIError
+from chart_ready import wait_for_chart_ready
+
 # Configuration
 METABASE_BASE_URL = "http://your-metabase.com"
 DEFAULT_QUESTION_ID = "123"
 DEFAULT_USERNAME = "your-username"
 DEFAULT_PASSWORD = "your-password"
+LOGIN_MODE = "api"  # "api" (session API) or "form" (login page)
 
 # Setup logging
 logging.basicConfig(
@@ -39,6 +45,15 @@ class MetabaseScreenshotService:
         self.firefox_options.add_argument("--height=1000")
         logger.info("Firefox options configured")
         
+        self.driver_pool = DriverPool(self.create_driver)
+        self.session_cache = SessionCache()
+        self.api_client = MetabaseAPIClient(METABASE_BASE_URL)
+    
+    def create_driver(self):
+        """Launch a new headless Firefox driver for the pool"""
+        logger.info("Creating Firefox driver...")
+        return webdriver.Firefox(options=self.firefox_options)
+        
     def login_to_metabase(self, driver, username, password):
         """Simple login based on Gist approach"""
         login_url = f"{METABASE_BASE_URL}/auth/login"
@@ -102,7 +117,10 @@ class MetabaseScreenshotService:
                 password_element.send_keys("\n")
             
             # Wait for login to complete
-            time.sleep(3)
+            try:
+                WebDriverWait(driver, 10).until(lambda d: "/auth/login" not in d.current_url)
+            except TimeoutException:
+                pass
             
             # Check if login was successful
             current_url = driver.current_url
@@ -117,38 +135,73 @@ class MetabaseScreenshotService:
             logger.error(f"Login error: {e}")
             return False
     
+    def login_via_api(self, driver, username, password):
+        """Get a session token over HTTP and attach it to the browser as a cookie"""
+        try:
+            token = self.api_client.create_session(username, password)
+        except MetabaseAPIError as e:
+            logger.warning(f"API login failed: {e}")
+            return False
+        
+        cookie = self.session_cache.store_token(username, password, token)
+        try:
+            self.session_cache.attach(driver, METABASE_BASE_URL, cookie)
+        except Exception as e:
+            logger.warning(f"Failed to attach session cookie: {e}")
+            self.session_cache.invalidate(username)
+            return False
+        
+        logger.info("Logged in via session API")
+        return True
+    
+    def authenticate(self, driver, username, password):
+        """Reuse a cached session cookie, logging in through the form only on a miss"""
+        if self.session_cache.inject(driver, METABASE_BASE_URL, username, password):
+            logger.info(f"Reusing cached session for {username}")
+            return True
+        
+        if LOGIN_MODE == "api" and self.login_via_api(driver, username, password):
+            return True
+        
+        if not self.login_to_metabase(driver, username, password):
+            return False
+        
+        self.session_cache.store_from_driver(driver, username, password)
+        return True
+    
+    def open_authenticated(self, driver, url, username, password):
+        """Load a page, logging in again if Metabase redirects to /auth/login"""
+        driver.get(url)
+        if "/auth/login" not in driver.current_url:
+            return True
+        
+        logger.warning("Redirected to login page, cached session rejected")
+        self.session_cache.invalidate(username)
+        if not self.authenticate(driver, username, password):
+            return False
+        
+        driver.get(url)
+        return "/auth/login" not in driver.current_url
+    
     def wait_for_chart_load(self, driver, wait_seconds=10):
         """Wait for chart to load on question page"""
         logger.info("Waiting for chart to load...")
         
-        # Wait for visualization elements
-        chart_selectors = [
-            ".Visualization",
-            "svg",
-            "canvas",
-            ".Card .Card-content"
-        ]
-        
-        chart_found = False
-        for selector in chart_selectors:
-            try:
-                WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, selector))
-                )
-                logger.info(f"Chart element found: {selector}")
-                chart_found = True
-                break
-            except TimeoutException:
-                continue
-        
-        if not chart_found:
-            logger.warning("No chart elements found, but continuing...")
+        # Wait until the chart is stable, with wait_seconds as the upper bound
+        try:
+            result = wait_for_chart_ready(driver, wait_seconds)
+        except Exception as e:
+            logger.error(f"Readiness detection failed: {e}, falling back to fixed wait")
+            time.sleep(wait_seconds)
+            result = {"ready": False, "reason": "error", "ready_time": wait_seconds}
         
-        # Additional wait for chart rendering
-        logger.info(f"Additional wait for chart rendering: {wait_seconds} seconds")
-        time.sleep(wait_seconds)
+        if result.get("ready"):
+            logger.info(f"Chart ready in {result['ready_time']:.2f} seconds")
+        else:
+            logger.warning(f"Chart not stable after {result['ready_time']:.2f} seconds "
+                           f"({result.get('reason')}), continuing...")
         
-        return chart_found
+        return result
     
     def capture_chart_area(self, driver):
         """Capture chart area or full page"""
@@ -177,8 +230,10 @@ class MetabaseScreenshotService:
         logger.info("Capturing full page screenshot")
         return driver.get_screenshot_as_png()
     
-    def capture_question(self, question_id=None, username=None, password=None, wait_seconds=10, crop_to_chart=True):
-        """Main function to capture question as PNG"""
+    def capture_question(self, question_id=None, username=None, password=None, wait_seconds=10, crop_to_chart=True,
+                         info=None):
+        """Main function to capture question as PNG, recording capture details into info"""
+        info = {} if info is None else info
         logger.info("Starting screenshot capture process")
         
         # Use defaults if not provided
@@ -189,25 +244,29 @@ class MetabaseScreenshotService:
         logger.info(f"Target: {METABASE_BASE_URL}/question/{question_id}")
         logger.info(f"Username: {username}")
         
-        # Initialize driver
-        logger.info("Creating Firefox driver...")
-        driver = webdriver.Firefox(options=self.firefox_options)
+        # Borrow a warm driver from the pool
+        logger.info("Borrowing Firefox driver from pool...")
+        driver = self.driver_pool.checkout()
         
+        healthy = True
         try:
             # Step 1: Login
             logger.info("Step 1: Login")
-            if not self.login_to_metabase(driver, username, password):
+            if not self.authenticate(driver, username, password):
                 raise Exception("Login failed")
             
             # Step 2: Navigate to question
             logger.info("Step 2: Navigate to question")
             question_url = f"{METABASE_BASE_URL}/question/{question_id}"
-            driver.get(question_url)
+            if not self.open_authenticated(driver, question_url, username, password):
+                raise Exception("Login failed")
             logger.info(f"Question page loaded: {driver.current_url}")
             
             # Step 3: Wait for chart
             logger.info("Step 3: Wait for chart to load")
-            self.wait_for_chart_load(driver, wait_seconds)
+            readiness = self.wait_for_chart_load(driver, wait_seconds)
+            info["chart_ready"] = readiness.get("ready", False)
+            info["ready_time"] = readiness.get("ready_time")
             
             # Step 4: Capture screenshot
             logger.info("Step 4: Capture screenshot")
@@ -227,10 +286,11 @@ class MetabaseScreenshotService:
                 logger.info("Error screenshot saved: error_screenshot.png")
             except:
                 pass
+            healthy = self.driver_pool.is_healthy(driver)
             raise
         finally:
-            logger.info("Closing driver")
-            driver.quit()
+            logger.info("Returning driver to pool")
+            self.driver_pool.checkin(driver, discard=not healthy)
 
 # Service instance
 screenshot_service = MetabaseScreenshotService()
@@ -251,12 +311,14 @@ def take_screenshot():
         
         # Capture screenshot
         start_time = time.time()
+        capture_info = {}
         screenshot_png = screenshot_service.capture_question(
             question_id=question_id,
             username=username,
             password=password,
             wait_seconds=wait_seconds,
-            crop_to_chart=crop_to_chart
+            crop_to_chart=crop_to_chart,
+            info=capture_info
         )
         end_time = time.time()
         
@@ -268,16 +330,20 @@ def take_screenshot():
                 "timestamp": datetime.now().isoformat(),
                 "question_id": question_id or DEFAULT_QUESTION_ID,
                 "processing_time": round(end_time - start_time, 2),
+                "chart_ready": capture_info.get("chart_ready"),
+                "ready_time": capture_info.get("ready_time"),
                 "image_size": len(screenshot_png)
             })
         else:
             filename = f'metabase_question_{question_id or DEFAULT_QUESTION_ID}.png'
-            return send_file(
+            response = send_file(
                 io.BytesIO(screenshot_png),
                 mimetype='image/png',
                 as_attachment=True,
                 download_name=filename
             )
+            response.headers['X-Ready-Time'] = str(capture_info.get("ready_time"))
+            return response
             
     except Exception as e:
         logger.error(f"API error: {e}")
@@ -297,9 +363,7 @@ def test_login():
         username = data.get('username') or DEFAULT_USERNAME
         password = data.get('password') or DEFAULT_PASSWORD
         
-        driver = webdriver.Firefox(options=screenshot_service.firefox_options)
-        
-        try:
+        with screenshot_service.driver_pool.borrow() as driver:
             result = screenshot_service.login_to_metabase(driver, username, password)
             return jsonify({
                 "success": result,
@@ -307,8 +371,6 @@ def test_login():
                 "current_url": driver.current_url,
                 "timestamp": datetime.now().isoformat()
             })
-        finally:
-            driver.quit()
             
     except Exception as e:
         logger.error(f"Test login error: {e}")
@@ -324,7 +386,9 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "service": "Metabase Screenshot Service"
+        "service": "Metabase Screenshot Service",
+        "driver_pool": screenshot_service.driver_pool.stats(),
+        "session_cache": screenshot_service.session_cache.stats()
     })
 
 @app.route('/config', methods=['GET'])
@@ -333,7 +397,8 @@ def get_config():
     return jsonify({
         "base_url": METABASE_BASE_URL,
         "default_question_id": DEFAULT_QUESTION_ID,
-        "default_username": DEFAULT_USERNAME
+        "default_username": DEFAULT_USERNAME,
+        "login_mode": LOGIN_MODE
     })
 
 if __name__ == '__main__':
@@ -346,4 +411,6 @@ if __name__ == '__main__':
     logger.info("  GET /config - View config")
     logger.info("Server starting on http://0.0.0.0:5000")
     
+    screenshot_service.driver_pool.start()
+    
     app.run(host='0.0.0.0', port=5000, debug=False)
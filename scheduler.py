@@ -0,0 +1,359 @@
+# scheduler.py
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from session_cache import credential_digest
+from tracing import begin_request, end_request
+
+logger = logging.getLogger(__name__)
+
+# Scheduler configuration
+SCHEDULE_FILE = os.environ.get("SCHEDULE_FILE")  # JSON list of {"cron", "question_id" | "dashboard_id", ...}
+SCHEDULER_CONCURRENCY = 2
+SCHEDULER_TICK_SECONDS = 15
+SCHEDULER_LOCK_FILE = "scheduler.lock"
+HOT_SET_ENABLED = True
+HOT_SET_SIZE = 50
+HOT_WINDOW_SECONDS = 60 * 60
+HOT_MIN_REQUESTS = 3
+HOT_REFRESH_AGE = 15 * 60  # re-render a hot question once its cached image is this old
+HOT_CHECK_SECONDS = 60
+
+CRON_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 6))
+CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *"
+}
+QUESTION_OPTIONS = ("username", "password", "wait_seconds", "crop_to_chart", "renderer")
+DASHBOARD_OPTIONS = ("username", "password", "wait_seconds", "per_card")
+
+
+class CronSchedule:
+    """Five-field cron expression (minute hour day month weekday) in local time.
+
+    Supports *, lists, ranges and steps (e.g. "*/15 7-9 * * 1-5" or "5/15"); Sunday is 0 or 7.
+    As in cron, a restricted day and weekday match when either one does.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression '{expression}' must have 5 fields")
+        self.fields = [self._parse(field, name, low, high) for field, (name, low, high) in zip(fields, CRON_FIELDS)]
+        self.fields[4] = {0 if day == 7 else day for day in self.fields[4]}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field, name, low, high):
+        values = set()
+        top = 7 if name == "weekday" else high
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-", 1))
+            else:
+                start = end = int(part)
+                if step:
+                    # "5/15" means every 15 starting at 5, as in cron
+                    end = high
+            step = int(step) if step else 1
+            if not (low <= start <= top and low <= end <= top and start <= end and step > 0):
+                raise ValueError(f"invalid cron {name} '{field}'")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matches(self, moment):
+        minutes, hours, days, months, weekdays = self.fields
+        if moment.minute not in minutes or moment.hour not in hours or moment.month not in months:
+            return False
+        day = moment.day in days
+        weekday = (moment.weekday() + 1) % 7 in weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+
+class ScheduledRender:
+    """One schedule entry and the outcome of its last run"""
+
+    def __init__(self, index, entry):
+        if not isinstance(entry, dict) or "cron" not in entry:
+            raise ValueError(f"schedule entry {index} needs a 'cron' expression")
+        if ("question_id" in entry) == ("dashboard_id" in entry):
+            raise ValueError(f"schedule entry {index} needs exactly one of 'question_id' or 'dashboard_id'")
+        self.cron = CronSchedule(entry["cron"])
+        self.kind = "question" if "question_id" in entry else "dashboard"
+        self.target = str(entry["question_id"] if self.kind == "question" else entry["dashboard_id"])
+        allowed = QUESTION_OPTIONS if self.kind == "question" else DASHBOARD_OPTIONS
+        self.params = {key: entry[key] for key in allowed if key in entry}
+        self.name = entry.get("name") or f"{self.kind} {self.target}"
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_status = None
+        self.last_duration = None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "cron": self.cron.expression,
+            "kind": self.kind,
+            "target": self.target,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_run": datetime.fromtimestamp(self.last_run).isoformat() if self.last_run else None,
+            "last_status": self.last_status,
+            "last_duration": self.last_duration
+        }
+
+
+def load_schedule(path):
+    """Schedule entries from a JSON file, or none when no file is configured"""
+    if not path:
+        return []
+    with open(path) as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError(f"{path} must contain a JSON list of schedule entries")
+    return [ScheduledRender(index, entry) for index, entry in enumerate(entries)]
+
+
+class HotSet:
+    """Questions requested most often in a sliding window, with the parameters they were requested with"""
+
+    def __init__(self, window=HOT_WINDOW_SECONDS, size=HOT_SET_SIZE, min_requests=HOT_MIN_REQUESTS):
+        self.window = window
+        self.size = size
+        self.min_requests = min_requests
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def record(self, question_id, params):
+        """Count a successful request; each set of credentials is tracked on its own"""
+        # Keyed by password too, so one caller's credentials never replace another's
+        key = json.dumps([str(question_id), credential_digest(params.get("username"), params.get("password")),
+                          params.get("crop_to_chart", True), params.get("renderer")])
+        now = time.time()
+        with self._lock:
+            times, _ = self._requests.get(key, (deque(), None))
+            times.append(now)
+            self._requests[key] = (times, dict(params, question_id=str(question_id)))
+
+    def hot(self):
+        """Parameters of the hottest questions, most requested first"""
+        cutoff = time.time() - self.window
+        with self._lock:
+            ranked = []
+            for key, (times, params) in list(self._requests.items()):
+                while times and times[0] < cutoff:
+                    times.popleft()
+                if not times:
+                    del self._requests[key]
+                elif len(times) >= self.min_requests:
+                    ranked.append((len(times), params))
+        ranked.sort(key=lambda item: -item[0])
+        return [dict(params, requests=count) for count, params in ranked[:self.size]]
+
+    def stats(self):
+        with self._lock:
+            tracked = len(self._requests)
+        return {"tracked": tracked, "window_seconds": self.window, "hot": len(self.hot())}
+
+
+class PrerenderScheduler:
+    """Renders scheduled and frequently requested questions into the image cache ahead of demand.
+
+    Schedule entries fire on their cron minute. Under gunicorn only the worker
+    holding SCHEDULER_LOCK_FILE runs them; every worker refreshes the hot set it
+    learned from its own traffic, skipping questions whose shared cache entry
+    is still fresh. Renders run on a small pool, so background work never holds
+    more than SCHEDULER_CONCURRENCY browsers.
+    """
+
+    def __init__(self, service, entries=None, concurrency=SCHEDULER_CONCURRENCY):
+        self.service = service
+        self.entries = entries or []
+        self.concurrency = concurrency
+        self.hot_set = HotSet()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="prerender")
+        self._in_flight = set()
+        self._hot_attempts = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+        self._last_tick = None
+        self._last_hot_check = 0
+        self.completed = 0
+        self.failed = 0
+        self.hot_refreshes = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or self._stop.is_set():
+                return
+            self._thread = threading.Thread(target=self._run, name="prerender-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Pre-render scheduler started: {len(self.entries)} schedule entries, "
+                    f"hot set {'on' if HOT_SET_ENABLED else 'off'}, concurrency {self.concurrency}")
+
+    def record_request(self, question_id, params):
+        if HOT_SET_ENABLED:
+            self.hot_set.record(question_id, params)
+
+    def _is_leader(self):
+        """Whether this process runs the schedule; retried every tick in case the leader exited"""
+        if self._lock_file is not None:
+            return True
+        lock_file = open(SCHEDULER_LOCK_FILE, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info(f"Process {os.getpid()} is running the pre-render schedule")
+        return True
+
+    def _submit(self, key, name, render, entry=None):
+        with self._lock:
+            if key in self._in_flight:
+                logger.info(f"Pre-render of {name} is still running, skipping")
+                return False
+            self._in_flight.add(key)
+        self._executor.submit(self._render, key, name, render, entry)
+        return True
+
+    def _render(self, key, name, render, entry):
+        tokens = begin_request(None, f"prerender {name}")
+        start_time = time.time()
+        status = "succeeded"
+        try:
+            logger.info(f"Pre-rendering {name}...")
+            info = {}
+            render(info)
+            logger.info(f"Pre-rendered {name} in {time.time() - start_time:.2f} seconds "
+                        f"(cached: {info.get('cached', False)}, ready: {info.get('chart_ready')})")
+        except Exception as e:
+            status = f"failed: {e}"
+            logger.error(f"Pre-render of {name} failed: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
+                if status == "succeeded":
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                if entry is not None:
+                    entry.runs += 1
+                    if status != "succeeded":
+                        entry.failures += 1
+                    entry.last_run = start_time
+                    entry.last_status = status
+                    entry.last_duration = round(time.time() - start_time, 2)
+            end_request(tokens)
+
+    def run_entry(self, entry):
+        """Render one schedule entry now"""
+        params = entry.params
+        if entry.kind == "question":
+            def render(info):
+                self.service.capture_question_cached(question_id=entry.target, info=info, **params)
+        else:
+            def render(info):
+                self.service.capture_dashboard_cached(entry.target, info=info, **params)
+        return self._submit((entry.kind, entry.target, json.dumps(params, sort_keys=True)), entry.name, render, entry)
+
+    def refresh_hot(self):
+        """Re-render hot questions whose cached image is missing or older than HOT_REFRESH_AGE"""
+        submitted = 0
+        for params in self.hot_set.hot():
+            params = dict(params)
+            question_id = params.pop("question_id")
+            params.pop("requests")
+            age = self.service.cached_question_age(question_id, **{
+                key: params.get(key) for key in ("username", "password", "crop_to_chart", "renderer")
+            })
+            if age is not None and age < HOT_REFRESH_AGE:
+                continue
+            key = ("question", question_id, json.dumps(params, sort_keys=True, default=str))
+            # A render that could not be cached (chart never ready) is not retried every check
+            if time.time() - self._hot_attempts.get(key, 0) < HOT_REFRESH_AGE:
+                continue
+
+            def render(info, question_id=question_id, params=params):
+                self.service.capture_question_cached(question_id=question_id, info=info, **params)
+
+            if self._submit(key, f"hot question {question_id}", render):
+                self._hot_attempts[key] = time.time()
+                submitted += 1
+        cutoff = time.time() - HOT_REFRESH_AGE
+        for key in [key for key, attempted in self._hot_attempts.items() if attempted < cutoff]:
+            del self._hot_attempts[key]
+        if submitted:
+            with self._lock:
+                self.hot_refreshes += submitted
+            logger.info(f"Refreshing {submitted} hot questions in the background")
+        return submitted
+
+    def _due(self, now):
+        """Entries whose cron matched any minute since the last tick"""
+        start = self._last_tick or now
+        minute = start.replace(second=0, microsecond=0)
+        if self._last_tick is not None:
+            minute += timedelta(minutes=1)
+        due = []
+        # A late tick still fires minutes it slept through, up to an hour back
+        minute = max(minute, now.replace(second=0, microsecond=0) - timedelta(hours=1))
+        while minute <= now:
+            due.extend(entry for entry in self.entries if entry.cron.matches(minute) and entry not in due)
+            minute += timedelta(minutes=1)
+        self._last_tick = now
+        return due
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                now = datetime.now()
+                if self.entries and self._is_leader():
+                    for entry in self._due(now):
+                        self.run_entry(entry)
+                if HOT_SET_ENABLED and time.time() - self._last_hot_check >= HOT_CHECK_SECONDS:
+                    self._last_hot_check = time.time()
+                    self.refresh_hot()
+            except Exception as e:
+                logger.error(f"Pre-render scheduler tick failed: {e}")
+            self._stop.wait(SCHEDULER_TICK_SECONDS)
+
+    def close(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": [entry.to_dict() for entry in self.entries],
+                "leader": self._lock_file is not None,
+                "concurrency": self.concurrency,
+                "in_flight": len(self._in_flight),
+                "completed": self.completed,
+                "failed": self.failed,
+                "hot_refreshes": self.hot_refreshes,
+                "hot_set": self.hot_set.stats() if HOT_SET_ENABLED else None
+            }
@@ -0,0 +1,104 @@
+# session_cache.py
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Session cache configuration
+SESSION_COOKIE_NAME = "metabase.SESSION"
+SESSION_TTL_SECONDS = 6 * 60 * 60
+SESSION_LANDING_PATH = "/api/health"
+
+
+def credential_digest(username, password):
+    return hashlib.sha256(f"{username}\0{password}".encode()).hexdigest()
+
+
+class SessionCache:
+    """Per-username cache of Metabase session cookies with a TTL"""
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username, password):
+        """Return the cached cookie for these credentials, or None if missing or expired"""
+        with self._lock:
+            entry = self._sessions.get(username)
+            if not entry:
+                self.misses += 1
+                return None
+            if entry["digest"] != credential_digest(username, password) or entry["expires_at"] <= time.time():
+                del self._sessions[username]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entry["cookie"])
+
+    def store(self, username, password, cookie):
+        """Cache a session cookie, capped by the cookie's own expiry if it has one"""
+        expires_at = time.time() + self.ttl
+        if cookie.get("expiry"):
+            expires_at = min(expires_at, cookie["expiry"])
+        cookie = {key: cookie[key] for key in ("name", "value", "path", "secure", "httpOnly", "sameSite")
+                  if key in cookie}
+        cookie.setdefault("path", "/")
+        with self._lock:
+            self._sessions[username] = {
+                "cookie": cookie,
+                "digest": credential_digest(username, password),
+                "expires_at": expires_at
+            }
+        logger.info(f"Cached Metabase session for {username} ({int(expires_at - time.time())}s TTL)")
+        return dict(cookie)
+
+    def store_from_driver(self, driver, username, password):
+        """Read the session cookie from a freshly logged-in browser and cache it"""
+        cookie = driver.get_cookie(SESSION_COOKIE_NAME)
+        if not cookie:
+            logger.warning(f"No {SESSION_COOKIE_NAME} cookie found after login")
+            return False
+        self.store(username, password, cookie)
+        return True
+
+    def invalidate(self, username):
+        with self._lock:
+            if self._sessions.pop(username, None):
+                logger.info(f"Invalidated cached Metabase session for {username}")
+
+    def store_token(self, username, password, token):
+        """Cache a session token obtained from the session API"""
+        return self.store(username, password, {"name": SESSION_COOKIE_NAME, "value": token, "path": "/"})
+
+    def attach(self, driver, base_url, cookie):
+        """Set a session cookie on the browser for the Metabase origin"""
+        # Cookies can only be set for the domain currently loaded
+        driver.get(f"{base_url}{SESSION_LANDING_PATH}")
+        driver.add_cookie(cookie)
+
+    def inject(self, driver, base_url, username, password):
+        """Attach a cached session cookie to the browser instead of replaying the login form"""
+        cookie = self.get(username, password)
+        if not cookie:
+            return False
+        try:
+            self.attach(driver, base_url, cookie)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to inject cached session: {e}")
+            self.invalidate(username)
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "ttl_seconds": self.ttl
+            }
@@ -0,0 +1,380 @@
+# tab_engine.py
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from chart_ready import poll_chart_ready
+from metrics import (CAPTURE_FAILURES_TOTAL, CAPTURE_MODE_TOTAL, CAPTURES_TOTAL, FULL_PAGE_FALLBACKS_TOTAL,
+                     PhaseTimer)
+from popups import dismiss_popups
+from session_cache import credential_digest
+
+logger = logging.getLogger(__name__)
+
+# Tab engine configuration
+TAB_ENGINE_BROWSERS = 1
+TABS_PER_BROWSER = 6
+TAB_POLL_SECONDS = 0.1
+TAB_NAVIGATION_TIMEOUT = 30
+TAB_RELAUNCH_DELAY = 5
+TAB_RESULT_MARGIN = 60  # added to wait_seconds + TAB_NAVIGATION_TIMEOUT for queueing and login
+TAB_BROWSER_MAX_CAPTURES = 100  # recycle a browser after this many windows, as the driver pool does
+
+
+class BrowserLost(Exception):
+    """Raised when the browser behind a tab engine worker stops responding"""
+
+
+class TabCapture:
+    """One question capture running in its own window of a shared browser"""
+
+    def __init__(self, url, question_id, username, password, wait_seconds, crop_to_chart, info):
+        self.url = url
+        self.question_id = question_id
+        self.username = username
+        self.password = password
+        self.identity = credential_digest(username, password)
+        self.wait_seconds = wait_seconds
+        self.crop_to_chart = crop_to_chart
+        self.info = info
+        self.future = Future()
+        # Steps run on the worker thread but log and trace under the submitting request
+        self.context = contextvars.copy_context()
+        self.phases = PhaseTimer(info.setdefault("phase_timings", {}))
+        self.handle = None
+        self.deadline = None
+        self.loading_started = None
+        self.relogins = 0
+
+
+class TabEngine:
+    """Runs several captures concurrently in one logged-in browser, one window per capture.
+
+    Each worker thread owns a browser and multiplexes its windows: it opens a
+    window per capture, starts navigation without waiting for the load, then
+    cycles through the windows with a non-blocking readiness check and
+    captures each one as soon as its chart is stable. A browser carries one
+    Metabase session at a time, so captures for another user wait until the
+    browser's windows have drained.
+    """
+
+    def __init__(self, service, base_url, browsers=TAB_ENGINE_BROWSERS, tabs_per_browser=TABS_PER_BROWSER):
+        self.service = service
+        self.base_url = base_url
+        self.browsers = browsers
+        self.tabs_per_browser = tabs_per_browser
+        self._queue = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._active = {}
+        self._completed = 0
+        self._failed = 0
+        self._launches = 0
+
+    @property
+    def capacity(self):
+        return self.browsers * self.tabs_per_browser
+
+    def start(self):
+        with self._lock:
+            if self._workers or self._closed:
+                return
+            for i in range(self.browsers):
+                worker = threading.Thread(target=self._run, args=(i,), name=f"tab-engine-{i}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+        logger.info(f"Tab engine started: {self.browsers} browsers x {self.tabs_per_browser} windows")
+
+    def submit(self, question_id, username, password, wait_seconds=10, crop_to_chart=True, info=None):
+        """Queue a capture and return a Future resolving to its PNG bytes"""
+        if self._closed:
+            raise RuntimeError("Tab engine is closed")
+        self.start()
+        info = {} if info is None else info
+        info["phase"] = "queued"
+        task = TabCapture(f"{self.base_url}/question/{question_id}", question_id, username, password,
+                          wait_seconds, crop_to_chart, info)
+        self._queue.put(task)
+        return task.future
+
+    def capture(self, question_id, username, password, wait_seconds=10, crop_to_chart=True, info=None):
+        future = self.submit(question_id, username, password, wait_seconds, crop_to_chart, info)
+        timeout = wait_seconds + TAB_NAVIGATION_TIMEOUT + TAB_RESULT_MARGIN
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            # A queued task is skipped once cancelled; a running one finishes into a discarded future
+            future.cancel()
+            raise Exception(f"Tab capture of question {question_id} did not finish within {timeout} seconds")
+
+    # Worker side
+
+    def _next(self, block):
+        while True:
+            try:
+                task = self._queue.get(timeout=0.5) if block else self._queue.get_nowait()
+            except queue.Empty:
+                return None
+            if not task.future.cancelled():
+                return task
+
+    def _finish(self, task, result=None, error=None):
+        task.phases.stop(error)
+        if task.future.done():
+            # The caller gave up waiting and cancelled it
+            return
+        with self._lock:
+            if error is None:
+                self._completed += 1
+            else:
+                self._failed += 1
+        if error is None:
+            CAPTURES_TOTAL.inc(kind="tab", outcome="succeeded")
+            task.future.set_result(result)
+        else:
+            CAPTURE_FAILURES_TOTAL.inc(phase=task.info.get("phase"))
+            CAPTURES_TOTAL.inc(kind="tab", outcome="failed")
+            task.future.set_exception(error if isinstance(error, Exception) else Exception(str(error)))
+
+    def _launch(self):
+        with self._lock:
+            self._launches += 1
+        driver = self.service.create_driver()
+        return driver, driver.current_window_handle
+
+    def _close_window(self, driver, task, main_handle):
+        try:
+            driver.switch_to.window(task.handle)
+            driver.close()
+        except Exception as e:
+            logger.warning(f"Failed to close capture window: {e}")
+        try:
+            driver.switch_to.window(main_handle)
+        except Exception as e:
+            logger.warning(f"Failed to switch back to the main window: {e}")
+
+    def _login(self, driver, task, main_handle):
+        task.info["phase"] = "authentication"
+        task.phases.start("authentication")
+        driver.switch_to.window(main_handle)
+        return self.service.authenticate(driver, task.username, task.password)
+
+    def _open(self, driver, task):
+        """Open a window and start navigating without waiting for the page load"""
+        task.info["phase"] = "navigation"
+        task.phases.start("navigation")
+        logger.info(f"Opening window for question {task.question_id}: {task.url}")
+        driver.switch_to.new_window("window")
+        task.handle = driver.current_window_handle
+        driver.set_window_size(*self.service.viewport)
+        driver.execute_script("window.location.href = arguments[0];", task.url)
+        task.deadline = time.time() + TAB_NAVIGATION_TIMEOUT
+
+    def _step(self, driver, task, main_handle):
+        """Advance one capture by a single non-blocking check; returns True once it is finished"""
+        driver.switch_to.window(task.handle)
+        state = poll_chart_ready(driver)
+        now = time.time()
+
+        if "/auth/login" in (state.get("url") or ""):
+            if task.relogins:
+                raise Exception("Authentication failed")
+            logger.warning("  - Redirected to login page, cached session rejected")
+            task.relogins += 1
+            self.service.session_cache.invalidate(task.username)
+            if not self.service.authenticate(driver, task.username, task.password):
+                raise Exception("Authentication failed")
+            driver.execute_script("window.location.href = arguments[0];", task.url)
+            task.deadline = now + TAB_NAVIGATION_TIMEOUT
+            return False
+
+        if task.info["phase"] == "navigation":
+            if state.get("reason") == "loading":
+                if now >= task.deadline:
+                    raise Exception(f"Question page did not load within {TAB_NAVIGATION_TIMEOUT} seconds")
+                return False
+            task.info["phase"] = "chart_loading"
+            task.phases.start("chart_loading")
+            task.loading_started = now
+            task.deadline = now + task.wait_seconds
+
+        if not state.get("ready") and now < task.deadline:
+            return False
+
+        task.info["chart_ready"] = bool(state.get("ready"))
+        task.info["ready_time"] = round(now - task.loading_started, 3)
+        if task.info["chart_ready"]:
+            logger.info(f"  - Chart ready in {task.info['ready_time']:.2f} seconds (root: '{state.get('selector')}')")
+        else:
+            logger.warning(f"  - Chart not stable after {task.info['ready_time']:.2f} seconds "
+                           f"({state.get('reason')}), capturing anyway")
+
+        task.info["phase"] = "popup_dismissal"
+        task.phases.start("popup_dismissal")
+        dismiss_popups(driver)
+
+        task.info["phase"] = "capture"
+        task.phases.start("capture")
+        if task.crop_to_chart:
+            screenshot_png = self.service.capture_question_chart(driver, task.info)
+            if task.info.get("capture_mode") == "full_page":
+                FULL_PAGE_FALLBACKS_TOTAL.inc()
+        else:
+            task.info["capture_mode"] = "full_page"
+            screenshot_png = driver.get_screenshot_as_png()
+        CAPTURE_MODE_TOTAL.inc(mode=task.info["capture_mode"])
+
+        self._close_window(driver, task, main_handle)
+        logger.info(f"Question {task.question_id} captured in its window: {len(screenshot_png):,} bytes")
+        self._finish(task, screenshot_png)
+        return True
+
+    def _alive(self, driver):
+        try:
+            driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    def _run(self, index):
+        driver = None
+        main_handle = None
+        identity = None
+        active = []
+        deferred = None
+        opened = 0
+
+        while True:
+            if self._closed and not active:
+                break
+
+            if driver is not None and opened >= TAB_BROWSER_MAX_CAPTURES and not active:
+                logger.info(f"Tab engine browser {index} recycled after {opened} captures")
+                self._quit(driver)
+                driver = None
+
+            if driver is None:
+                try:
+                    driver, main_handle = self._launch()
+                    identity = None
+                    opened = 0
+                except Exception as e:
+                    logger.error(f"Tab engine browser {index} failed to launch: {e}")
+                    time.sleep(TAB_RELAUNCH_DELAY)
+                    continue
+
+            current = None
+            try:
+                # Fill free windows; a capture for another user waits until this browser drains,
+                # and a browser due for recycling takes no new captures
+                while len(active) < self.tabs_per_browser and not self._closed and opened < TAB_BROWSER_MAX_CAPTURES:
+                    task = current = deferred or self._next(block=not active)
+                    deferred = None
+                    if task is None:
+                        break
+                    if task.identity != identity:
+                        if active:
+                            deferred = task
+                            break
+                        try:
+                            logged_in = task.context.run(self._login, driver, task, main_handle)
+                        except Exception as e:
+                            if not self._alive(driver):
+                                active.append(task)
+                                raise BrowserLost(str(e))
+                            logger.error(f"Tab engine login failed: {e}")
+                            logged_in = False
+                        if not logged_in:
+                            identity = None
+                            task.context.run(self._finish, task, error=Exception("Authentication failed"))
+                            continue
+                        identity = task.identity
+                    opened += 1
+                    try:
+                        task.context.run(self._open, driver, task)
+                        active.append(task)
+                    except Exception as e:
+                        if not self._alive(driver):
+                            active.append(task)
+                            raise BrowserLost(str(e))
+                        task.context.run(self._finish, task, error=e)
+                current = None
+
+                for task in list(active):
+                    try:
+                        if task.context.run(self._step, driver, task, main_handle):
+                            active.remove(task)
+                    except Exception as e:
+                        if not self._alive(driver):
+                            raise BrowserLost(str(e))
+                        logger.error(f"Tab capture of question {task.question_id} failed during "
+                                     f"{task.info.get('phase')}: {e}")
+                        active.remove(task)
+                        if task.handle:
+                            self._close_window(driver, task, main_handle)
+                        task.context.run(self._finish, task, error=e)
+
+                with self._lock:
+                    self._active[index] = len(active)
+                if active:
+                    time.sleep(TAB_POLL_SECONDS)
+
+            except Exception as e:
+                # Anything unexpected leaves the browser in an unknown state: fail its captures and relaunch it
+                if isinstance(e, BrowserLost):
+                    logger.error(f"Tab engine browser {index} lost with {len(active)} captures in flight: {e}")
+                    error = Exception(f"Browser crashed: {e}")
+                else:
+                    logger.error(f"Tab engine browser {index} failed with {len(active)} captures in flight: {e}")
+                    error = Exception(f"Tab engine error: {e}")
+                for task in active + ([current] if current is not None and current not in active else []):
+                    task.context.run(self._finish, task, error=error)
+                active = []
+                self._quit(driver)
+                driver = None
+
+        if deferred:
+            self._finish(deferred, error=Exception("Tab engine is closed"))
+        if driver is not None:
+            self._quit(driver)
+        with self._lock:
+            self._active.pop(index, None)
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Tab engine browser quit failed: {e}")
+
+    def close(self, timeout=None):
+        """Let in-flight captures finish (up to timeout seconds), fail queued ones and quit the browsers"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers)
+        while True:
+            task = self._next(block=False)
+            if task is None:
+                break
+            self._finish(task, error=Exception("Tab engine is closed"))
+        deadline = time.time() + (TAB_NAVIGATION_TIMEOUT + 60 if timeout is None else timeout)
+        for worker in workers:
+            worker.join(timeout=max(0, deadline - time.time()))
+        logger.info("Tab engine closed")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "browsers": self.browsers,
+                "tabs_per_browser": self.tabs_per_browser,
+                "active_windows": sum(self._active.values()),
+                "queued": self._queue.qsize(),
+                "completed": self._completed,
+                "failed": self._failed,
+                "browser_launches": self._launches
+            }
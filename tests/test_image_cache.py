@@ -0,0 +1,54 @@
+import os
+import time
+
+import pytest
+
+from image_cache import ImageCache, cache_key
+from session_cache import credential_digest
+
+
+def test_cache_key_is_scoped_by_password():
+    alice = cache_key(1, True, (1280, 800), credential_digest("alice", "secret"))
+    guess = cache_key(1, True, (1280, 800), credential_digest("alice", "guess"))
+    assert alice != guess
+    assert alice == cache_key(1, True, (1280, 800), credential_digest("alice", "secret"))
+
+
+def test_cache_key_requires_an_identity():
+    with pytest.raises(ValueError):
+        cache_key(1, True, (1280, 800), None)
+
+
+def test_renderer_is_part_of_the_key():
+    identity = credential_digest("alice", "secret")
+    assert cache_key(1, True, (1000, 500), identity, "native") != cache_key(1, True, (1000, 500), identity)
+
+
+def test_get_respects_max_age(tmp_path):
+    cache = ImageCache(directory=str(tmp_path))
+    cache.put("k", b"png")
+    assert cache.get("k", max_age=60).data == b"png"
+    cache._entries["k"].created_at -= 120
+    assert cache.get("k", max_age=60) is None
+
+
+def test_put_prunes_the_disk_store(tmp_path, monkeypatch):
+    monkeypatch.setattr("image_cache.IMAGE_CACHE_PRUNE_INTERVAL", 0)
+    cache = ImageCache(directory=str(tmp_path), disk_max_bytes=10)
+    cache.put("old", b"x" * 8)
+    os.utime(tmp_path / "old.img", (time.time() - 30, time.time() - 30))
+    cache.put("new", b"y" * 8)
+    assert sorted(path.name for path in tmp_path.glob("*.img")) == ["new.img"]
+
+
+def test_lookup_prefers_a_newer_render_from_another_worker(tmp_path):
+    ours = ImageCache(directory=str(tmp_path))
+    theirs = ImageCache(directory=str(tmp_path))
+    ours.put("k", b"old")
+    ours._entries["k"].created_at -= 600
+    theirs.put("k", b"new")
+
+    entry = ours.peek("k")
+    assert entry.data == b"new"
+    assert entry.age < 60
+    assert ours.get("k", max_age=60).data == b"new"
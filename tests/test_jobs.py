@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JobManager, check_callback_url
+
+
+def wait_until_finished(manager, job, timeout=5):
+    deadline = time.time() + timeout
+    while not manager.get(job.id).finished:
+        assert time.time() < deadline, "job did not finish"
+        time.sleep(0.01)
+    return manager.get(job.id)
+
+
+@pytest.fixture
+def managers(tmp_path):
+    created = []
+
+    def make(capture, **kwargs):
+        kwargs.setdefault("directory", str(tmp_path))
+        manager = JobManager(capture, workers=1, **kwargs)
+        created.append(manager)
+        return manager
+
+    yield make
+    for manager in created:
+        manager.shutdown(wait=True)
+
+
+def test_callback_hosts_must_be_allowed(monkeypatch):
+    monkeypatch.setattr(jobs, "CALLBACK_ALLOWED_HOSTS", ["hooks.example.com", ".corp.example"])
+    assert check_callback_url("https://hooks.example.com/done") == "https://hooks.example.com/done"
+    assert check_callback_url("http://reports.corp.example/done")
+    for url in ("http://169.254.169.254/latest", "http://evilcorp.example/", "file:///etc/passwd", "hooks.example.com"):
+        with pytest.raises(ValueError):
+            check_callback_url(url)
+
+
+def test_any_manager_sharing_the_directory_sees_the_result(managers):
+    owner = managers(lambda info, **params: b"png-" + params["question_id"].encode())
+    job = wait_until_finished(owner, owner.submit({"question_id": "7", "password": "secret"}))
+    assert job.result == b"png-7"
+    assert job._result is None  # served from disk, not held in memory
+
+    other = managers(lambda info, **params: b"unused")
+    seen = other.get(job.id)
+    assert seen.state == "succeeded" and seen.result == b"png-7"
+    assert "password" not in seen.params
+    assert other.get("../../etc/passwd") is None
+
+
+def test_queued_jobs_are_handed_back_on_shutdown(managers):
+    started, release = threading.Event(), threading.Event()
+
+    def first(info, **params):
+        started.set()
+        release.wait(5)
+        return b"first"
+
+    owner = managers(first)
+    owner.submit({"question_id": "1"})
+    queued = owner.submit({"question_id": "2"})
+    # The single worker thread is busy with job 1, so job 2 is certainly still queued
+    assert started.wait(5)
+    owner.shutdown(wait=False, cancel_pending=True)
+    release.set()
+
+    successor = managers(lambda info, **params: b"adopted")
+    assert successor.adopt_orphans() == 1
+    assert wait_until_finished(successor, queued).result == b"adopted"
+
+
+def test_in_memory_results_are_bounded(managers, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RESULT_MAX_BYTES", 15)
+    manager = managers(lambda info, **params: b"x" * 10, directory=None)
+    first = wait_until_finished(manager, manager.submit({"question_id": "1"}))
+    second = wait_until_finished(manager, manager.submit({"question_id": "2"}))
+    manager.submit({"question_id": "3"})
+    assert first.result is None and second.result == b"x" * 10
+
+
+def test_a_running_job_is_never_handed_back(managers):
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def capture(info, **params):
+        runs.append(params["question_id"])
+        started.set()
+        release.wait(5)
+        return b"png"
+
+    owner = managers(capture)
+    job = owner.submit({"question_id": "1"})
+    assert started.wait(5)
+    owner.shutdown(wait=False, cancel_pending=True)
+
+    successor = managers(capture)
+    assert successor.adopt_orphans() == 0
+    assert successor.get(job.id).state == "running"
+    release.set()
+    assert wait_until_finished(owner, job).state == "succeeded"
+    assert runs == ["1"]
+
+
+def test_passwords_are_not_written_to_the_job_directory(managers, tmp_path):
+    release = threading.Event()
+    owner = managers(lambda info, **params: release.wait(5) and b"png")
+    owner.submit({"question_id": "1"})
+    job = owner.submit({"question_id": "2", "username": "alice", "password": "secret"})
+    assert "secret" not in (tmp_path / f"{job.id}.json").read_text()
+
+    # Its worker exits before running it; nobody else has the password, so it fails instead of moving
+    owner.shutdown(wait=False, cancel_pending=True)
+    release.set()
+    successor = managers(lambda info, **params: b"unused")
+    assert successor.adopt_orphans() == 0
+    assert successor.get(job.id).state == "failed"
+
+
+def test_phase_changes_reach_other_workers(managers):
+    in_navigation, release = threading.Event(), threading.Event()
+
+    def capture(info, **params):
+        info["phase"] = "navigation"
+        in_navigation.set()
+        release.wait(5)
+        return b"png"
+
+    owner = managers(capture)
+    job = owner.submit({"question_id": "1"})
+    assert in_navigation.wait(5)
+    assert managers(capture).get(job.id).to_dict()["phase"] == "navigation"
+    release.set()
+    wait_until_finished(owner, job)
@@ -0,0 +1,172 @@
+# test_native_render.py
+import io
+
+import pytest
+
+import native_render
+from metabase_api import MetabaseAPIClient, result_fingerprint
+from native_render import NativeUnsupported, chart_spec, draw_table, draw_xy_chart, nice_ticks
+
+Image = pytest.importorskip("PIL.Image")
+
+COLS = [
+    {"name": "month", "display_name": "Month", "base_type": "type/Text"},
+    {"name": "count", "display_name": "Count", "base_type": "type/Integer"}
+]
+
+
+def result(rows, cols=COLS):
+    return {"data": {"cols": cols, "rows": rows}}
+
+
+def spec_for(display, rows, settings=None, cols=COLS):
+    return chart_spec({"display": display, "name": "Orders", "visualization_settings": settings or {}},
+                      result(rows, cols))
+
+
+def png_size(png):
+    image = Image.open(io.BytesIO(png))
+    return image.size
+
+
+# chart_spec
+
+def test_chart_spec_uses_first_column_as_dimension_and_numeric_columns_as_series():
+    spec = spec_for("line", [["a", 1], ["b", 2]])
+    assert spec["x"] == ["a", "b"]
+    assert spec["x_label"] == "Month"
+    assert spec["series"] == [{"name": "Count", "values": [1, 2]}]
+
+
+def test_chart_spec_honours_graph_settings():
+    cols = COLS + [{"name": "total", "display_name": "Total", "base_type": "type/Float"}]
+    spec = spec_for("bar", [["a", 1, 2.5]], {"graph.dimensions": ["month"], "graph.metrics": ["total"]}, cols)
+    assert [s["name"] for s in spec["series"]] == ["Total"]
+
+
+def test_chart_spec_table_keeps_enabled_columns_only():
+    spec = spec_for("table", [["a", 1]], {"table.columns": [{"name": "count", "enabled": True},
+                                                            {"name": "month", "enabled": False}]})
+    assert spec["columns"] == ["Count"]
+    assert spec["rows"] == [[1]]
+    assert spec["numeric"] == [True]
+
+
+@pytest.mark.parametrize("display, settings", [
+    ("pie", {}),
+    ("bar", {"stackable.stack_type": "stacked"}),
+    ("line", {"graph.y_axis.scale": "log"}),
+    ("line", {"graph.dimensions": ["month", "count"]})
+])
+def test_chart_spec_rejects_what_the_browser_must_draw(display, settings):
+    with pytest.raises(NativeUnsupported):
+        spec_for(display, [["a", 1]], settings)
+
+
+def test_chart_spec_rejects_too_many_bars():
+    with pytest.raises(NativeUnsupported):
+        spec_for("bar", [[str(i), i] for i in range(native_render.NATIVE_MAX_BARS + 1)])
+
+
+# nice_ticks
+
+@pytest.mark.parametrize("low, high", [
+    (0, 950), (50, 950), (-3.2, 7.7), (0, 0), (5, 5), (-4, -4),
+    (1e-12, 2e-12), (1e-12, 1e-12), (-1e300, 1e300), (0, 1e300), (0.1, 0.3)
+])
+def test_nice_ticks_cover_the_range_with_distinct_ascending_values(low, high):
+    ticks = nice_ticks(low, high)
+    assert len(ticks) >= 2
+    assert ticks == sorted(set(ticks))
+    assert ticks[0] <= low and ticks[-1] >= high
+
+
+def test_nice_ticks_are_round():
+    assert nice_ticks(50, 950) == [0, 200, 400, 600, 800, 1000]
+
+
+def test_nice_ticks_reject_non_finite_ranges():
+    with pytest.raises(ValueError):
+        nice_ticks(0, float("inf"))
+    with pytest.raises(ValueError):
+        nice_ticks(-1.7e308, 1.7e308)
+
+
+# draw_*
+
+@pytest.mark.parametrize("rows", [
+    [["a", 5], ["b", 0]],
+    [["a", 1000], ["b", 1]],
+    [["a", 0], ["b", 0]],
+    [["a", -5], ["b", 3]],
+    [["a", None], ["b", 2]],
+    [["a", 1e-12], ["b", 2e-12]],
+    [["a", 1e300], ["b", -1e300]],
+    [["a", 7]]
+])
+@pytest.mark.parametrize("display", ["bar", "line"])
+def test_draw_xy_chart_handles_edge_values(display, rows):
+    png = draw_xy_chart(spec_for(display, rows), 400, 200)
+    assert png_size(png) == (400, 200)
+
+
+def test_draw_xy_chart_with_no_rows():
+    assert png_size(draw_xy_chart(spec_for("line", []), 400, 200)) == (400, 200)
+
+
+def test_draw_table_shrinks_to_its_content_and_notes_truncation():
+    rows = [[f"row {i}", i] for i in range(native_render.NATIVE_TABLE_MAX_ROWS + 5)]
+    spec = spec_for("table", rows)
+    width, height = png_size(draw_table(spec, 1000))
+    assert width < 1000
+    assert spec["row_count"] > len(spec["rows"])
+
+
+# NativeRenderer
+
+class FakeAPI:
+    def __init__(self, card, result):
+        self.card = card
+        self.result = result
+        self.queries = 0
+
+    def get_card(self, card_id, session_token):
+        return self.card
+
+    def query_card(self, card_id, session_token):
+        self.queries += 1
+        return self.result
+
+
+def test_renderer_skips_the_query_for_unsupported_displays():
+    api = FakeAPI({"display": "pie"}, None)
+    with pytest.raises(NativeUnsupported):
+        native_render.NativeRenderer(api).render("1", "token")
+    assert api.queries == 0
+
+
+def test_renderer_turns_drawing_errors_into_fallbacks(monkeypatch):
+    def broken(*args, **kwargs):
+        raise ValueError("unexpected")
+
+    monkeypatch.setattr(native_render, "draw_xy_chart", broken)
+    api = FakeAPI({"display": "bar", "name": "Orders"}, result([["a", 1]]))
+    with pytest.raises(NativeUnsupported) as error:
+        native_render.NativeRenderer(api).render("1", "token")
+    assert error.value.display == "bar"
+    # The fallback fingerprints what was already fetched instead of querying again
+    assert error.value.result is api.result and api.queries == 1
+
+
+def test_fallback_fingerprint_matches_a_fresh_one():
+    card, query = {"display": "bar", "updated_at": "2026-10-01"}, result([["a", 1]])
+    api = FakeAPI(card, query)
+    assert MetabaseAPIClient.card_fingerprint(api, "1", "token") == result_fingerprint(card, query)
+
+
+def test_renderer_reports_native_capture_info():
+    api = FakeAPI({"display": "bar", "name": "Orders"}, result([["a", 5], ["b", 0]]))
+    info = {}
+    png = native_render.NativeRenderer(api, 400, 200).render("1", "token", info)
+    assert png_size(png) == (400, 200)
+    assert info["renderer"] == "native" and info["chart_ready"] is True
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from scheduler import CronSchedule, HotSet, PrerenderScheduler, ScheduledRender
+
+
+def test_hot_set_keeps_each_callers_credentials():
+    hot_set = HotSet(min_requests=2)
+    for _ in range(2):
+        hot_set.record(7, {"username": "alice", "password": "secret"})
+    hot_set.record(7, {"username": "alice", "password": "wrong"})
+
+    hot = hot_set.hot()
+    assert [params["password"] for params in hot] == ["secret"]
+    assert hot[0]["requests"] == 2
+
+
+@pytest.mark.parametrize("expression,minutes", [
+    ("*/15 * * * *", {0, 15, 30, 45}),
+    ("5/15 * * * *", {5, 20, 35, 50}),
+    ("10-20/5 * * * *", {10, 15, 20}),
+    ("1,2,58 * * * *", {1, 2, 58}),
+])
+def test_cron_minute_fields(expression, minutes):
+    assert CronSchedule(expression).fields[0] == minutes
+
+
+@pytest.mark.parametrize("expression", ["* * *", "60 * * * *", "5-1 * * * *", "*/0 * * * *", "x * * * *"])
+def test_invalid_cron_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_cron_matches_minute_hour_and_month():
+    schedule = CronSchedule("30 7-9 * 1,6 *")
+    assert schedule.matches(datetime(2026, 6, 2, 8, 30))
+    assert not schedule.matches(datetime(2026, 6, 2, 10, 30))
+    assert not schedule.matches(datetime(2026, 6, 2, 8, 31))
+    assert not schedule.matches(datetime(2026, 7, 2, 8, 30))
+
+
+def test_cron_restricted_day_and_weekday_match_either():
+    # The 13th of the month or any Friday
+    schedule = CronSchedule("0 0 13 * 5")
+    assert schedule.matches(datetime(2026, 10, 13, 0, 0))  # Tuesday the 13th
+    assert schedule.matches(datetime(2026, 10, 16, 0, 0))  # Friday the 16th
+    assert not schedule.matches(datetime(2026, 10, 14, 0, 0))
+
+
+def test_cron_wildcard_day_requires_weekday():
+    weekdays = CronSchedule("0 9 * * 1-5")
+    assert weekdays.matches(datetime(2026, 10, 16, 9, 0))  # Friday
+    assert not weekdays.matches(datetime(2026, 10, 18, 9, 0))  # Sunday
+    sundays = CronSchedule("0 9 * * 7")
+    assert sundays.matches(datetime(2026, 10, 18, 9, 0))
+
+
+def test_cron_aliases():
+    assert CronSchedule("@daily").matches(datetime(2026, 10, 18, 0, 0))
+    assert not CronSchedule("@hourly").matches(datetime(2026, 10, 18, 3, 1))
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(*crons):
+        entries = [ScheduledRender(index, {"cron": cron, "question_id": index}) for index, cron in enumerate(crons)]
+        scheduler = PrerenderScheduler(service=None, entries=entries)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.close()
+
+
+def test_due_fires_each_minute_once(make_scheduler):
+    scheduler = make_scheduler("*/5 * * * *")
+    start = datetime(2026, 10, 18, 10, 0, 20)
+    assert [entry.target for entry in scheduler._due(start)] == ["0"]
+    assert scheduler._due(start + timedelta(seconds=15)) == []
+    assert scheduler._due(start + timedelta(minutes=1)) == []
+
+
+def test_due_catches_up_on_missed_minutes(make_scheduler):
+    scheduler = make_scheduler("*/5 * * * *", "7 * * * *", "30 * * * *")
+    scheduler._due(datetime(2026, 10, 18, 10, 1, 0))
+    # The tick slept through 10:05, 10:07 and 10:10; each entry fires once
+    due = scheduler._due(datetime(2026, 10, 18, 10, 12, 5))
+    assert [entry.target for entry in due] == ["0", "1"]
+
+
+def test_due_catch_up_is_limited_to_an_hour(make_scheduler):
+    scheduler = make_scheduler("0 11 * * *", "0 13 * * *")
+    scheduler._due(datetime(2026, 10, 18, 9, 59, 0))
+    due = scheduler._due(datetime(2026, 10, 18, 13, 30, 0))
+    assert [entry.target for entry in due] == ["1"]
@@ -0,0 +1,135 @@
+import time
+
+import pytest
+
+import tab_engine
+from tab_engine import TabEngine
+
+
+class FakeSwitch:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        if handle == "main" and self.driver.fail_main_switches:
+            self.driver.fail_main_switches -= 1
+            raise RuntimeError("no such window")
+        self.driver.current_window_handle = handle
+
+    def new_window(self, kind):
+        self.driver.windows += 1
+        self.driver.current_window_handle = f"window-{self.driver.windows}"
+
+
+class FakeDriver:
+    def __init__(self):
+        self.current_window_handle = "main"
+        self.switch_to = FakeSwitch(self)
+        self.windows = 0
+        self.fail_main_switches = 0
+        self.quit_called = False
+        self.window_handles = ["main"]
+
+    def execute_script(self, script, *args):
+        if "window.location.href" in script:
+            return None
+        return {"ready": True, "url": "http://metabase/question/1", "dismissed": []}
+
+    def set_window_size(self, width, height):
+        pass
+
+    def get_screenshot_as_png(self):
+        return b"png-" + self.current_window_handle.encode()
+
+    def close(self):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeService:
+    viewport = (800, 600)
+
+    def __init__(self, login_delay=0):
+        self.drivers = []
+        self.login_delay = login_delay
+
+    def create_driver(self):
+        driver = FakeDriver()
+        self.drivers.append(driver)
+        return driver
+
+    def authenticate(self, driver, username, password):
+        time.sleep(self.login_delay)
+        return True
+
+
+@pytest.fixture
+def engine():
+    engines = []
+
+    def make(service, **kwargs):
+        created = TabEngine(service, "http://metabase", browsers=1, tabs_per_browser=2, **kwargs)
+        engines.append(created)
+        return created
+
+    yield make
+    for created in engines:
+        created.close(timeout=5)
+
+
+def capture(engine, question_id=1):
+    return engine.capture(question_id, "alice", "secret", wait_seconds=1, crop_to_chart=False)
+
+
+def test_a_failed_switch_back_does_not_stop_the_worker(engine):
+    service = FakeService()
+    tabs = engine(service)
+    assert capture(tabs).startswith(b"png-")
+    service.drivers[0].fail_main_switches = 1
+    assert capture(tabs).startswith(b"png-")
+    assert capture(tabs).startswith(b"png-")
+
+
+def test_unexpected_errors_fail_the_active_captures_and_relaunch(engine, monkeypatch):
+    service = FakeService()
+    tabs = engine(service)
+    assert capture(tabs)
+
+    def broken_step(driver, task, main_handle):
+        raise RuntimeError("window vanished")
+
+    def broken_alive(driver):
+        raise RuntimeError("probe failed")
+
+    monkeypatch.setattr(tabs, "_step", broken_step)
+    monkeypatch.setattr(tabs, "_alive", broken_alive)
+    with pytest.raises(Exception, match="Tab engine error"):
+        capture(tabs)
+    monkeypatch.undo()
+    assert capture(tabs)
+    assert len(service.drivers) == 2 and service.drivers[0].quit_called
+
+
+def test_browsers_are_recycled_after_max_captures(engine, monkeypatch):
+    monkeypatch.setattr(tab_engine, "TAB_BROWSER_MAX_CAPTURES", 2)
+    service = FakeService()
+    tabs = engine(service)
+    for question_id in range(5):
+        assert capture(tabs, question_id)
+    assert len(service.drivers) == 3
+    assert all(driver.quit_called for driver in service.drivers[:2])
+
+
+def test_capture_times_out_instead_of_waiting_forever(engine, monkeypatch):
+    monkeypatch.setattr(tab_engine, "TAB_NAVIGATION_TIMEOUT", 0)
+    monkeypatch.setattr(tab_engine, "TAB_RESULT_MARGIN", 0.2)
+    tabs = engine(FakeService(login_delay=1))
+    started = time.time()
+    with pytest.raises(Exception, match="did not finish"):
+        tabs.capture(1, "alice", "secret", wait_seconds=0, crop_to_chart=False)
+    assert time.time() - started < 1
+    # The late result lands in the cancelled future without killing the worker
+    time.sleep(1.2)
+    assert all(worker.is_alive() for worker in tabs._workers)
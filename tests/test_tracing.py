@@ -0,0 +1,52 @@
+from contextlib import nullcontext
+
+import pytest
+
+from metrics import PhaseTimer
+from tracing import begin_request, end_request, span
+
+
+def test_phase_spans_are_recorded_in_order():
+    tokens = begin_request("req-ok", "capture")
+    timings = {}
+    with PhaseTimer(timings) as phases:
+        phases.start("navigation")
+        phases.start("capture")
+    root = end_request(tokens, write=False)
+
+    assert [child.name for child in root.children] == ["phase.navigation", "phase.capture"]
+    assert all(child.ended is not None and child.error is None for child in root.children)
+    assert set(timings) == {"navigation", "capture"}
+
+
+def test_failing_phase_does_not_swallow_later_spans():
+    tokens = begin_request("req-batch", "batch")
+    for question_id, fail in ((1, True), (2, False)):
+        with pytest.raises(RuntimeError) if fail else nullcontext():
+            with PhaseTimer({}) as phases:
+                phases.start("navigation")
+                if fail:
+                    raise RuntimeError(f"question {question_id} did not load")
+                phases.start("capture")
+        with span("encode", question_id=question_id):
+            pass
+    root = end_request(tokens, write=False)
+
+    names = [child.name for child in root.children]
+    assert names == ["phase.navigation", "encode", "phase.navigation", "phase.capture", "encode"]
+    failed = root.children[0]
+    assert failed.error == "question 1 did not load"
+    assert failed.children == []
+    assert all(child.ended is not None for child in root.children)
+
+
+def test_stop_with_error_marks_the_phase_span():
+    tokens = begin_request("req-tab", "tab")
+    phases = PhaseTimer({})
+    phases.start("chart_loading")
+    phases.stop(Exception("Browser crashed"))
+    phases.stop()
+    root = end_request(tokens, write=False)
+
+    assert root.children[0].error == "Browser crashed"
+
@@ -0,0 +1,217 @@
+# tracing.py
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Tracing configuration
+TRACE_FILE = None  # e.g. "traces.jsonl" to append every capture trace as one JSON line
+TRACE_MAX_SPANS = 5000
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+_request_id = contextvars.ContextVar("request_id", default="-")
+_current_span = contextvars.ContextVar("current_span", default=None)
+_file_lock = threading.Lock()
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp every log record with the request ID of the context that emitted it"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+def install_log_filter():
+    """Add the request ID filter to every root handler so %(request_id)s works in formats"""
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
+
+
+class Span:
+    """One timed operation in a capture's trace tree"""
+
+    def __init__(self, name, attrs=None, root=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.ended = None
+        self.error = None
+        self.children = []
+        self.root = root or self
+        self._lock = threading.Lock() if root is None else root._lock
+        self._count = 1 if root is None else None
+
+    def child(self, name, attrs=None):
+        span = Span(name, attrs, self.root)
+        with self._lock:
+            if self.root._count >= TRACE_MAX_SPANS:
+                return None
+            self.root._count += 1
+            self.children.append(span)
+        return span
+
+    def finish(self, error=None):
+        """End this span and any descendants a failure left open"""
+        if self.ended is not None:
+            return
+        self.ended = time.perf_counter()
+        if error is not None:
+            self.error = str(error)
+        for child in list(self.children):
+            if child.ended is None:
+                child.finish(error="abandoned")
+
+    @property
+    def duration_ms(self):
+        return round(((self.ended or time.perf_counter()) - self.started) * 1000, 2)
+
+    def to_dict(self, origin=None):
+        origin = self.started if origin is None else origin
+        span = {
+            "name": self.name,
+            "start_ms": round((self.started - origin) * 1000, 2),
+            "duration_ms": self.duration_ms
+        }
+        if self.attrs:
+            span["attrs"] = self.attrs
+        if self.error:
+            span["error"] = self.error
+        if self.ended is None:
+            span["open"] = True
+        with self._lock:
+            children = list(self.children)
+        if children:
+            span["children"] = [child.to_dict(origin) for child in children]
+        return span
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block as a child of the current span; a no-op outside a traced request"""
+    parent = _current_span.get()
+    current = parent.child(name, attrs) if parent is not None else None
+    if current is None:
+        yield None
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.finish(error=e)
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+
+
+def begin_request(request_id=None, name="request", **attrs):
+    """Bind a request ID and a root span to the current context; returns tokens for end_request"""
+    if not request_id or not _REQUEST_ID_PATTERN.match(str(request_id)):
+        request_id = new_request_id()
+    root = Span(name, dict(attrs, request_id=request_id))
+    return _request_id.set(request_id), _current_span.set(root), root
+
+
+def end_request(tokens, write=True):
+    """Close the root span, append it to TRACE_FILE when configured, and unbind the context"""
+    id_token, span_token, root = tokens
+    root.finish()
+    if write and TRACE_FILE and root.children:
+        write_trace(trace_dict(root))
+    _current_span.reset(span_token)
+    _request_id.reset(id_token)
+    return root
+
+
+def current_trace():
+    """Trace of the request bound to this context so far, or None outside a traced request"""
+    span = _current_span.get()
+    return trace_dict(span.root) if span is not None else None
+
+
+def webdriver_summary(root):
+    """Count and total time per WebDriver command, slowest first"""
+    totals = {}
+    stack = [root]
+    while stack:
+        span = stack.pop()
+        stack.extend(span.children)
+        if span.name.startswith("webdriver."):
+            command = span.name[len("webdriver."):]
+            count, total = totals.get(command, (0, 0.0))
+            totals[command] = (count + 1, total + span.duration_ms)
+    return [{"command": command, "count": count, "total_ms": round(total, 2)}
+            for command, (count, total) in sorted(totals.items(), key=lambda item: -item[1][1])]
+
+
+def trace_dict(root):
+    return {
+        "request_id": root.attrs.get("request_id"),
+        "timestamp": root.started_at,
+        "duration_ms": root.duration_ms,
+        "webdriver": webdriver_summary(root),
+        "root": root.to_dict()
+    }
+
+
+def write_trace(trace, path=None):
+    path = path or TRACE_FILE
+    try:
+        line = json.dumps(trace, default=str)
+        with _file_lock, open(path, "a") as f:
+            f.write(line + "\n")
+    except Exception as e:
+        logger.warning(f"Failed to write trace to {path}: {e}")
+
+
+def instrument_driver(driver):
+    """Record every WebDriver command as a span by wrapping the driver's single execute() funnel"""
+    original = driver.execute
+
+    def execute(driver_command, params=None):
+        if _current_span.get() is None:
+            return original(driver_command, params)
+        with span(f"webdriver.{driver_command}"):
+            return original(driver_command, params)
+
+    driver.execute = execute
+    return driver
+
+
+def in_context(iterable, name=None):
+    """Iterate a streamed response body inside the request's context, optionally as its own traced root"""
+    # Copied now, while the request is still bound; the body is iterated after the request context is gone
+    ctx = contextvars.copy_context()
+    tokens = ctx.run(begin_request, _request_id.get(), name) if name else None
+
+    def generate():
+        iterator = iter(iterable)
+        try:
+            while True:
+                try:
+                    item = ctx.run(next, iterator)
+                except StopIteration:
+                    return
+                yield item
+        finally:
+            if tokens:
+                ctx.run(end_request, tokens)
+
+    return generate()